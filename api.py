@@ -0,0 +1,410 @@
+"""API HTTP/JSON (asyncio, apenas biblioteca padrão) sobre as funções do back.py.
+
+Rotas (todas GET):
+    /saude
+    /produtos
+    /produtores?lat=..&lon=..&raio=..[&produtos=A&produtos=B][&sazonalidade=1][&limite=100]
+    /produtores/filtro?[todos=A&todos=B][&algum=C][&estacao=Verão][&limite=100]
+    /produtores/proximos?lat=..&lon=..[&k=20][&raio=..][&produtos=A][&sazonalidade=1]
+    /produtores/<id>?[cursor=..][&tamanho=20]
+    /usuarios/<id>/recomendacoes?[quantidade=10][&motor=knn|item|mf][&lat=..&lon=..&raio=..][&produtos=A][&sazonalidade=1]
+    /usuarios/<id>/avaliacoes
+    /metricas            (texto do Prometheus)
+    /metricas/json
+
+Com INSTRUMENTACAO=1 cada requisição roda em um escopo de instrumentacao.py:
+a resposta traz um cabeçalho Server-Timing (tempo total, tempo e número de
+consultas SQL, linhas lidas) e os totais por rota ficam em /metricas.
+
+O laço asyncio só lê e escreve nos sockets; o trabalho bloqueante (SQLite,
+índices, modelo KNN) roda em um pool de TRABALHADORES_API threads que
+compartilham a engine (pool de conexões) do back.py. Requisições além de
+LIMITE_FILA_API esperando uma thread recebem 503 em vez de acumular.
+
+Metas de latência na base de benchmark "media", medidas com `python api.py
+carga` (mistura de rotas, cliente e servidor no mesmo host de 1 núcleo):
+
+    conexões   meta p99   medido (SQLite)           medido (CAMINHO_CATALOGO)
+    10         250 ms     150 ms, 185 req/s         76 ms, 308 req/s
+    50         1 s        519 ms, 182 req/s
+    200        2 s        1,46 s, 190 req/s         1,09 s, 287 req/s
+
+Com 200 conexões as 5000 requisições são atendidas sem erros nem 503,
+mas a latência é fila: cerca de conexões / vazão. Um p99 abaixo de 250 ms
+com 200 conexões exigiria ~5x a vazão de um núcleo, ou seja, mais núcleos
+ou mais processos atrás de um balanceador.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qs, urlsplit
+
+import back
+import instrumentacao
+import numpy as np
+
+TRABALHADORES = int(os.environ.get("TRABALHADORES_API", 8))
+LIMITE_FILA = int(os.environ.get("LIMITE_FILA_API", 1000))
+TAMANHO_MAXIMO_CABECALHO = 16 * 1024
+LIMITE_PADRAO, LIMITE_MAXIMO = 100, 1000  # produtores por resposta nas rotas de busca
+
+STATUS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+          431: "Request Header Fields Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class ErroHTTP(Exception):
+    """Erro que vira uma resposta JSON {"erro": mensagem} com o status dado."""
+
+    def __init__(self, status: int, mensagem: str):
+        super().__init__(mensagem)
+        self.status = status
+        self.mensagem = mensagem
+
+
+# ================= serialização =================
+def produtor_para_dict(produtor) -> dict:
+    return {
+        "id": produtor.id,
+        "nome": produtor.nome,
+        "sigla": produtor.sigla,
+        "logradouro": produtor.logradouro,
+        "lat": produtor.lat,
+        "lon": produtor.lon,
+        "nota": produtor.nota,
+    }
+
+def produto_para_dict(produto) -> dict:
+    return {
+        "id": produto.id,
+        "nome": produto.nome,
+        "sazonalidade": produto.sazonalidade,
+        "descricao": produto.descricao,
+        "kcal_por_100g": produto.kcal_por_100g,
+        "preco_por_100g": produto.preco_por_100g,
+    }
+
+
+# ================= parâmetros =================
+def _numero(parametros: dict, nome: str, tipo=float, padrao=None):
+    """Converte o primeiro valor do parâmetro; 400 se faltar, não for número ou não for finito (nan, inf)."""
+    valores = parametros.get(nome)
+    if not valores:
+        if padrao is None:
+            raise ErroHTTP(400, f"parâmetro obrigatório: {nome}")
+        return padrao
+    try:
+        valor = tipo(valores[0])
+    except ValueError:
+        raise ErroHTTP(400, f"parâmetro inválido: {nome}")
+    if not math.isfinite(valor):
+        raise ErroHTTP(400, f"parâmetro inválido: {nome}")
+    return valor
+
+def _limite(parametros: dict) -> int:
+    return max(0, min(_numero(parametros, "limite", int, LIMITE_PADRAO), LIMITE_MAXIMO))
+
+def _lista(parametros: dict, nome: str) -> list[str] | None:
+    """Aceita tanto ?p=A&p=B quanto ?p=A,B; None se o parâmetro não foi enviado."""
+    if nome not in parametros:
+        return None
+    return [item for valor in parametros[nome] for item in valor.split(",") if item]
+
+
+# ================= rotas (rodam no pool de threads) =================
+def rota_saude(parametros: dict) -> dict:
+    return {"status": "ok"}
+
+def rota_produtos(parametros: dict) -> list:
+    return back.get_produtos()
+
+def rota_busca(parametros: dict) -> list:
+    lat, lon = _numero(parametros, "lat"), _numero(parametros, "lon")
+    raio = _numero(parametros, "raio", padrao=25.0)
+    produtores = back.filtrar_produtores(
+        lat, lon, raio, preferencia=_lista(parametros, "produtos"),
+        sazonalidade=parametros.get("sazonalidade", ["0"])[0] in ("1", "true"),
+        limite=_limite(parametros),
+    )
+    return [produtor_para_dict(produtor) for produtor in produtores]
+
+def rota_proximos(parametros: dict) -> list:
+    lat, lon = _numero(parametros, "lat"), _numero(parametros, "lon")
+    k = max(0, min(_numero(parametros, "k", int, 20), LIMITE_MAXIMO))
+    raio = _numero(parametros, "raio") if "raio" in parametros else None
+    proximos = back.produtores_mais_proximos(
+        lat, lon, k, raio=raio, preferencia=_lista(parametros, "produtos"),
+        sazonalidade=parametros.get("sazonalidade", ["0"])[0] in ("1", "true"),
+    )
+    return [dict(produtor_para_dict(produtor), distancia_km=distancia) for produtor, distancia in proximos]
+
+def rota_filtro_produtos(parametros: dict) -> list:
+    estacao = parametros.get("estacao", [None])[0]
+    produtores = back.filtro_produtos(_lista(parametros, "todos"), _lista(parametros, "algum"), estacao,
+                                      limite=_limite(parametros))
+    return [produtor_para_dict(produtor) for produtor in produtores]
+
+def rota_produtor(parametros: dict, produtor_id: str) -> dict:
+    cursor = _numero(parametros, "cursor", int) if "cursor" in parametros else None
+    detalhes = back.get_detalhes_produtor(
+        int(produtor_id), apos_avaliacao_id=cursor,
+        tamanho_pagina=max(1, min(_numero(parametros, "tamanho", int, 20), 100)),
+    )
+    if detalhes is None:
+        raise ErroHTTP(404, f"produtor {produtor_id} não encontrado")
+    return {
+        "produtor": produtor_para_dict(detalhes["produtor"]),
+        "produtos": [produto_para_dict(produto) for produto in detalhes["produtos"]],
+        "avaliacoes": [{"usuario": nome, "nota": nota} for nome, nota in detalhes["avaliacoes"]],
+        "proximo_cursor": detalhes["proximo_cursor"],
+        "resumo": detalhes["resumo"],
+    }
+
+def rota_recomendacoes(parametros: dict, usuario_id: str) -> list:
+    quantidade = max(1, min(_numero(parametros, "quantidade", int, 10), 100))
+    motor = parametros.get("motor", [back.MOTOR_RECOMENDACAO])[0]
+    if motor not in back.MOTORES_RECOMENDACAO:
+        raise ErroHTTP(400, f"parâmetro inválido: motor (use um de {list(back.MOTORES_RECOMENDACAO)})")
+    # raio (com lat/lon), produtos e sazonalidade restringem os candidatos, como em /produtores
+    raio = _numero(parametros, "raio") if "raio" in parametros else None
+    lat, lon = (_numero(parametros, "lat"), _numero(parametros, "lon")) if raio is not None else (None, None)
+    produtores = back.recomendar_produtores(
+        quantidade, usuario_id=int(usuario_id), motor=motor, user_lat=lat, user_lon=lon, raio=raio,
+        preferencia=_lista(parametros, "produtos"),
+        sazonalidade=parametros.get("sazonalidade", ["0"])[0] in ("1", "true"),
+    )
+    return [produtor_para_dict(produtor) for produtor in produtores]
+
+def rota_avaliacoes_usuario(parametros: dict, usuario_id: str) -> dict:
+    return back.get_avaliacoes_usuario(int(usuario_id))
+
+def rota_metricas(parametros: dict) -> str:
+    return instrumentacao.exportar_prometheus()
+
+def rota_metricas_json(parametros: dict) -> dict:
+    return instrumentacao.exportar_json()
+
+ROTAS = [
+    (re.compile(r"/saude"), rota_saude),
+    (re.compile(r"/produtos"), rota_produtos),
+    (re.compile(r"/produtores"), rota_busca),
+    (re.compile(r"/produtores/filtro"), rota_filtro_produtos),
+    (re.compile(r"/produtores/proximos"), rota_proximos),
+    (re.compile(r"/produtores/(\d+)"), rota_produtor),
+    (re.compile(r"/usuarios/(\d+)/recomendacoes"), rota_recomendacoes),
+    (re.compile(r"/usuarios/(\d+)/avaliacoes"), rota_avaliacoes_usuario),
+    (re.compile(r"/metricas"), rota_metricas),
+    (re.compile(r"/metricas/json"), rota_metricas_json),
+]
+
+def executar_rota(funcao, parametros: dict, grupos: tuple):
+    """Roda a rota dentro de um escopo de instrumentação; retorna (corpo, coleta ou None)."""
+    with instrumentacao.escopo(funcao.__name__) as coleta:
+        return funcao(parametros, *grupos), coleta
+
+def server_timing(coleta) -> str:
+    """Cabeçalho Server-Timing com os números do escopo da requisição."""
+    total = coleta.total
+    return (f'app;dur={total["segundos"] * 1000:.2f}, '
+            f'sql;dur={total["segundos_sql"] * 1000:.2f};desc="{total["consultas_sql"]} consultas, '
+            f'{total["linhas"]} linhas"')
+
+
+# ================= servidor =================
+class ServidorAPI:
+    """Servidor HTTP/1.1 mínimo com keep-alive; uma corrotina por conexão."""
+
+    def __init__(self, trabalhadores: int = TRABALHADORES, limite_fila: int = LIMITE_FILA):
+        self.executor = ThreadPoolExecutor(max_workers=trabalhadores, thread_name_prefix="api")
+        self.limite_fila = limite_fila
+        self.pendentes = 0  # requisições aguardando ou rodando no pool
+
+    async def atender(self, leitor: asyncio.StreamReader, escritor: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    cabecalho = await leitor.readuntil(b"\r\n\r\n")
+                except asyncio.IncompleteReadError:
+                    break  # cliente fechou a conexão
+                except asyncio.LimitOverrunError:
+                    await self._responder(escritor, 431, {"erro": "cabeçalho grande demais"}, False)
+                    break
+
+                linhas = cabecalho.decode("latin-1").split("\r\n")
+                try:
+                    metodo, alvo, versao = linhas[0].split(" ", 2)
+                except ValueError:
+                    await self._responder(escritor, 400, {"erro": "linha de requisição inválida"}, False)
+                    break
+                cabecalhos = {}
+                for linha in linhas[1:]:
+                    if ":" in linha:
+                        nome, valor = linha.split(":", 1)
+                        cabecalhos[nome.strip().lower()] = valor.strip()
+
+                # descarta o corpo, se houver (todas as rotas são GET)
+                try:
+                    tamanho_corpo = int(cabecalhos.get("content-length", 0) or 0)
+                    if tamanho_corpo < 0:
+                        raise ValueError(tamanho_corpo)
+                except ValueError:
+                    await self._responder(escritor, 400, {"erro": "Content-Length inválido"}, False)
+                    break
+                if tamanho_corpo:
+                    try:
+                        await leitor.readexactly(tamanho_corpo)
+                    except asyncio.IncompleteReadError:
+                        break  # cliente fechou a conexão no meio do corpo
+
+                manter = (versao == "HTTP/1.1" and cabecalhos.get("connection", "").lower() != "close") \
+                    or cabecalhos.get("connection", "").lower() == "keep-alive"
+                status, corpo, coleta = await self.despachar(metodo, alvo)
+                await self._responder(escritor, status, corpo, manter, coleta)
+                if not manter:
+                    break
+        except (ConnectionResetError, BrokenPipeError):
+            pass
+        finally:
+            escritor.close()
+
+    async def despachar(self, metodo: str, alvo: str) -> tuple[int, object, object]:
+        """Encontra a rota, executa no pool de threads e devolve (status, corpo, coleta da instrumentação)."""
+        if metodo != "GET":
+            return 405, {"erro": "apenas GET"}, None
+        url = urlsplit(alvo)
+        for padrao, funcao in ROTAS:
+            casamento = padrao.fullmatch(url.path.rstrip("/") or "/")
+            if casamento:
+                break
+        else:
+            return 404, {"erro": f"rota não encontrada: {url.path}"}, None
+
+        if self.pendentes >= self.limite_fila:
+            return 503, {"erro": "servidor sobrecarregado, tente novamente"}, None
+        self.pendentes += 1
+        try:
+            loop = asyncio.get_running_loop()
+            parametros = parse_qs(url.query)
+            # o escopo é aberto na thread do pool: run_in_executor não copia o contexto
+            corpo, coleta = await loop.run_in_executor(
+                self.executor, partial(executar_rota, funcao, parametros, casamento.groups()))
+            return 200, corpo, coleta
+        except ErroHTTP as erro:
+            return erro.status, {"erro": erro.mensagem}, None
+        except Exception as erro:
+            return 500, {"erro": f"{type(erro).__name__}: {erro}"}, None
+        finally:
+            self.pendentes -= 1
+
+    async def _responder(self, escritor: asyncio.StreamWriter, status: int, corpo, manter: bool,
+                         coleta=None):
+        if isinstance(corpo, str):  # /metricas
+            dados, tipo = corpo.encode(), "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            dados, tipo = json.dumps(corpo, ensure_ascii=False, default=_converter).encode(), \
+                "application/json; charset=utf-8"
+        extras = f"Server-Timing: {server_timing(coleta)}\r\n" if coleta is not None else ""
+        escritor.write(
+            f"HTTP/1.1 {status} {STATUS.get(status, '')}\r\n"
+            f"Content-Type: {tipo}\r\n"
+            f"Content-Length: {len(dados)}\r\n"
+            f"{extras}"
+            f"Connection: {'keep-alive' if manter else 'close'}\r\n\r\n".encode("latin-1") + dados
+        )
+        await escritor.drain()
+
+    async def servir(self, host: str, porta: int):
+        servidor = await asyncio.start_server(self.atender, host, porta, limit=TAMANHO_MAXIMO_CABECALHO,
+                                              backlog=1024)
+        print(f"API ouvindo em http://{host}:{porta}")
+        async with servidor:
+            await servidor.serve_forever()
+
+
+def _converter(valor):
+    """Converte tipos NumPy que aparecem nos resultados para JSON."""
+    if isinstance(valor, np.generic):
+        return valor.item()
+    raise TypeError(f"tipo não serializável: {type(valor).__name__}")
+
+
+# ================= gerador de carga =================
+async def _cliente(host: str, porta: int, caminhos: list[str], requisicoes: int, latencias: list, erros: list):
+    """Uma conexão keep-alive que envia `requisicoes` GETs em sequência."""
+    leitor, escritor = await asyncio.open_connection(host, porta)
+    try:
+        for i in range(requisicoes):
+            caminho = caminhos[i % len(caminhos)]
+            inicio = time.perf_counter()
+            escritor.write(f"GET {caminho} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+            await escritor.drain()
+            cabecalho = (await leitor.readuntil(b"\r\n\r\n")).decode("latin-1")
+            tamanho = int(re.search(r"content-length: (\d+)", cabecalho, re.I).group(1))
+            await leitor.readexactly(tamanho)
+            latencias.append(time.perf_counter() - inicio)
+            if not cabecalho.startswith("HTTP/1.1 200"):
+                erros.append(cabecalho.split("\r\n", 1)[0])
+    finally:
+        escritor.close()
+
+async def medir_carga(host: str, porta: int, caminhos: list[str], concorrencia: int = 200,
+                      requisicoes: int = 5000) -> dict:
+    """Dispara `requisicoes` GETs distribuídos em `concorrencia` conexões e resume as latências."""
+    latencias, erros = [], []
+    por_cliente = max(1, requisicoes // concorrencia)
+    inicio = time.perf_counter()
+    await asyncio.gather(*[
+        _cliente(host, porta, caminhos[i % len(caminhos):] + caminhos[:i % len(caminhos)],
+                 por_cliente, latencias, erros)
+        for i in range(concorrencia)
+    ])
+    duracao = time.perf_counter() - inicio
+    ms = np.array(latencias) * 1000
+    return {
+        "requisicoes": len(latencias),
+        "erros": len(erros),
+        "requisicoes_por_segundo": len(latencias) / duracao,
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API HTTP/JSON sobre o back.py.")
+    subcomandos = parser.add_subparsers(dest="comando")
+
+    servir = subcomandos.add_parser("servir", help="inicia o servidor (padrão)")
+    servir.add_argument("--host", default="127.0.0.1")
+    servir.add_argument("--porta", type=int, default=8000)
+    servir.add_argument("--trabalhadores", type=int, default=TRABALHADORES)
+
+    carga = subcomandos.add_parser("carga", help="mede a latência de um servidor já em execução")
+    carga.add_argument("--host", default="127.0.0.1")
+    carga.add_argument("--porta", type=int, default=8000)
+    carga.add_argument("--concorrencia", type=int, default=200)
+    carga.add_argument("--requisicoes", type=int, default=5000)
+    carga.add_argument("--usuario", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.comando == "carga":
+        caminhos = [
+            "/produtores?lat=-15.793889&lon=-47.882778&raio=25",
+            "/produtores?lat=-15.793889&lon=-47.882778&raio=10&sazonalidade=1",
+            "/produtores/filtro?estacao=Ver%C3%A3o&limite=50",
+            f"/usuarios/{args.usuario}/recomendacoes",
+            "/produtores/1",
+        ]
+        resultado = asyncio.run(medir_carga(args.host, args.porta, caminhos, args.concorrencia, args.requisicoes))
+        print("\n=== CARGA NA API ===")
+        for chave, valor in resultado.items():
+            print(f"{chave}: {valor:.1f}" if isinstance(valor, float) else f"{chave}: {valor}")
+        print("==============================\n")
+    else:
+        servidor = ServidorAPI(getattr(args, "trabalhadores", TRABALHADORES))
+        asyncio.run(servidor.servir(getattr(args, "host", "127.0.0.1"), getattr(args, "porta", 8000)))
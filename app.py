@@ -1,7 +1,12 @@
+import json
+import os
 import folium
 import pandas as pd
 import streamlit as st
+import instrumentacao
 from back import *
+from distancia import FORMULAS
+from folium.plugins import FastMarkerCluster
 from streamlit_folium import st_folium
 
 # ==================== INICIALIZAÇÃO DO SESSION STATE ====================
@@ -26,9 +31,57 @@ init_session_state()
 # ==================== CONFIGURAÇÃO DA PÁGINA ====================
 st.set_page_config(layout="wide", page_title="Busca por Produtores Locais")
 
+# ==================== CACHE ====================
+# Os resultados ficam em cache entre reruns e sessões (a engine já é única
+# por processo, criada no back.py). A chave inclui os parâmetros e os
+# contadores de escrita das tabelas envolvidas (get_versao_dados), então
+# qualquer escrita no banco invalida as entradas antigas; TTL e
+# max_entries limitam o tamanho do cache.
+TTL_CATALOGO = 3600  # segundos
+TTL_CONSULTAS = 600
+
+# Com o painel de desempenho ligado, cada chamada conta como acerto de
+# cache, a menos que o corpo rode (falha_cache).
+@instrumentacao.medir(cache=True)
+@st.cache_data(ttl=TTL_CATALOGO, max_entries=4, show_spinner=False)
+def produtos_em_cache(versao: tuple) -> list[str]:
+    instrumentacao.falha_cache()
+    return get_produtos()
+
+@instrumentacao.medir(cache=True)
+@st.cache_data(ttl=TTL_CATALOGO, max_entries=4, show_spinner=False)
+def produtores_com_ids_em_cache(versao: tuple) -> dict[int, str]:
+    instrumentacao.falha_cache()
+    return dict(get_produtores_com_ids())
+
+@instrumentacao.medir(cache=True)
+@st.cache_data(ttl=TTL_CONSULTAS, max_entries=256, show_spinner=False)
+def filtrar_produtores_em_cache(lat: float, lon: float, raio: float, preferencia: tuple,
+                                sazonalidade: bool, estacao: str, versao: tuple) -> list:
+    instrumentacao.falha_cache()
+    return filtrar_produtores(lat, lon, raio, preferencia=list(preferencia), sazonalidade=sazonalidade)
+
+@instrumentacao.medir(cache=True)
+@st.cache_data(ttl=TTL_CONSULTAS, max_entries=256, show_spinner=False)
+def mais_proximos_em_cache(lat: float, lon: float, k: int, preferencia: tuple,
+                           sazonalidade: bool, estacao: str, versao: tuple) -> list:
+    instrumentacao.falha_cache()
+    return [produtor for produtor, _ in produtores_mais_proximos(lat, lon, k, preferencia=list(preferencia),
+                                                                 sazonalidade=sazonalidade)]
+
+@instrumentacao.medir(cache=True)
+@st.cache_data(ttl=TTL_CONSULTAS, max_entries=64, show_spinner=False)
+def recomendacoes_em_cache(usuario_id: int, versao: tuple, motor: str = "knn") -> list:
+    instrumentacao.falha_cache()
+    return recomendar_produtores(usuario_id=usuario_id, motor=motor)
+
 # ==================== FUNÇÕES AUXILIARES ====================
-def criar_df_info_produtores(lista_de_objetos_produtor):
-    """Cria um DataFrame Pandas com informações dos produtores."""
+def criar_df_info_produtores(lista_de_objetos_produtor, origem=None, ordenar_por="nota"):
+    """Cria um DataFrame Pandas com informações dos produtores.
+
+    Com `origem` (lat, lon) inclui a coluna distancia_km (Vincenty, em lote);
+    `ordenar_por` é "nota" (maior primeiro) ou "distancia_km" (mais perto primeiro).
+    """
     dados = []
     if lista_de_objetos_produtor:
         for produtor in lista_de_objetos_produtor:
@@ -42,7 +95,12 @@ def criar_df_info_produtores(lista_de_objetos_produtor):
             })
     if dados:
         df = pd.DataFrame(dados)
-        df.sort_values(by="nota", ascending=False, inplace=True)
+        if origem is not None:
+            df["distancia_km"] = FORMULAS["vincenty"](origem[0], origem[1], df["lat"].to_numpy(dtype=float),
+                                                      df["lon"].to_numpy(dtype=float)).round(2)
+        if ordenar_por not in df:
+            ordenar_por = "nota"
+        df.sort_values(by=ordenar_por, ascending=ordenar_por != "nota", inplace=True, kind="stable")
         return df
     return pd.DataFrame() # Retorna DataFrame vazio se não houver dados
 
@@ -61,6 +119,55 @@ def adicionar_marcador_mapa(mapa, lat, lon, nome, nota, sigla, cor_icone, toolti
         tooltip=tooltip_text, # Usar o texto fornecido para o tooltip
     ).add_to(mapa)
 
+# Acima deste número de produtores o mapa usa uma única camada agrupada
+# (FastMarkerCluster) montada no navegador, em vez de um Marker por linha
+LIMITE_MARCADORES = int(os.environ.get("LIMITE_MARCADORES", 200))
+
+# Cria no navegador o marcador de cada linha [lat, lon, nome, nota]; tooltip
+# e popup só são montados quando usados e o nome entra como texto, não HTML
+CALLBACK_MARCADOR = """function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]), {
+        icon: L.AwesomeMarkers.icon({icon: 'fa-thumb-tack', prefix: 'fa', markerColor: %(cor)s})
+    });
+    marker.bindTooltip(function () {
+        var texto = document.createElement('span');
+        texto.textContent = %(prefixo)s + row[2];
+        return texto;
+    });
+    marker.bindPopup(function () {
+        var div = document.createElement('div');
+        div.style.width = '200px';
+        var titulo = document.createElement('h4');
+        titulo.textContent = row[2];
+        var nota = document.createElement('p');
+        nota.innerHTML = '<b>Nota:</b> ';
+        nota.appendChild(document.createTextNode(row[3] + ' ⭐'));
+        div.appendChild(titulo);
+        div.appendChild(nota);
+        return div;
+    }, {maxWidth: 200});
+    return marker;
+}"""
+
+def adicionar_camada_produtores(mapa, df, cor_icone, prefixo_tooltip=""):
+    """Adiciona os produtores do DataFrame ao mapa e retorna quantos foram desenhados.
+
+    Até LIMITE_MARCADORES usa um Marker com popup por produtor; acima disso
+    envia apenas as colunas lat, lon, nome e nota para uma FastMarkerCluster.
+    """
+    if df.empty:
+        return 0
+    df = df.dropna(subset=["lat", "lon"])
+
+    if len(df) > LIMITE_MARCADORES:
+        callback = CALLBACK_MARCADOR % {"cor": json.dumps(cor_icone), "prefixo": json.dumps(prefixo_tooltip)}
+        FastMarkerCluster(df[["lat", "lon", "nome", "nota"]].to_numpy().tolist(), callback=callback).add_to(mapa)
+    else:
+        for linha in df.itertuples(index=False):
+            adicionar_marcador_mapa(mapa, linha.lat, linha.lon, linha.nome, linha.nota, linha.sigla,
+                                    cor_icone, f"{prefixo_tooltip}{linha.nome}")
+    return len(df)
+
 # ==================== PÁGINA 1: Filtros e Mapa de Produtores ====================
 def pagina_filtros_e_mapa():
     st.header("🔎 Produtores Locais: Filtros e Mapa")
@@ -79,13 +186,18 @@ def pagina_filtros_e_mapa():
             # Use st.session_state para persistir e acessar user_lat/lon
             user_lat_input = st.number_input("Sua latitude", value=st.session_state.user_lat, format="%.6f", key="user_lat_input_p1")
             user_lon_input = st.number_input("Sua longitude", value=st.session_state.user_lon, format="%.6f", key="user_lon_input_p1")
-            raio = st.slider("Raio máximo (km)", 1, 100, 25, key="raio_p1") # Aumentei o raio máximo e o padrão
+            # "Mais próximos" traz os k produtores mais perto, sem limite de raio
+            modo_busca = st.radio("Buscar", ["Dentro do raio", "Mais próximos"], horizontal=True, key="modo_busca_p1")
+            if modo_busca == "Mais próximos":
+                quantidade_proximos = st.slider("Quantidade de produtores", 1, 100, 20, key="k_p1")
+            else:
+                raio = st.slider("Raio máximo (km)", 1, 100, 25, key="raio_p1") # Aumentei o raio máximo e o padrão
 
             # Atualizar session_state se os valores mudarem
             st.session_state.user_lat = user_lat_input
             st.session_state.user_lon = user_lon_input
         
-        lista_produtos_disponiveis = get_produtos()
+        lista_produtos_disponiveis = produtos_em_cache(get_versao_dados("produtos"))
         with st.container(border=True):
             st.markdown("##### Filtro por preferência de produtos 🍎")
             produtos_selecionados = st.multiselect("Quais produtos você procura?", options=lista_produtos_disponiveis, key="produtos_p1")
@@ -97,18 +209,26 @@ def pagina_filtros_e_mapa():
             usar_filtro_sazonalidade = st.checkbox("Mostrar apenas quem possui produtos da estação atual?", value=False, key="sazonalidade_p1")
 
     # ============== Aplicação dos filtros! ==============
-    # Sempre começa com o filtro de distância
-    produtores_base = filtro_distancia(st.session_state.user_lat, st.session_state.user_lon, raio)
-
-    produtores_para_exibir = list(produtores_base) # Copia para manipulação
+    # Distância, preferência e sazonalidade em uma única consulta (ou direto do cache)
+    versao_dados = get_versao_dados()
+    if modo_busca == "Mais próximos":
+        produtores_para_exibir = mais_proximos_em_cache(
+            st.session_state.user_lat, st.session_state.user_lon, quantidade_proximos,
+            tuple(produtos_selecionados), usar_filtro_sazonalidade, estacao_atual, versao_dados,
+        )
+    else:
+        produtores_para_exibir = filtrar_produtores_em_cache(
+            st.session_state.user_lat, st.session_state.user_lon, raio,
+            tuple(produtos_selecionados), usar_filtro_sazonalidade, estacao_atual, versao_dados,
+        )
 
     if st.session_state.get('recomendar_page1', False): # Verifica o estado do checkbox
         # Gera ou obtém recomendações
-        recomendacoes = recomendar_produtores() # Ajuste parâmetros conforme necessário
+        recomendacoes = recomendacoes_em_cache(get_id_usuario_padrao(), versao_dados, st.session_state.motor_recomendacao) # Ajuste parâmetros conforme necessário
         st.session_state.recomendados_lista = recomendacoes
 
         if st.session_state.recomendados_lista:
-            recomendacoes_ids = [prod.id for prod in st.session_state.recomendados_lista]
+            recomendacoes_ids = {prod.id for prod in st.session_state.recomendados_lista}
             # Remove recomendados da lista principal para evitar duplicidade no mapa se mostrados com cores diferentes
             produtores_para_exibir = [p for p in produtores_para_exibir if p.id not in recomendacoes_ids]
     else:
@@ -117,16 +237,6 @@ def pagina_filtros_e_mapa():
         # Para este exemplo, vamos assumir que Page 2 sempre busca as suas.
         pass # st.session_state.recomendados_lista permanece como estava ou é limpa se necessário
 
-    if produtos_selecionados:
-        produtores_preferencia = filtro_preferencia(produtos_selecionados)
-        ids_preferencia = [p.id for p in produtores_preferencia]
-        produtores_para_exibir = [p for p in produtores_para_exibir if p.id in ids_preferencia]
-
-    if usar_filtro_sazonalidade:
-        produtores_sazonalidade = filtro_sazonalidade()
-        ids_sazonalidade = [p.id for p in produtores_sazonalidade]
-        produtores_para_exibir = [p for p in produtores_para_exibir if p.id in ids_sazonalidade]
-
     st.session_state.produtores_filtrados = produtores_para_exibir
     st.session_state.filtros_aplicados = True
 
@@ -134,10 +244,13 @@ def pagina_filtros_e_mapa():
     with col2:
         st.subheader("Resultados da Busca")
 
-        df_produtores_filtrados = criar_df_info_produtores(st.session_state.produtores_filtrados)
+        origem = (st.session_state.user_lat, st.session_state.user_lon)
+        ordenar_por = {"Distância": "distancia_km", "Nota": "nota"}[
+            st.selectbox("Ordenar tabela por", ["Distância", "Nota"], key="ordem_p1")]
+        df_produtores_filtrados = criar_df_info_produtores(st.session_state.produtores_filtrados, origem, ordenar_por)
         df_recomendados_page1 = pd.DataFrame() # Inicializa DataFrame vazio
         if st.session_state.get('recomendar_page1', False) and st.session_state.recomendados_lista:
-             df_recomendados_page1 = criar_df_info_produtores(st.session_state.recomendados_lista)
+             df_recomendados_page1 = criar_df_info_produtores(st.session_state.recomendados_lista, origem, ordenar_por)
 
         # --- Mapa ---
         st.markdown("##### Mapa de Produtores")
@@ -150,21 +263,10 @@ def pagina_filtros_e_mapa():
             tooltip="Sua localização"
         ).add_to(mapa_filtrados)
 
-        produtores_no_mapa_count = 0
-        if not df_produtores_filtrados.empty:
-            for _, produtor_row in df_produtores_filtrados.iterrows():
-                adicionar_marcador_mapa(mapa_filtrados, produtor_row['lat'], produtor_row['lon'], 
-                                        produtor_row['nome'], produtor_row['nota'], produtor_row['sigla'], 
-                                        'blue', produtor_row['nome']) # Tooltip com nome para clareza
-                produtores_no_mapa_count += 1
-        
-        recomendados_no_mapa_count = 0
-        if not df_recomendados_page1.empty:
-            for _, rec_row in df_recomendados_page1.iterrows():
-                adicionar_marcador_mapa(mapa_filtrados, rec_row['lat'], rec_row['lon'], 
-                                        rec_row['nome'], rec_row['nota'], rec_row['sigla'], 
-                                        'green', f"Recomendado: {rec_row['nome']}") # Tooltip diferenciado
-                recomendados_no_mapa_count +=1
+        # Tooltip com nome para clareza; recomendados com tooltip diferenciado
+        produtores_no_mapa_count = adicionar_camada_produtores(mapa_filtrados, df_produtores_filtrados, 'blue')
+        recomendados_no_mapa_count = adicionar_camada_produtores(mapa_filtrados, df_recomendados_page1,
+                                                                 'green', "Recomendado: ")
 
         if produtores_no_mapa_count == 0 and recomendados_no_mapa_count == 0:
             if st.session_state.filtros_aplicados:
@@ -178,7 +280,7 @@ def pagina_filtros_e_mapa():
     # --- Tabela de Produtores Filtrados ---
     st.markdown("##### Tabela de Produtores Filtrados")
     if not df_produtores_filtrados.empty:
-        st.dataframe(df_produtores_filtrados[["nome", "sigla", "logradouro", "nota"]], hide_index=True, use_container_width=True)
+        st.dataframe(df_produtores_filtrados[["nome", "sigla", "logradouro", "nota", "distancia_km"]], hide_index=True, use_container_width=True)
     else:
         st.info("Nenhum produtor filtrado para exibir na tabela.")
 
@@ -186,7 +288,7 @@ def pagina_filtros_e_mapa():
     if st.session_state.get('recomendar_page1', False) and not df_recomendados_page1.empty:
         st.markdown("##### Tabela de Produtores Recomendados")
         st.caption("Estas recomendações são baseadas em diversos fatores, incluindo suas possíveis interações e avaliações de outros usuários.")
-        st.dataframe(df_recomendados_page1[["nome", "sigla", "logradouro", "nota"]], hide_index=True, use_container_width=True)
+        st.dataframe(df_recomendados_page1[["nome", "sigla", "logradouro", "nota", "distancia_km"]], hide_index=True, use_container_width=True)
     elif st.session_state.get('recomendar_page1', False) and df_recomendados_page1.empty:
             st.info("Nenhuma recomendação disponível no momento (baseado na sua seleção).")
 
@@ -199,13 +301,15 @@ def pagina_recomendacoes():
     # Botão para forçar a atualização das recomendações
     if st.button("Buscar/Atualizar Recomendações"):
         with st.spinner("Buscando recomendações..."):
-            st.session_state.recomendados_lista = recomendar_produtores() # Parâmetros podem ser diferentes para esta página
+            st.session_state.recomendados_lista = recomendacoes_em_cache(get_id_usuario_padrao(), get_versao_dados(),
+                                                                           st.session_state.motor_recomendacao) # Parâmetros podem ser diferentes para esta página
 
     if not st.session_state.recomendados_lista:
         st.info("Clique em 'Buscar/Atualizar Recomendações' para ver sugestões ou verifique os filtros na Página 1 caso as recomendações dependam deles e você não os ativou.")
         return
 
-    df_recomendados = criar_df_info_produtores(st.session_state.recomendados_lista)
+    df_recomendados = criar_df_info_produtores(st.session_state.recomendados_lista,
+                                               (st.session_state.user_lat, st.session_state.user_lon))
 
     if df_recomendados.empty:
         st.warning("Nenhuma recomendação encontrada no momento.")
@@ -228,17 +332,20 @@ def pagina_recomendacoes():
             tooltip="Sua localização (referência)"
         ).add_to(mapa_recomendacoes)
 
-    for _, row in df_recomendados.iterrows():
-        adicionar_marcador_mapa(mapa_recomendacoes, row['lat'], row['lon'], 
-                                row['nome'], row['nota'], row['sigla'], 
-                                'purple', f"Recomendado: {row['nome']}") # Cor diferente para destaque
+    # Cor diferente para destaque
+    adicionar_camada_produtores(mapa_recomendacoes, df_recomendados, 'purple', "Recomendado: ")
 
     st_folium(mapa_recomendacoes, width=900, height=500, key="mapa_recomendacoes")
 
     # ============== Exibição dos recomendados em tabela ==============
     st.subheader("Detalhes dos Produtores Recomendados:")
-    st.dataframe(df_recomendados[["nome", "sigla", "logradouro", "nota"]], hide_index=True, use_container_width=True)
-    st.caption("Estas recomendações são baseadas em usuários com perfis e avaliações semelhantes (via algoritmo KNN).")
+    st.dataframe(df_recomendados[["nome", "sigla", "logradouro", "nota", "distancia_km"]], hide_index=True, use_container_width=True)
+    if st.session_state.motor_recomendacao == "item":
+        st.caption("Estas recomendações são baseadas em produtores parecidos com os que você já avaliou (filtragem item-item).")
+    elif st.session_state.motor_recomendacao == "mf":
+        st.caption("Estas recomendações são baseadas em fatores latentes aprendidos de todas as avaliações (fatoração de matrizes).")
+    else:
+        st.caption("Estas recomendações são baseadas em usuários com perfis e avaliações semelhantes (via algoritmo KNN).")
 
 
 # ==================== PÁGINA 3: Buscar Produtores e Avaliações ====================
@@ -247,36 +354,60 @@ def pagina_busca_e_avaliacoes():
 
     # ============== Pesquisar produtores =====================
     st.subheader("Buscar Produtor Específico")
-    lista_todos_produtores_nomes = get_produtores()
+    nomes_por_id = produtores_com_ids_em_cache(get_versao_dados("produtores"))
     
-    if not lista_todos_produtores_nomes:
+    if not nomes_por_id:
         st.warning("Não há produtores cadastrados para busca.")
         return
 
-    nome_produtor_selecionado = st.selectbox(
+    # As opções são ids (ordenados por nome); o nome aparece apenas na tela
+    produtor_id_selecionado = st.selectbox(
         'Selecione um produtor para ver detalhes:', 
-        options=lista_todos_produtores_nomes,
+        options=list(nomes_por_id),
+        format_func=nomes_por_id.get,
         index=None, # Nenhum selecionado por padrão
         placeholder="Digite ou selecione um produtor"
     )
 
-    if nome_produtor_selecionado:
-        st.markdown(f"### Detalhes de: {nome_produtor_selecionado}")
+    if produtor_id_selecionado is not None:
+        # Cursores das páginas de avaliações já visitadas; reinicia ao trocar de produtor
+        if st.session_state.get('detalhe_produtor_id') != produtor_id_selecionado:
+            st.session_state.detalhe_produtor_id = produtor_id_selecionado
+            st.session_state.cursores_avaliacoes = [None]
+        cursores = st.session_state.cursores_avaliacoes
+
+        detalhes = get_detalhes_produtor(produtor_id_selecionado, apos_avaliacao_id=cursores[-1])
+        if detalhes is None:
+            st.warning("Produtor não encontrado.")
+            return
+        st.markdown(f"### Detalhes de: {detalhes['produtor'].nome}")
         
         # --- Avaliações do Produtor ---
         with st.container(border=True):
             st.markdown("##### Avaliações Recebidas")
-            avaliacoes_produtor = get_avaliacoes_produtor(nome_produtor_selecionado)
-            if avaliacoes_produtor:
-                df_avaliacoes = pd.DataFrame(avaliacoes_produtor, columns=["Usuário", "Nota (⭐)"])
+            resumo = detalhes["resumo"]
+            if resumo["quantidade"]:
+                col_resumo, col_histograma = st.columns([1, 2])
+                col_resumo.metric("Nota média", f"{resumo['media']:.1f} ⭐", f"{resumo['quantidade']} avaliações", delta_color="off")
+                col_histograma.bar_chart(pd.Series(resumo["histograma"], name="Avaliações"), height=150)
+
+                df_avaliacoes = pd.DataFrame(detalhes["avaliacoes"], columns=["Usuário", "Nota (⭐)"])
                 st.dataframe(df_avaliacoes, hide_index=True, use_container_width=True)
+
+                col_anterior, col_proxima = st.columns(2)
+                if col_anterior.button("Página anterior", disabled=len(cursores) == 1):
+                    cursores.pop()
+                    st.rerun()
+                if col_proxima.button("Próxima página", disabled=detalhes["proximo_cursor"] is None):
+                    cursores.append(detalhes["proximo_cursor"])
+                    st.rerun()
             else:
                 st.info("Este produtor ainda não possui avaliações.")
 
         # --- Produtos Ofertados ---
         with st.container(border=True):
             st.markdown("##### Produtos Ofertados")
-            produtos_ofertados = get_produtor_produtos(nome_produtor_selecionado)
+            produtos_ofertados = detalhes["produtos"]
             if produtos_ofertados:
                 dados_produtos = []
                 for produto in produtos_ofertados:
@@ -305,6 +436,30 @@ def pagina_busca_e_avaliacoes():
         st.info("Você ainda não avaliou nenhum produtor.")
 
 
+# ==================== PAINEL DE DESEMPENHO ====================
+def painel_de_desempenho(coleta):
+    """Mostra na barra lateral tempo, SQL, linhas e caches do rerun, e as exportações do processo."""
+    total = coleta.total
+    with st.sidebar.expander("Desempenho deste rerun", expanded=True):
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Tempo", f"{total['segundos'] * 1000:.0f} ms")
+        col2.metric("SQL", f"{total['consultas_sql']}", f"{total['segundos_sql'] * 1000:.0f} ms", delta_color="off")
+        col3.metric("Linhas", f"{total['linhas']}")
+        if coleta.funcoes:
+            funcoes = pd.DataFrame.from_dict(coleta.funcoes, orient="index")
+            funcoes["ms"] = (funcoes.pop("segundos") * 1000).round(1)
+            funcoes["ms_sql"] = (funcoes.pop("segundos_sql") * 1000).round(1)
+            st.caption("Por função (tempos incluem as funções chamadas)")
+            st.dataframe(funcoes.sort_values("ms", ascending=False), use_container_width=True)
+        if coleta.caches:
+            st.caption("Caches")
+            st.dataframe(pd.DataFrame.from_dict(coleta.caches, orient="index"), use_container_width=True)
+        st.download_button("Exportar JSON", json.dumps({"rerun": coleta.como_dict(),
+                                                        "processo": instrumentacao.exportar_json()}, indent=2),
+                           file_name="desempenho.json", mime="application/json")
+        st.download_button("Exportar Prometheus", instrumentacao.exportar_prometheus(),
+                           file_name="metricas.prom", mime="text/plain")
+
 # ==================== LÓGICA PRINCIPAL DA APLICAÇÃO / ROTEAMENTO DE PÁGINA ====================
 st.sidebar.title("Navegação Principal")
 
@@ -314,18 +469,37 @@ pagina_selecionada = st.sidebar.radio(
     key="page_selection"
 )
 
+# Motor usado nas recomendações das páginas 1 e 2
+st.sidebar.selectbox(
+    "Motor de recomendação:", MOTORES_RECOMENDACAO, index=MOTORES_RECOMENDACAO.index(MOTOR_RECOMENDACAO),
+    format_func={"knn": "Usuários parecidos (KNN)", "item": "Produtores parecidos (item-item)",
+                 "mf": "Fatores latentes (ALS)"}.get,
+    key="motor_recomendacao"
+)
+
+# Painel de desempenho (ou INSTRUMENTACAO=1): mede o rerun inteiro
+painel_desempenho = st.sidebar.checkbox("Painel de desempenho", value=instrumentacao.ATIVA)
+coleta_rerun = instrumentacao.iniciar_escopo("rerun", ativo=painel_desempenho)
+
 # ==================== CABEÇALHO GLOBAL ====================
 st.markdown(f"<h1 style='text-align: center;'>Busca de Produtores Locais!</h1>", unsafe_allow_html=True)
 st.markdown(f"<h3 style='text-align: center;'>Olá, {st.session_state.usuario}!</h3>", unsafe_allow_html=True)
 st.markdown("---") # Linha divisória
 
 # ==================== RENDERIZAÇÃO DA PÁGINA SELECIONADA ====================
-if pagina_selecionada == "Filtros e Mapa de Produtores":
-    pagina_filtros_e_mapa()
-elif pagina_selecionada == "Recomendações Personalizadas":
-    pagina_recomendacoes()
-elif pagina_selecionada == "Buscar Produtores e Avaliações":
-    pagina_busca_e_avaliacoes()
+try:
+    if pagina_selecionada == "Filtros e Mapa de Produtores":
+        pagina_filtros_e_mapa()
+    elif pagina_selecionada == "Recomendações Personalizadas":
+        pagina_recomendacoes()
+    elif pagina_selecionada == "Buscar Produtores e Avaliações":
+        pagina_busca_e_avaliacoes()
+finally:
+    # st.rerun() interrompe o script; o escopo é fechado mesmo assim
+    instrumentacao.encerrar_escopo(coleta_rerun)
+
+if coleta_rerun is not None:
+    painel_de_desempenho(coleta_rerun)
 
 # ==================== RODAPÉ ====================
 st.sidebar.markdown("---")
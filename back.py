@@ -1,33 +1,155 @@
+import logging
+import os
+import threading
 import time
+from functools import partial
 from db import *
-from sqlalchemy.orm import Session
-from geopy.distance import geodesic
-from sqlalchemy import create_engine, func
+from sqlalchemy.orm import Session, selectinload
+from cache_modelo import versao_atual_disco
+from catalogo import CatalogoColunar
+from indice_espacial import IndiceEspacial
+from indice_produtos import IndiceProdutos
+from instrumentacao import instrumentar_engine, medir, registrar_cache
+import numpy as np
 
-# engine principal para rodar querys do banco de dados
-engine = create_engine('sqlite:///db.db')
+logger = logging.getLogger(__name__)
 
-# usuário padrão usado no banco de dados
-usuario = None
-with Session(engine) as session:
-    usuario = session.query(Usuario).filter(Usuario.nome == "rafael" and Usuario.senha ==  "123").first()
+# engine principal para rodar querys do banco de dados
+# (CAMINHO_BANCO permite apontar para outro arquivo, ex.: bases de benchmark)
+# criar_banco também cria tabelas novas e aplica as migrações pendentes em bancos antigos.
+# O pool de conexões atende às threads da API (TAMANHO_POOL_BANCO conexões fixas).
+# Nada disso roda na importação: a engine é criada no primeiro uso (obter_engine)
+# e `back.engine` / `back.usuario` continuam acessíveis via __getattr__ do módulo.
+_engine = None
+_trava_engine = threading.Lock()
+
+def obter_engine():
+    """Cria (uma única vez, mesmo com várias threads) e retorna a engine do banco."""
+    global _engine
+    if _engine is None:
+        with _trava_engine:
+            if _engine is None:
+                _engine = criar_banco(os.environ.get('CAMINHO_BANCO', 'db.db'),
+                                      pool_size=int(os.environ.get('TAMANHO_POOL_BANCO', 10)),
+                                      max_overflow=10)
+                # consultas, tempo e linhas lidas por escopo (ver instrumentacao.py)
+                instrumentar_engine(_engine)
+    return _engine
+
+# índice espacial dos produtores para consultas por raio, vizinhos e caixa
+indice_espacial = IndiceEspacial()
+
+# bitsets produtor×produto para os filtros de preferência e sazonalidade
+indice_produtos = IndiceProdutos()
+
+# snapshot colunar (catalogo.py): com CAMINHO_CATALOGO os filtros, os vizinhos mais
+# próximos, a lista de produtos e as recomendações saem dos .npy mapeados em memória,
+# sem objetos do ORM (detalhes e avaliações de um produtor seguem no banco)
+CAMINHO_CATALOGO = os.environ.get("CAMINHO_CATALOGO")
+_catalogo = None
+_trava_catalogo = threading.Lock()
+_catalogo_desatualizado = None  # versão já avisada no log, para não repetir o aviso a cada chamada
+
+def obter_catalogo() -> CatalogoColunar | None:
+    """Retorna o snapshot de CAMINHO_CATALOGO, ou None se não houver snapshot configurado ou atualizado.
+
+    A cada chamada o ponteiro da versão publicada é relido e uma exportação
+    nova reabre o catálogo. Os contadores de versao_dados (uma consulta O(1))
+    são comparados com os da exportação: se as tabelas do snapshot mudaram
+    depois dela, retorna None e as funções usam o banco até a próxima
+    exportação, para não misturar dados do snapshot com os do banco.
+    """
+    global _catalogo, _catalogo_desatualizado
+    if not CAMINHO_CATALOGO:
+        return None
+    caminho = versao_atual_disco(CAMINHO_CATALOGO)
+    catalogo = _catalogo
+    if catalogo is None or catalogo.caminho != caminho:
+        with _trava_catalogo:
+            if _catalogo is None or _catalogo.caminho != caminho:
+                _catalogo = CatalogoColunar(CAMINHO_CATALOGO, diretorio_fatores=CAMINHO_FATORES,
+                                            motor_vizinhos=MOTOR_VIZINHOS, vizinhos_item=VIZINHOS_ITEM)
+            catalogo = _catalogo
+
+    with obter_engine().connect() as conexao:
+        versoes = versao_dados(conexao)
+    if not catalogo.atualizado(versoes):
+        if _catalogo_desatualizado != catalogo.caminho:
+            _catalogo_desatualizado = catalogo.caminho
+            logger.warning("Catálogo %s desatualizado em relação ao banco; usando SQL até a próxima exportação",
+                           catalogo.caminho)
+        return None
+    return catalogo
+
+# usuário padrão usado no banco de dados; só fica guardado depois de encontrado,
+# então um banco ainda sem ele no primeiro uso é consultado de novo na próxima vez
+_usuario_padrao: Usuario | None = None
+
+def get_usuario_padrao() -> Usuario | None:
+    """Retorna o usuário padrão, ou None se ele ainda não existir no banco."""
+    global _usuario_padrao
+    if _usuario_padrao is None:
+        with Session(obter_engine()) as session:
+            _usuario_padrao = session.query(Usuario).filter(Usuario.nome == "rafael", Usuario.senha == "123").first()
+    return _usuario_padrao
+
+def get_id_usuario_padrao() -> int:
+    """Id do usuário padrão; LookupError se ele não existir no banco."""
+    usuario = get_usuario_padrao()
+    if usuario is None:
+        raise LookupError('Usuário padrão "rafael" não encontrado no banco; gere os dados com `python db.py gerar`')
+    return usuario.id
+
+def __getattr__(nome: str):
+    if nome == "engine":
+        return obter_engine()
+    if nome == "usuario":
+        return get_usuario_padrao()
+    raise AttributeError(f"module {__name__!r} has no attribute {nome!r}")
 
 
 # ================= funções auxiliares =================
+@medir
+def buscar_produtores_por_ids(session: Session, ids, tamanho_lote: int = 500) -> list[Produtor]:
+    """Busca produtores pelos ids em lotes, preservando a ordem dos ids recebidos."""
+    ids = [int(id) for id in ids]
+    por_id = {}
+    for inicio in range(0, len(ids), tamanho_lote):
+        lote = ids[inicio:inicio + tamanho_lote]
+        for produtor in session.query(Produtor).filter(Produtor.id.in_(lote)).all():
+            por_id[produtor.id] = produtor
+    return [por_id[id] for id in ids if id in por_id]
+
+@medir
 def get_produtos() -> list[str]:
     """Retorna uma lista com os nomes dos produtos ordenados por nome."""
-    with Session(engine) as session:
+    if (catalogo := obter_catalogo()) is not None:
+        return catalogo.nomes_produtos()
+    with Session(obter_engine()) as session:
         produtos = session.query(Produto.nome).order_by(Produto.nome).all()
         produtos = [produto[0] for produto in produtos if isinstance(produto[0], str)]
         return produtos
 
+@medir
 def get_produtores() -> list[str]:
     """Retorna uma lista com os nomes dos produtores ordenados por nome."""
-    with Session(engine) as session:
+    with Session(obter_engine()) as session:
         produtores = session.query(Produtor.nome).order_by(Produtor.nome).all()
         produtores = [produtor[0] for produtor in produtores if isinstance(produtor[0], str)]
         return produtores
 
+@medir
+def get_versao_dados(*tabelas: str) -> tuple[int, ...]:
+    """Retorna os contadores de escrita das tabelas pedidas (todas, se nenhuma for informada).
+
+    Cada contador muda sempre que a tabela recebe um INSERT, UPDATE ou
+    DELETE, então a tupla serve de chave de cache para resultados que
+    dependem dessas tabelas.
+    """
+    with obter_engine().connect() as conexao:
+        versoes = versao_dados(conexao)
+    return tuple(versoes.get(tabela, 0) for tabela in (tabelas or TABELAS_VERSIONADAS))
+
 def get_estacao():
     """Retorna a estação atual com base no mês."""
     mes = time.localtime().tm_mon
@@ -39,9 +161,10 @@ def get_estacao():
     }
     return estacao[mes]
 
+@medir
 def get_produtor_produtos(produtor_nome: str) -> list[Produto]:
     """Retorna os produtos oferecidos por um produtor específico."""
-    with Session(engine) as session:
+    with Session(obter_engine()) as session:
         produtos = (
             session.query(Produto)
             .join(produtor_produto, Produto.id == produtor_produto.c.produto_id)
@@ -51,9 +174,10 @@ def get_produtor_produtos(produtor_nome: str) -> list[Produto]:
         )
         return produtos
 
+@medir
 def get_avaliacoes_produtor(produtor_nome: str) -> list[tuple[str, int]]:
     """Retorna as avaliações de um produtor específico."""
-    with Session(engine) as session:
+    with Session(obter_engine()) as session:
         avaliacoes = (
             session.query(Produtor.nome, Usuario.nome, Avaliacao.nota)
             .join(Produtor, Avaliacao.produtor_id == Produtor.id)
@@ -68,182 +192,352 @@ def get_avaliacoes_produtor(produtor_nome: str) -> list[tuple[str, int]]:
             resultado.append((usuario_nome, nota))
         return resultado
 
-def get_avaliacoes_usuario() -> dict[str, int]:
+@medir
+def get_avaliacoes_usuario(usuario_id: int = None) -> dict[str, int]:
     """Retorna todas as avaliações do usuário como um dicionário {produtor: nota}"""
-    with Session(engine) as session:
+    with Session(obter_engine()) as session:
   
-        # utiliza o usuário padrão definido no início
-        if usuario is None:
-            return {}
+        # sem usuario_id, utiliza o usuário padrão definido no início
+        if usuario_id is None:
+            usuario = get_usuario_padrao()
+            if usuario is None:
+                return {}
+            usuario_id = usuario.id
         
         avaliacoes = (
             session.query(Avaliacao, Produtor.nome)
             .join(Produtor, Avaliacao.produtor_id == Produtor.id)
-            .filter(Avaliacao.usuario_id == usuario.id)
+            .filter(Avaliacao.usuario_id == usuario_id)
             .all()
         )
 
         # Constrói o dicionário diretamente
         return {produtor_nome: avaliacao.nota for avaliacao, produtor_nome in avaliacoes}
 
-# ================= funções de filtros =================
-def filtro_distancia(user_lat: float, user_lon: float, raio: float) -> list[Produtor]:
-    """Retorna os produtores dentro de um raio especificado a partir da localização do usuário."""
-    with Session(engine) as session:
-        # Busca todos os produtores
-        produtores = session.query(Produtor).all()
+@medir
+def get_produtores_com_ids() -> list[tuple[int, str]]:
+    """Retorna [(id, nome)] de todos os produtores ordenados por nome."""
+    with Session(obter_engine()) as session:
+        produtores = session.query(Produtor.id, Produtor.nome).order_by(Produtor.nome).all()
+        return [(id, nome) for id, nome in produtores if isinstance(nome, str)]
+
+@medir
+def get_detalhes_produtor(produtor_id: int, apos_avaliacao_id: int = None,
+                          tamanho_pagina: int = 20) -> dict | None:
+    """Retorna produtor, produtos, uma página de avaliações e o resumo das notas, ou None se o id não existir.
+
+    Os produtos vêm de uma segunda consulta pelo índice de produtor_id
+    (selectinload; com joinedload o SQLite varria a tabela de produtos). As
+    avaliações são paginadas por chave: a próxima página começa depois de
+    `proximo_cursor` (o id da última avaliação retornada), então o custo não
+    cresce com o número de páginas. Quantidade, média e histograma vêm
+    dos contadores do produtor (mantidos pelos gatilhos de nota), sem
+    percorrer as avaliações. `tamanho_pagina` precisa ser pelo menos 1.
+    """
+    if tamanho_pagina < 1:
+        raise ValueError(f"tamanho_pagina deve ser >= 1, recebido {tamanho_pagina}")
+    with Session(obter_engine()) as session:
+        produtor = (
+            session.query(Produtor)
+            .options(selectinload(Produtor.produtos))
+            .filter(Produtor.id == produtor_id)
+            .one_or_none()
+        )
+        if produtor is None:
+            return None
 
-        # Calcula a distância entre o usuário e cada produtor
-        resultado = []
-        for produtor in produtores:
-            if produtor.lat is not None and produtor.lon is not None:
-                # Calcula a distância usando geopy
-                distancia = geodesic(
-                    (user_lat, user_lon),
-                    (produtor.lat, produtor.lon)
-                ).km
-                # Filtra a distancia para ver se adiciona nos resultados
-                if distancia <= raio:
-                    resultado.append(produtor)
-        
-        # Retorna os produtores dentro do raio ordenados pela distância
-        return resultado
-    
+        consulta = (
+            session.query(Avaliacao.id, Usuario.nome, Avaliacao.nota)
+            .join(Usuario, Avaliacao.usuario_id == Usuario.id)
+            .filter(Avaliacao.produtor_id == produtor_id)
+        )
+        if apos_avaliacao_id is not None:
+            consulta = consulta.filter(Avaliacao.id > apos_avaliacao_id)
+        # uma linha a mais indica se existe próxima página
+        pagina = consulta.order_by(Avaliacao.id).limit(tamanho_pagina + 1).all()
+        proximo_cursor = pagina[tamanho_pagina - 1][0] if len(pagina) > tamanho_pagina else None
+
+        return {
+            "produtor": produtor,
+            "produtos": list(produtor.produtos),
+            "avaliacoes": [(usuario_nome, nota) for _, usuario_nome, nota in pagina[:tamanho_pagina]],
+            "proximo_cursor": proximo_cursor,
+            "resumo": {
+                "quantidade": produtor.num_avaliacoes,
+                "media": produtor.soma_notas / produtor.num_avaliacoes if produtor.num_avaliacoes else 0.0,
+                "histograma": produtor.histograma_notas(),
+            },
+        }
+
+# ================= funções de filtros =================
+@medir
+def filtro_distancia(user_lat: float, user_lon: float, raio: float,
+                     formula: str = "vincenty") -> list[Produtor]:
+    """Retorna os produtores dentro de um raio especificado a partir da localização do usuário.
+
+    Os candidatos vêm do indice_espacial e as distâncias são refinadas em lote; `formula` pode ser
+    "vincenty" (equivalente ao geopy.geodesic) ou "haversine" (mais rápida).
+    """
+    with Session(obter_engine()) as session:
+        # Consulta o índice espacial em vez de percorrer todos os produtores
+        ids, _ = indice_espacial.raio(session, user_lat, user_lon, raio, formula)
+
+        # Busca apenas os produtores que estão dentro do raio
+        return buscar_produtores_por_ids(session, ids)
+
+@medir
+def produtores_mais_proximos(user_lat: float, user_lon: float, k: int = 20, raio: float = None,
+                             preferencia: list = None, sazonalidade: bool = False,
+                             formula: str = "vincenty") -> list[tuple[Produtor, float]]:
+    """Retorna os k produtores mais próximos como [(produtor, distância em km)], do mais perto ao mais longe.
+
+    A busca percorre o indice_espacial em ordem de distância e para assim
+    que os k resultados são garantidos, sem calcular nem ordenar a
+    distância de todos os produtores. Preferência (todos os produtos) e
+    sazonalidade restringem os candidatos pelos bitsets de indice_produtos;
+    `raio` (km), se informado, é a distância máxima.
+    """
+    if (catalogo := obter_catalogo()) is not None:
+        permitidos = None
+        if preferencia or sazonalidade:
+            permitidos = catalogo.filtrar(todos=preferencia or None, estacao=get_estacao() if sazonalidade else None)
+        ids, distancias = catalogo.mais_proximos(user_lat, user_lon, k, formula,
+                                                 permitidos=permitidos, raio_maximo=raio)
+        return list(zip(catalogo.produtores_por_ids(ids), distancias.tolist()))
+
+    with Session(obter_engine()) as session:
+        versoes = versao_dados(session.connection())  # uma leitura para os dois índices
+        permitidos = None
+        if preferencia or sazonalidade:
+            permitidos = indice_produtos.filtrar(session, todos=preferencia or None,
+                                                 estacao=get_estacao() if sazonalidade else None, versoes=versoes)
+        ids, distancias = indice_espacial.mais_proximos(session, user_lat, user_lon, k, formula, permitidos=permitidos,
+                                                        raio_maximo=raio, versoes=versoes)
+        distancia_por_id = dict(zip(ids.tolist(), distancias.tolist()))
+        return [(produtor, distancia_por_id[produtor.id]) for produtor in buscar_produtores_por_ids(session, ids)]
+
+@medir
 def filtro_preferencia(preferencia: list) -> list[Produtor]:
     """Retorna os produtores que oferecem todos os produtos da preferência."""
-    with Session(engine) as session:
+    with Session(obter_engine()) as session:
         if not preferencia:
             return []
-            
-        # Busca todos os ids dos produtos da preferência
-        produtos_id = session.query(Produto.id).filter(
-            Produto.nome.in_(preferencia)).all()
-        produtos_id = [produto[0] for produto in produtos_id]
-
-        if not produtos_id:
-            return []
-        
-        from db import produtor_produto
-        # Busca os produtores que oferecem todos os produtos da preferência
-        produtores = session.query(Produtor).join(
-            produtor_produto).filter(
-                produtor_produto.c.produto_id.in_(produtos_id)).group_by(
-                    Produtor.id).having(
-                        func.count(
-                            produtor_produto.c.produto_id
-                            ) >= len(produtos_id)).all()
 
-        return produtores
-    
-def filtro_sazonalidade() -> list[Produtor]:
-    """Retorna os produtos disponíveis na estação atual."""
-    estacao = get_estacao()
-
-    with Session(engine) as session:
-        # Busca os produtos disponíveis na estação atual
-        produtos = session.query(Produto).filter(
-            Produto.sazonalidade == estacao).all()
+        # AND dos bitsets dos produtos da preferência
+        ids = indice_produtos.todos(session, preferencia)
+        return buscar_produtores_por_ids(session, ids)
 
+@medir
+def filtro_algum_produto(produtos: list) -> list[Produtor]:
+    """Retorna os produtores que oferecem pelo menos um dos produtos informados."""
+    with Session(obter_engine()) as session:
         if not produtos:
             return []
-        produtos_id = [produto.id for produto in produtos]
 
-        from db import produtor_produto
-        produtores = session.query(Produtor).join(
-            produtor_produto).filter(
-                produtor_produto.c.produto_id.in_(produtos_id)).distinct().all()
+        # OR dos bitsets dos produtos
+        ids = indice_produtos.algum(session, produtos)
+        return buscar_produtores_por_ids(session, ids)
 
-        return produtores
+@medir
+def filtro_sazonalidade() -> list[Produtor]:
+    """Retorna os produtores que oferecem algum produto da estação atual."""
+    with Session(obter_engine()) as session:
+        # OR dos bitsets dos produtos da estação atual
+        ids = indice_produtos.da_estacao(session, get_estacao())
+        return buscar_produtores_por_ids(session, ids)
+
+@medir
+def filtro_produtos(todos: list = None, algum: list = None, estacao: str = None,
+                    limite: int = None) -> list[Produtor]:
+    """Combina os filtros de produtos: oferece todos de `todos`, algum de `algum` e algum da `estacao`.
+
+    Filtros None são ignorados; sem nenhum filtro retorna todos os produtores com ofertas.
+    Com `limite`, apenas os primeiros produtores (por id) são carregados do banco.
+    """
+    if (catalogo := obter_catalogo()) is not None:
+        ids = catalogo.filtrar(todos=todos, algum=algum, estacao=estacao)
+        return catalogo.produtores_por_ids(ids[:limite])
+
+    with Session(obter_engine()) as session:
+        ids = indice_produtos.filtrar(session, todos=todos, algum=algum, estacao=estacao)
+        return buscar_produtores_por_ids(session, ids[:limite])
+
+def _ids_filtrados(session: Session, user_lat: float = None, user_lon: float = None, raio: float = None,
+                   preferencia: list = None, sazonalidade: bool = False, formula: str = "vincenty",
+                   catalogo: CatalogoColunar = None):
+    """Ids dos produtores que passam pelos filtros informados, ou None se nenhum filtro foi informado.
+
+    Os contadores de versao_dados são lidos uma única vez e servem aos dois
+    índices. Com `catalogo` (o snapshot obtido pelo chamador) os índices são
+    os do catálogo e `session` não é usada.
+    """
+    if raio is None and not (preferencia or sazonalidade):
+        return None
+    if catalogo is not None:
+        buscar_raio, filtrar = catalogo.raio, catalogo.filtrar
+    else:
+        versoes = versao_dados(session.connection())
+        buscar_raio = partial(indice_espacial.raio, session, versoes=versoes)
+        filtrar = partial(indice_produtos.filtrar, session, versoes=versoes)
+    ids = None
+    if raio is not None:
+        ids, _ = buscar_raio(user_lat, user_lon, raio, formula)
+    if preferencia or sazonalidade:
+        permitidos = filtrar(todos=preferencia or None, estacao=get_estacao() if sazonalidade else None)
+        ids = permitidos if ids is None else ids[np.isin(ids, permitidos)]
+    return ids
+
+@medir
+def filtrar_produtores(user_lat: float, user_lon: float, raio: float,
+                       preferencia: list = None, sazonalidade: bool = False,
+                       formula: str = "vincenty", limite: int = None) -> list[Produtor]:
+    """Aplica os filtros de distância, preferência e sazonalidade sobre os índices em memória.
+
+    Os candidatos do raio vêm do indice_espacial, cujas buscas de até 100 km
+    reaproveitam os candidatos da célula geohash do ponto (buscas repetidas
+    perto do mesmo lugar não tocam a árvore). "Oferece todos os produtos da
+    preferência" e "oferece algum produto da estação atual" são os bitsets
+    do indice_produtos. Só os produtores que passam (no máximo `limite`, em
+    ordem de id) são carregados como objetos. Sem nenhum filtro (raio None,
+    sem preferência nem sazonalidade) todos os produtores passam.
+    """
+    if (catalogo := obter_catalogo()) is not None:
+        ids = _ids_filtrados(None, user_lat, user_lon, raio, preferencia, sazonalidade, formula, catalogo)
+        if ids is None:
+            ids = catalogo.produtores_ids
+        return catalogo.produtores_por_ids(np.sort(ids)[:limite])
+
+    with Session(obter_engine()) as session:
+        ids = _ids_filtrados(session, user_lat, user_lon, raio, preferencia, sazonalidade, formula)
+        if ids is None:
+            return session.query(Produtor).order_by(Produtor.id).limit(limite).all()
+        return buscar_produtores_por_ids(session, np.sort(ids)[:limite])
 
 # ================= funções principal ==================
 # Criação e treinamento de modelo KNN para recomendações
 # ======================================================
-import pandas as pd
-from sklearn.neighbors import NearestNeighbors
-
-def recomendar_produtores():
-    """Cria ou treina um modelo KNN para recomendações de produtores."""
-    with Session(engine) as session:
-        # Busca as informações necessárias
-        query = session.query(Avaliacao.usuario_id, Avaliacao.produtor_id, Avaliacao.nota)
-        dataframe = pd.read_sql(query.statement, session.connection())
-
-    # Cada linha dessse dataframe é uma avaliação
-    # Colunas usuario_id, produtor_id, nota
-    matriz = dataframe.pivot_table(
-        index='usuario_id',
-        columns='produtor_id',
-        values='nota',
-        fill_value=0
+from cache_modelo import ArmazemModelo
+from fatoracao import atualizar_fatores, construir_modelo_fatores, versao_fatores
+from recomendacao import construir_modelo_item, construir_modelo_knn, descrever_versao, versao_avaliacoes
+
+# modelo KNN treinado, reconstruído apenas quando a tabela de avaliações muda.
+# Defina CAMINHO_CACHE_MODELO para manter o modelo entre execuções do app e
+# MOTOR_VIZINHOS=lsh para usar a busca aproximada no lugar da busca bruta.
+MOTOR_VIZINHOS = os.environ.get("MOTOR_VIZINHOS", "bruta")
+armazem_knn = ArmazemModelo(partial(construir_modelo_knn, motor=MOTOR_VIZINHOS), versao_avaliacoes,
+                            caminho=os.environ.get("CAMINHO_CACHE_MODELO"), nome="modelo_knn")
+
+# Modelos item e mf servidos mesmo com avaliações mais novas que as do treino
+# (as notas do usuário são lidas na hora); o modelo novo é montado em segundo
+# plano, no máximo uma vez a cada INTERVALO_ATUALIZACAO_MODELOS segundos
+INTERVALO_ATUALIZACAO_MODELOS = float(os.environ.get("INTERVALO_ATUALIZACAO_MODELOS", "60"))
+
+# similaridade item-item (top-M produtores parecidos por produtor);
+# `python recomendacao.py --saida modelo_item.pkl` a pré-calcula offline para ser
+# carregada via CAMINHO_CACHE_ITEM, de qualquer versão das avaliações
+VIZINHOS_ITEM = int(os.environ.get("VIZINHOS_ITEM", "50"))
+armazem_item = ArmazemModelo(partial(construir_modelo_item, m_vizinhos=VIZINHOS_ITEM), versao_avaliacoes,
+                             caminho=os.environ.get("CAMINHO_CACHE_ITEM"), nome="modelo_item",
+                             intervalo_atualizacao=INTERVALO_ATUALIZACAO_MODELOS)
+
+# fatoração de matrizes (ALS); com CAMINHO_FATORES os vetores são lidos por mmap do
+# diretório gravado por `python fatoracao.py treinar`/`atualizar`, e o modelo só é
+# recarregado quando esses arquivos mudam. Sem ele o ALS é treinado no primeiro uso
+# e atualizado em segundo plano com algumas iterações a partir dos vetores servidos
+# (usuários novos recebem o vetor por fold-in)
+CAMINHO_FATORES = os.environ.get("CAMINHO_FATORES")
+armazem_fatores = ArmazemModelo(partial(construir_modelo_fatores, diretorio=CAMINHO_FATORES),
+                                partial(versao_fatores, diretorio=CAMINHO_FATORES), nome="modelo_fatores",
+                                atualizar=atualizar_fatores,
+                                intervalo_atualizacao=None if CAMINHO_FATORES else INTERVALO_ATUALIZACAO_MODELOS)
+
+# Motores de recomendação: "knn" (usuários vizinhos), "item" (produtores parecidos)
+# ou "mf" (fatoração de matrizes)
+MOTORES_RECOMENDACAO = ("knn", "item", "mf")
+MOTOR_RECOMENDACAO = os.environ.get("MOTOR_RECOMENDACAO", "knn")
+
+@medir
+def get_recomendacoes_salvas(session: Session, usuario_id: int, versao_modelo: str,
+                            quantidade: int = 10) -> list[Produtor]:
+    """Retorna as recomendações pré-calculadas pelo job em lote (recomendacoes_lote.py) para a versão dada."""
+    return (
+        session.query(Produtor)
+        .join(Recomendacao, Recomendacao.produtor_id == Produtor.id)
+        .filter(Recomendacao.usuario_id == usuario_id,
+                Recomendacao.versao_modelo == versao_modelo)
+        .order_by(Recomendacao.posicao)
+        .limit(quantidade)
+        .all()
     )
-    matriz.fillna(0)
-    # cada coluna é um produtor, cada linha é um usuario
-
-    # Criar e treinar o modelo KNN
-    modelo = NearestNeighbors(metric='cosine', n_neighbors=5, algorithm='brute')
-    modelo.fit(matriz.values)
-
-    # Criar um dicionario com os ids na ordem que aparecem na matriz
-    usuarios_idx = {id: i for i, id in enumerate(matriz.index.tolist())}
-
-    idx_usuario = usuarios_idx[usuario.id]
-    # criar uma lista de avaliacoes do usuario
-    # essa lista mostra o valor da nota para cada produtor na ordem das colunas
-    # da matriz pivotada
-    avaliacoes_usuario = matriz.iloc[idx_usuario].to_numpy().reshape(1, -1)
-    
-    # knn retorna a distancia dos vizinhos [[]] e o indice deles na matriz [[]]
-    _ , vizinhos_k = modelo.kneighbors(avaliacoes_usuario, n_neighbors=20)
-
-    # inverte o usuarios_idx para encontrar o usuario com base no indice
-    usuarios_idx = {value: key for key, value in usuarios_idx.items()}
-
-    vizinhos = []
-    # encontrar os vizinhos para colocar na lista
-    for i in range(1, len(vizinhos_k[0])):
-        idx = vizinhos_k[0][i]
-        id = usuarios_idx.get(idx)
-
-        if id is not None:
-            vizinhos.append(id)
-
-    # ====================================================
-    # Com a lista de vizinhos ordenada e feita, encontrar
-    # os vizinhos, seus produtores avaliados e pegar os que
-    # o usuário não avaliou e tem uma nota boa para recomendar
-
-    # encontrar os produtores dos vizinhos
-    produtores = []
-    with Session(engine) as session:    
-        for id in vizinhos:
-            avaliacoes = session.query(
-                Avaliacao.produtor_id).filter(
-                    Avaliacao.usuario_id == id).all()
-            # Adicionar os ids na lista de produtores
-            produtores.extend(aval[0] for aval in avaliacoes)
-            
-        # pegar os produtores avaliados pelo usuário
-        produtores_usuario = session.query(
-            Avaliacao.produtor_id).filter(
-                Avaliacao.usuario_id == usuario.id).all()
-        produtores_usuario = [produtor[0] for produtor in produtores_usuario]
-
-        produtores_finais = [produtor for 
-                             produtor in produtores if 
-                             produtor not in produtores_usuario]
-        # remover duplicados
-        produtores_finais = list(set(produtores_finais))
-
-        recomendacoes = session.query(Produtor).filter(
-            Produtor.id.in_(produtores_finais)).all()
-        # pegar apenas os com nota maior que 3
-        produtores_finais = []
-        for produtor in recomendacoes:
-            avg_nota = session.query(func.avg(Avaliacao.nota)).filter(
-                Avaliacao.produtor_id == produtor.id).scalar()
-            if avg_nota is not None and avg_nota >= 3:
-                produtores_finais.append(produtor)
-
-        print(len(produtores_finais), "produtores recomendados")
-        return produtores_finais[:10]  # Retorna os 10 primeiros produtores recomendados
 
+@medir
+def recomendar_produtores(quantidade: int = 10, usuario_id: int = None, motor: str = None,
+                          user_lat: float = None, user_lon: float = None, raio: float = None,
+                          preferencia: list = None, sazonalidade: bool = False) -> list[Produtor]:
+    """Recomenda produtores para o usuário (padrão: o usuário global) com o motor escolhido.
+
+    `motor` (padrão: MOTOR_RECOMENDACAO) pode ser "knn", que prevê as notas
+    a partir dos usuários vizinhos ponderados pela similaridade, "item",
+    que as prevê a partir dos produtores parecidos com os que o usuário já
+    avaliou, ou "mf", que pontua todos os produtores com um produto
+    matriz-vetor sobre os vetores da fatoração; nos modos item e mf o
+    custo não depende do número de usuários. Com `raio` (e a localização)
+    e/ou `preferencia`/`sazonalidade`, só entram os produtores que passam
+    nesses filtros, como em filtrar_produtores. Sem filtros, se o job em
+    lote já gravou ao menos `quantidade` recomendações do motor para a
+    versão atual das avaliações, elas são lidas diretamente. O número de consultas ao banco
+    é constante. Usuários sem avaliações recebem []. Com o snapshot
+    colunar (CAMINHO_CATALOGO), modelos, notas do usuário e registros vêm
+    do catálogo e as recomendações do job em lote não são usadas.
+    """
+    motor = motor or MOTOR_RECOMENDACAO
+    if motor not in MOTORES_RECOMENDACAO:
+        raise ValueError(f"Motor de recomendação desconhecido: {motor}. Use um de {list(MOTORES_RECOMENDACAO)}")
+    if usuario_id is None:
+        usuario_id = get_id_usuario_padrao()
+
+    if (catalogo := obter_catalogo()) is not None:
+        permitidos = _ids_filtrados(None, user_lat, user_lon, raio, preferencia, sazonalidade, catalogo=catalogo)
+        recomendacoes = catalogo.recomendar(usuario_id, motor, quantidade=quantidade, permitidos=permitidos)
+        return catalogo.produtores_por_ids([id for id, _ in recomendacoes])
+
+    with Session(obter_engine()) as session:
+        versao = versao_avaliacoes(session)
+        permitidos = _ids_filtrados(session, user_lat, user_lon, raio, preferencia, sazonalidade)
+
+        # Usa as recomendações pré-calculadas, se estiverem atualizadas (só valem sem filtros)
+        # e cobrirem a quantidade pedida; o job grava um número fixo por usuário, então
+        # pedidos maiores (ou usuários com menos candidatos) caem no modelo
+        if permitidos is None:
+            salvas = get_recomendacoes_salvas(session, usuario_id, descrever_versao(versao, motor), quantidade)
+            registrar_cache("recomendacoes_salvas", len(salvas) >= quantidade)
+            if len(salvas) >= quantidade:
+                return salvas
+
+        if motor in ("item", "mf"):
+            # Modelo do cache; as notas do usuário saem do índice por usuario_id
+            modelo = (armazem_item.obter(session, versao) if motor == "item"
+                      else armazem_fatores.obter(session))
+            avaliadas = (session.query(Avaliacao.produtor_id, Avaliacao.nota)
+                         .filter(Avaliacao.usuario_id == usuario_id).all())
+            if not avaliadas:
+                return []
+            produtores_avaliados, notas = zip(*avaliadas)
+            if motor == "item":
+                recomendacoes = modelo.recomendar(produtores_avaliados, notas, quantidade=quantidade,
+                                                  permitidos=permitidos)
+            else:
+                recomendacoes = modelo.recomendar(usuario_id, produtores_avaliados, notas, quantidade=quantidade,
+                                                  permitidos=permitidos)
+        else:
+            # Obtém o modelo treinado do cache (ou treina se as avaliações mudaram)
+            modelo = armazem_knn.obter(session, versao)
+
+            # Vizinhos, produtores avaliados por eles e notas médias saem da matriz em memória
+            try:
+                recomendacoes = modelo.recomendar(usuario_id, n_vizinhos=20, quantidade=quantidade,
+                                                  permitidos=permitidos)
+            except KeyError:
+                return []  # usuário sem avaliações não tem vizinhos
+
+        return buscar_produtores_por_ids(session, [id for id, _ in recomendacoes])
@@ -0,0 +1,282 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+# Escalas das bases sintéticas: produtores (além dos do CSV) e avaliações.
+# Cada usuário avalia em média 9 produtores (entre 6 e 12), como em db.criar_avaliacoes.
+ESCALAS = {
+    "pequena": {"produtores": 1_000, "avaliacoes": 10_000},
+    "media": {"produtores": 10_000, "avaliacoes": 100_000},
+    "grande": {"produtores": 100_000, "avaliacoes": 1_000_000},
+}
+AVALIACOES_POR_USUARIO = 9
+
+# Ponto de referência das buscas por distância (Brasília)
+LAT, LON, RAIO = -15.793889, -47.882778, 25
+
+# Limite padrão para considerar uma piora como regressão (20%)
+TOLERANCIA = 0.2
+
+# Módulos cujo tempo de importação (partida do app e dos workers da API) é medido
+MODULOS_IMPORTACAO = ["back", "api"]
+
+
+# ================= preparação das bases =================
+def preparar_base(escala: str, pasta: str) -> str:
+    """Gera (uma única vez) a base sintética da escala e retorna o caminho do arquivo."""
+    from db import gerar_dados_sinteticos
+
+    os.makedirs(pasta, exist_ok=True)
+    caminho = os.path.join(pasta, f"{escala}.db")
+    if not os.path.exists(caminho):
+        parametros = ESCALAS[escala]
+        gerar_dados_sinteticos(
+            caminho,
+            usuarios=max(1, parametros["avaliacoes"] // AVALIACOES_POR_USUARIO),
+            produtores_extras=parametros["produtores"],
+            semente=42,
+        )
+    return caminho
+
+
+# ================= medição (processo filho) =================
+def _percentis(tempos: list[float]) -> dict:
+    """Resumo em milissegundos de uma lista de tempos em segundos."""
+    ms = np.array(tempos) * 1000
+    return {
+        "n": len(ms),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "media_ms": float(ms.mean()),
+    }
+
+def medir_funcoes(repeticoes: int) -> dict:
+    """Mede as funções públicas do back.py contra a base indicada em CAMINHO_BANCO.
+
+    Deve rodar em um processo novo: a engine do back.py é criada no primeiro
+    uso a partir de CAMINHO_BANCO e vale para o processo inteiro.
+    """
+    import back
+    from sqlalchemy import event
+
+    consultas = {"total": 0}
+
+    @event.listens_for(back.engine, "before_cursor_execute")
+    def contar(*_):
+        consultas["total"] += 1
+
+    with back.Session(back.engine) as session:
+        produtos = [nome for (nome,) in session.query(back.Produto.nome).order_by(back.Produto.id).limit(3)]
+        produtor_popular = (
+            session.query(back.Produtor.nome)
+            .join(back.Avaliacao, back.Avaliacao.produtor_id == back.Produtor.id)
+            .group_by(back.Produtor.id)
+            .order_by(back.func.count(back.Avaliacao.id).desc())
+            .limit(1)
+            .scalar()
+        )
+
+    def limpar_caches():
+        back.indice_espacial.invalidar()
+        back.indice_produtos.invalidar()
+        back.armazem_knn.invalidar()
+        back.armazem_fatores.invalidar()
+
+    funcoes = {
+        "filtro_distancia": lambda: back.filtro_distancia(LAT, LON, RAIO),
+        "filtro_preferencia": lambda: back.filtro_preferencia(produtos),
+        "filtro_sazonalidade": lambda: back.filtro_sazonalidade(),
+        "filtrar_produtores": lambda: back.filtrar_produtores(LAT, LON, RAIO, produtos, True),
+        "produtores_mais_proximos": lambda: back.produtores_mais_proximos(LAT, LON, 20),
+        "get_avaliacoes_produtor": lambda: back.get_avaliacoes_produtor(produtor_popular),
+        "recomendar_produtores": lambda: back.recomendar_produtores(),
+        "recomendar_produtores_mf": lambda: back.recomendar_produtores(motor="mf"),
+    }
+
+    resultados = {}
+    for nome, funcao in funcoes.items():
+        # pico de memória (Python) de uma execução fria
+        limpar_caches()
+        tracemalloc.start()
+        funcao()
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        frio, quente, consultas_frio, consultas_quente = [], [], [], []
+        for _ in range(max(1, repeticoes // 4)):
+            limpar_caches()
+            antes = consultas["total"]
+            inicio = time.perf_counter()
+            funcao()
+            frio.append(time.perf_counter() - inicio)
+            consultas_frio.append(consultas["total"] - antes)
+
+        for _ in range(repeticoes):
+            antes = consultas["total"]
+            inicio = time.perf_counter()
+            funcao()
+            quente.append(time.perf_counter() - inicio)
+            consultas_quente.append(consultas["total"] - antes)
+
+        resultados[nome] = {
+            "frio": _percentis(frio),
+            "quente": _percentis(quente),
+            "consultas_sql_frio": int(max(consultas_frio)),
+            "consultas_sql_quente": int(max(consultas_quente)),
+            "pico_memoria_mb": pico / 2**20,
+        }
+    return resultados
+
+def executar_escala(caminho: str, repeticoes: int) -> dict:
+    """Roda medir_funcoes em um processo filho apontado para a base dada."""
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as arquivo:
+        saida = arquivo.name
+    try:
+        ambiente = dict(os.environ, CAMINHO_BANCO=caminho)
+        subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "_medir",
+             "--repeticoes", str(repeticoes), "--saida", saida],
+            env=ambiente, check=True, stdout=subprocess.DEVNULL,
+        )
+        with open(saida) as arquivo:
+            return json.load(arquivo)
+    finally:
+        os.remove(saida)
+
+
+# ================= tempo de importação =================
+def medir_importacao(modulo: str, repeticoes: int = 5, mais_caros: int = 10) -> dict:
+    """Mede `import modulo` em processos novos com `python -X importtime`.
+
+    Retorna os percentis do tempo total e, da última execução, os módulos
+    com maior tempo acumulado (o que mais pesa na partida).
+    """
+    pasta = os.path.dirname(os.path.abspath(__file__))
+    tempos, linhas = [], []
+    for _ in range(repeticoes):
+        processo = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+                                  cwd=pasta, capture_output=True, text=True, check=True)
+        # formato: "import time: <próprio us> | <acumulado us> | <indentação><módulo>"
+        linhas = []
+        for linha in processo.stderr.splitlines():
+            if not linha.startswith("import time:") or "cumulative" in linha:
+                continue
+            _, acumulado, nome = linha[len("import time:"):].split("|")
+            linhas.append((nome.strip(), int(acumulado) / 1e6))
+        tempos.append(next(tempo for nome, tempo in linhas if nome == modulo))
+
+    linhas.sort(key=lambda linha: linha[1], reverse=True)
+    return {
+        "total": _percentis(tempos),
+        "mais_caros_ms": {nome: tempo * 1000 for nome, tempo in linhas[:mais_caros + 1] if nome != modulo},
+    }
+
+
+# ================= comparação =================
+def comparar(atual: dict, base: dict, tolerancia: float = TOLERANCIA) -> list[str]:
+    """Retorna a lista de regressões do resultado atual em relação à base salva."""
+    regressoes = []
+    for modulo, medidas in atual.get("importacao", {}).items():
+        referencia = base.get("importacao", {}).get(modulo)
+        if referencia is None:
+            continue
+        novo, antigo = medidas["total"]["p50_ms"], referencia["total"]["p50_ms"]
+        if novo > antigo * (1 + tolerancia):
+            regressoes.append(f"import {modulo} p50: {antigo:.2f} ms -> {novo:.2f} ms")
+    for escala, funcoes in atual["resultados"].items():
+        for funcao, medidas in funcoes.items():
+            referencia = base.get("resultados", {}).get(escala, {}).get(funcao)
+            if referencia is None:
+                continue
+            for modo in ("frio", "quente"):
+                novo, antigo = medidas[modo]["p50_ms"], referencia[modo]["p50_ms"]
+                if novo > antigo * (1 + tolerancia):
+                    regressoes.append(f"{escala}/{funcao} p50 {modo}: {antigo:.2f} ms -> {novo:.2f} ms")
+            for chave in ("consultas_sql_frio", "consultas_sql_quente"):
+                if medidas[chave] > referencia[chave]:
+                    regressoes.append(f"{escala}/{funcao} {chave}: {referencia[chave]} -> {medidas[chave]}")
+            if medidas["pico_memoria_mb"] > referencia["pico_memoria_mb"] * (1 + tolerancia):
+                regressoes.append(f"{escala}/{funcao} pico de memória: "
+                                  f"{referencia['pico_memoria_mb']:.1f} MB -> {medidas['pico_memoria_mb']:.1f} MB")
+    return regressoes
+
+
+def _imprimir_importacao(importacao: dict):
+    for modulo, medidas in importacao.items():
+        print(f"\n=== IMPORTAÇÃO {modulo} === p50 {medidas['total']['p50_ms']:.1f} ms "
+              f"| p95 {medidas['total']['p95_ms']:.1f} ms")
+        for nome, ms in medidas["mais_caros_ms"].items():
+            print(f"  {nome:40s} {ms:9.1f} ms")
+
+def _imprimir(resultado: dict):
+    _imprimir_importacao(resultado.get("importacao", {}))
+    for escala, funcoes in resultado["resultados"].items():
+        print(f"\n=== ESCALA {escala.upper()} ===")
+        for funcao, medidas in funcoes.items():
+            print(f"{funcao:26s} frio p50 {medidas['frio']['p50_ms']:9.2f} ms | "
+                  f"quente p50 {medidas['quente']['p50_ms']:9.2f} ms p99 {medidas['quente']['p99_ms']:9.2f} ms | "
+                  f"SQL {medidas['consultas_sql_frio']}/{medidas['consultas_sql_quente']} | "
+                  f"pico {medidas['pico_memoria_mb']:.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks das funções de consulta e recomendação do back.py.")
+    subcomandos = parser.add_subparsers(dest="comando", required=True)
+
+    executar = subcomandos.add_parser("executar", help="gera as bases (se preciso) e mede todas as funções")
+    executar.add_argument("--escalas", nargs="+", default=["pequena", "media"], choices=list(ESCALAS))
+    executar.add_argument("--repeticoes", type=int, default=20)
+    executar.add_argument("--dados", default=".benchmark", help="pasta das bases sintéticas")
+    executar.add_argument("--saida", default="benchmark.json")
+
+    importacao = subcomandos.add_parser("importacao", help="mede apenas o tempo de importação dos módulos")
+    importacao.add_argument("--modulos", nargs="+", default=MODULOS_IMPORTACAO)
+    importacao.add_argument("--repeticoes", type=int, default=5)
+
+    comparar_parser = subcomandos.add_parser("comparar", help="compara um resultado com uma base salva")
+    comparar_parser.add_argument("atual")
+    comparar_parser.add_argument("base")
+    comparar_parser.add_argument("--tolerancia", type=float, default=TOLERANCIA)
+
+    medir = subcomandos.add_parser("_medir")  # uso interno: processo filho de executar
+    medir.add_argument("--repeticoes", type=int, default=20)
+    medir.add_argument("--saida", required=True)
+
+    args = parser.parse_args()
+
+    if args.comando == "_medir":
+        with open(args.saida, "w") as arquivo:
+            json.dump(medir_funcoes(args.repeticoes), arquivo)
+
+    elif args.comando == "executar":
+        resultado = {"gerado_em": time.strftime("%Y-%m-%dT%H:%M:%S"), "repeticoes": args.repeticoes,
+                     "importacao": {modulo: medir_importacao(modulo) for modulo in MODULOS_IMPORTACAO},
+                     "resultados": {}}
+        for escala in args.escalas:
+            caminho = preparar_base(escala, args.dados)
+            resultado["resultados"][escala] = executar_escala(caminho, args.repeticoes)
+        with open(args.saida, "w") as arquivo:
+            json.dump(resultado, arquivo, indent=2)
+        _imprimir(resultado)
+        print(f"\nResultados salvos em {args.saida}")
+
+    elif args.comando == "importacao":
+        _imprimir_importacao({modulo: medir_importacao(modulo, args.repeticoes) for modulo in args.modulos})
+
+    elif args.comando == "comparar":
+        with open(args.atual) as atual, open(args.base) as base:
+            regressoes = comparar(json.load(atual), json.load(base), args.tolerancia)
+        if regressoes:
+            print("Regressões encontradas:")
+            for regressao in regressoes:
+                print(f"  - {regressao}")
+            sys.exit(1)
+        print("Nenhuma regressão encontrada.")
@@ -0,0 +1,222 @@
+import logging
+import os
+import pickle
+import shutil
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from instrumentacao import registrar_cache
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# ================= versões em disco =================
+# Modelos de vários arquivos (ex.: .npy lidos por mmap) são gravados inteiros em
+# um subdiretório novo e publicados trocando o arquivo ARQUIVO_VERSAO_ATUAL com
+# os.replace: quem abre o diretório nunca mistura arquivos de versões diferentes.
+ARQUIVO_VERSAO_ATUAL = "ATUAL"
+VERSOES_MANTIDAS = 2  # a atual e a anterior, que pode continuar mapeada por quem a abriu antes da troca
+
+def nova_versao_disco(diretorio: str) -> str:
+    """Cria e retorna um subdiretório vazio onde a próxima versão será gravada."""
+    caminho = os.path.join(diretorio, f"v{time.time_ns()}-{os.getpid()}")
+    os.makedirs(caminho)
+    return caminho
+
+def publicar_versao_disco(diretorio: str, caminho_versao: str):
+    """Torna `caminho_versao` a versão atual (troca atômica do ponteiro) e apaga as versões antigas.
+
+    Versões mais novas que a publicada (gravações concorrentes ainda em
+    andamento) não são tocadas.
+    """
+    nome = os.path.basename(caminho_versao)
+    temporario = os.path.join(diretorio, f"{ARQUIVO_VERSAO_ATUAL}.{os.getpid()}.tmp")
+    with open(temporario, 'w') as arquivo:
+        arquivo.write(nome)
+    os.replace(temporario, os.path.join(diretorio, ARQUIVO_VERSAO_ATUAL))
+
+    anteriores = sorted(entrada for entrada in os.listdir(diretorio)
+                        if entrada.startswith("v") and entrada < nome
+                        and os.path.isdir(os.path.join(diretorio, entrada)))
+    for entrada in anteriores[:len(anteriores) - (VERSOES_MANTIDAS - 1)]:
+        # em sistemas que não apagam arquivos mapeados a remoção fica para a próxima publicação
+        shutil.rmtree(os.path.join(diretorio, entrada), ignore_errors=True)
+
+def versao_atual_disco(diretorio: str) -> Optional[str]:
+    """Caminho do subdiretório da versão publicada, ou None se nenhuma versão foi publicada."""
+    try:
+        with open(os.path.join(diretorio, ARQUIVO_VERSAO_ATUAL)) as arquivo:
+            return os.path.join(diretorio, arquivo.read().strip())
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+class ArmazemModelo:
+    """Guarda um modelo treinado em memória (e opcionalmente em disco) associado a uma versão dos dados.
+
+    `versao(session)` deve ser uma consulta barata que muda sempre que os
+    dados de treino mudam; `construir(session)` só é chamado quando a versão
+    guardada é diferente da atual.
+
+    Com `intervalo_atualizacao` (segundos), só a primeira construção bloqueia
+    a chamada: depois dela, se a versão muda, o modelo guardado continua
+    sendo servido e uma thread em segundo plano monta o novo, com
+    `atualizar(session, anterior)` (ex.: warm start) ou `construir`, no
+    máximo uma vez por intervalo. Nesse modo o arquivo em disco é aceito
+    mesmo que seja de outra versão.
+    """
+
+    def __init__(self, construir: Callable[[Session], Any], versao: Callable[[Session], tuple],
+                 caminho: Optional[str] = None, nome: str = "modelo",
+                 atualizar: Optional[Callable[[Session, Any], Any]] = None,
+                 intervalo_atualizacao: Optional[float] = None):
+        self.construir = construir
+        self.versao = versao
+        self.caminho = caminho
+        self.nome = nome  # nome do cache na instrumentação
+        self.atualizar = atualizar
+        self.intervalo_atualizacao = intervalo_atualizacao
+
+        self.modelo = None
+        self.versao_modelo = None
+        self._trava = threading.Lock()
+        self._atualizando = False
+        self._inicio_ultima_atualizacao = None
+
+        # contadores expostos por estatisticas()
+        self.acertos = 0
+        self.falhas = 0
+        self.carregamentos_disco = 0
+        self.reconstrucoes = 0
+        self.tempo_reconstrucao = 0.0  # segundos somados de todas as reconstruções
+        self.ultima_reconstrucao = 0.0
+        self.desatualizados = 0  # chamadas servidas com o modelo anterior enquanto o novo não fica pronto
+        self.atualizacoes_falhas = 0
+
+    def obter(self, session: Session, versao: Optional[tuple] = None):
+        """Retorna o modelo da versão atual dos dados, reconstruindo-o se necessário.
+
+        Quem já consultou a versão pode passá-la em `versao` para evitar a
+        consulta repetida. Com `intervalo_atualizacao`, retorna o modelo
+        guardado mesmo que a versão tenha mudado (ver a classe).
+        """
+        if versao is None:
+            versao = self.versao(session)
+        with self._trava:
+            if self.modelo is not None and self.versao_modelo == versao:
+                self.acertos += 1
+                registrar_cache(self.nome, True)
+                return self.modelo
+
+            em_segundo_plano = self.intervalo_atualizacao is not None
+            if self.modelo is None and em_segundo_plano and self._carregar_disco(None):
+                self.carregamentos_disco += 1
+                if self.versao_modelo == versao:
+                    self.falhas += 1
+                    registrar_cache(self.nome, False)
+                    return self.modelo
+            if self.modelo is not None and em_segundo_plano:
+                self.desatualizados += 1
+                registrar_cache(self.nome, True)
+                self._agendar_atualizacao(session)
+                return self.modelo
+
+            self.falhas += 1
+            registrar_cache(self.nome, False)
+            if self._carregar_disco(versao):
+                self.carregamentos_disco += 1
+                return self.modelo
+
+            modelo = self._cronometrar(self.construir, session)
+            self.modelo, self.versao_modelo = modelo, versao
+            self._salvar_disco()
+            return modelo
+
+    def _cronometrar(self, funcao: Callable, *args):
+        """Executa a construção (ou atualização) do modelo e soma a duração às estatísticas."""
+        inicio = time.perf_counter()
+        modelo = funcao(*args)
+        duracao = time.perf_counter() - inicio
+        self.reconstrucoes += 1
+        self.tempo_reconstrucao += duracao
+        self.ultima_reconstrucao = duracao
+        return modelo
+
+    # ================= atualização em segundo plano =================
+    def _agendar_atualizacao(self, session: Session):
+        """Inicia a thread de atualização, se nenhuma estiver rodando e o intervalo mínimo já passou."""
+        agora = time.monotonic()
+        if self._atualizando or (self._inicio_ultima_atualizacao is not None
+                                 and agora - self._inicio_ultima_atualizacao < self.intervalo_atualizacao):
+            return
+        self._atualizando = True
+        self._inicio_ultima_atualizacao = agora
+        # a sessão da requisição é fechada antes do fim do treino: a thread abre a sua na mesma engine
+        threading.Thread(target=self._atualizar_em_segundo_plano, args=(session.get_bind(),),
+                         name=f"atualizar-{self.nome}", daemon=True).start()
+
+    def _atualizar_em_segundo_plano(self, bind):
+        """Monta o modelo da versão atual fora da trava e o troca pelo servido ao terminar."""
+        try:
+            with Session(bind) as session:
+                versao = self.versao(session)  # lida antes do treino: escritas posteriores disparam outra rodada
+                anterior = self.modelo
+                if self.atualizar is not None and anterior is not None:
+                    modelo = self._cronometrar(self.atualizar, session, anterior)
+                else:
+                    modelo = self._cronometrar(self.construir, session)
+            with self._trava:
+                self.modelo, self.versao_modelo = modelo, versao
+                self._salvar_disco()
+        except Exception:
+            self.atualizacoes_falhas += 1
+            logger.exception("Falha ao atualizar %s em segundo plano; o modelo anterior continua servindo", self.nome)
+        finally:
+            self._atualizando = False
+
+    def invalidar(self):
+        """Descarta o modelo em memória; o arquivo em disco é ignorado se a versão mudar."""
+        with self._trava:
+            self.modelo = None
+            self.versao_modelo = None
+
+    def estatisticas(self) -> dict:
+        """Retorna os contadores de acertos, falhas e tempo de reconstrução."""
+        return {
+            "acertos": self.acertos,
+            "falhas": self.falhas,
+            "carregamentos_disco": self.carregamentos_disco,
+            "reconstrucoes": self.reconstrucoes,
+            "tempo_reconstrucao": self.tempo_reconstrucao,
+            "ultima_reconstrucao": self.ultima_reconstrucao,
+            "desatualizados": self.desatualizados,
+            "atualizacoes_falhas": self.atualizacoes_falhas,
+            "versao": self.versao_modelo,
+        }
+
+    # ================= persistência =================
+    def _carregar_disco(self, versao) -> bool:
+        """Carrega o modelo salvo em disco se ele corresponder à versão atual (com versao None, qualquer uma)."""
+        if not self.caminho or not os.path.exists(self.caminho):
+            return False
+        try:
+            with open(self.caminho, 'rb') as arquivo:
+                salvo = pickle.load(arquivo)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return False
+
+        if versao is not None and salvo.get("versao") != versao:
+            return False
+        self.modelo, self.versao_modelo = salvo["modelo"], salvo.get("versao")
+        return True
+
+    def _salvar_disco(self):
+        """Salva o modelo atual em disco de forma atômica (arquivo temporário + rename)."""
+        if not self.caminho:
+            return
+        temporario = f"{self.caminho}.tmp"
+        with open(temporario, 'wb') as arquivo:
+            pickle.dump({"versao": self.versao_modelo, "modelo": self.modelo}, arquivo,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporario, self.caminho)
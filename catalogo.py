@@ -0,0 +1,543 @@
+"""Snapshot colunar do catálogo (produtores, produtos, ofertas e avaliações) em arquivos .npy.
+
+`exportar_catalogo` grava cada coluna em um .npy, em um subdiretório por
+versão publicado de forma atômica (ver cache_modelo); `CatalogoColunar` abre
+os arquivos com mmap (somente leitura) e responde aos filtros e às
+recomendações sem SQL e sem criar objetos do ORM. A similaridade
+item-item e os vetores da fatoração (ALS, continuando os do snapshot
+anterior) são calculados na exportação, para que nenhuma requisição
+treine esses modelos. Vários processos que
+abrem o mesmo diretório compartilham as páginas do cache do sistema
+operacional, ou seja, uma única cópia física do catálogo.
+
+Uso:
+    python catalogo.py exportar --banco db.db --saida catalogo
+    python catalogo.py medir --catalogo catalogo --banco db.db
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from itertools import chain
+from typing import NamedTuple
+
+import numpy as np
+from cache_modelo import nova_versao_disco, publicar_versao_disco, versao_atual_disco
+from db import Produto, Produtor, produtor_produto, versao_dados
+from distancia import FORMULAS, caixa_delimitadora, haversine
+from fatoracao import (ARQUIVOS_FATORES, REGULARIZACAO, ModeloFatores, continuar_treino, diretorio_modelo,
+                       modelo_de_treino, treinar_als)
+from indice_espacial import MARGEM_ELIPSOIDE
+from recomendacao import (MatrizAvaliacoes, ModeloItemItem, ModeloKNN, carregar_avaliacoes, similaridade_produtores,
+                          versao_avaliacoes)
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+# ================= formato =================
+# Versão do formato dos arquivos; um snapshot de outro formato precisa ser exportado de novo
+FORMATO_CATALOGO = 4
+
+# Colunas numéricas: produtores em ordem de id (a posição é a mesma em todas as
+# colunas), latitudes ordenadas com a permutação para a busca por raio, bitsets
+# produto×produtor (mesma forma do indice_produtos) e avaliações agrupadas por
+# usuário no formato CSR (indptr sobre os ids de usuário ordenados), a similaridade
+# item-item (CSR top-M sobre as colunas de item_produtores_ids) e os vetores da
+# fatoração com os mesmos nomes de fatoracao.py
+ARQUIVOS_CATALOGO = (
+    "produtores_ids", "produtores_lat", "produtores_lon", "produtores_nota",
+    "lats_ordenadas", "ordem_lat",
+    "produtos_ids", "ofertas",
+    "avaliacoes_usuarios_ids", "avaliacoes_indptr", "avaliacoes_produtores", "avaliacoes_notas",
+    "item_produtores_ids", "item_media_produtores", "item_indptr", "item_indices", "item_similaridades",
+) + tuple(f"fatores_{nome}" for nome in ARQUIVOS_FATORES)
+
+# Iterações do ALS na exportação: do zero, ou continuando os vetores do snapshot anterior
+ITERACOES_FATORES, ITERACOES_FATORES_CONTINUACAO = 10, 3
+
+# Colunas de texto: bytes UTF-8 concatenados, offsets (n + 1) e máscara de nulos
+TEXTOS_CATALOGO = ("produtores_nome", "produtores_sigla", "produtores_logradouro",
+                   "produtos_nome", "produtos_sazonalidade")
+PARTES_TEXTO = ("dados", "offsets", "nulos")
+
+ARQUIVO_METADADOS = "metadados.json"
+
+# Tabelas cujo conteúdo está no snapshot; escritas nelas depois da exportação o desatualizam
+TABELAS_CATALOGO = ("produtos", "produtores", "produtor_produto", "avaliacoes")
+
+
+class ProdutorColunar(NamedTuple):
+    """Produtor lido do snapshot, com os mesmos atributos que a interface usa de Produtor."""
+    id: int
+    nome: str
+    sigla: str | None
+    logradouro: str | None
+    lat: float | None
+    lon: float | None
+    nota: float | None
+
+
+# ================= colunas de texto =================
+def codificar_textos(valores: list) -> dict[str, np.ndarray]:
+    """Converte uma lista de textos (ou None) nas partes dados/offsets/nulos de uma coluna."""
+    codificados = [(valor or "").encode("utf-8") for valor in valores]
+    offsets = np.zeros(len(codificados) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(texto) for texto in codificados])
+    return {
+        "dados": np.frombuffer(b"".join(codificados), dtype=np.uint8),
+        "offsets": offsets,
+        "nulos": np.array([valor is None for valor in valores], dtype=bool),
+    }
+
+class ColunaTexto:
+    """Coluna de texto sobre vetores (mapeados) de bytes e offsets; decodifica só as linhas pedidas."""
+
+    def __init__(self, dados: np.ndarray, offsets: np.ndarray, nulos: np.ndarray):
+        self.dados = dados
+        self.offsets = offsets
+        self.nulos = nulos
+
+    def __len__(self) -> int:
+        return len(self.nulos)
+
+    def __getitem__(self, posicao: int) -> str | None:
+        if self.nulos[posicao]:
+            return None
+        return self.dados[self.offsets[posicao]:self.offsets[posicao + 1]].tobytes().decode("utf-8")
+
+    def valores(self) -> list[str | None]:
+        """Todos os textos da coluna (usado para colunas pequenas, como as de produtos)."""
+        return [self[posicao] for posicao in range(len(self))]
+
+
+# ================= exportação =================
+def exportar_catalogo(session: Session, diretorio: str, vizinhos_item: int = 50) -> dict:
+    """Grava o snapshot colunar do banco em uma versão nova de `diretorio`, publica-a e retorna os metadados.
+
+    Quem já abriu a versão anterior continua com ela; os metadados guardam
+    a forma de cada arquivo, conferida por CatalogoColunar ao abrir. A
+    similaridade item-item guarda `vizinhos_item` vizinhos por produtor; os
+    vetores da fatoração continuam os do snapshot publicado (warm start),
+    ou são treinados do zero se ele não existir ou for de outro formato.
+    """
+    os.makedirs(diretorio, exist_ok=True)
+    versao = versao_avaliacoes(session)
+    versoes = versao_dados(session.connection())
+    colunas, textos = {}, {}
+
+    # produtores em ordem de id; coordenadas e notas ausentes viram NaN
+    produtores = session.execute(
+        select(Produtor.id, Produtor.nome, Produtor.sigla, Produtor.logradouro,
+               Produtor.lat, Produtor.lon, Produtor.nota).order_by(Produtor.id)).all()
+    colunas["produtores_ids"] = np.array([p.id for p in produtores], dtype=np.int64)
+    for nome in ("lat", "lon", "nota"):
+        colunas[f"produtores_{nome}"] = np.array(
+            [np.nan if getattr(p, nome) is None else getattr(p, nome) for p in produtores], dtype=np.float64)
+    for nome in ("nome", "sigla", "logradouro"):
+        textos[f"produtores_{nome}"] = [getattr(p, nome) for p in produtores]
+
+    # latitudes ordenadas (só quem tem coordenadas) para achar a faixa do raio por busca binária
+    com_coordenadas = np.flatnonzero(~np.isnan(colunas["produtores_lat"]) & ~np.isnan(colunas["produtores_lon"]))
+    ordem = com_coordenadas[np.argsort(colunas["produtores_lat"][com_coordenadas], kind="stable")]
+    colunas["ordem_lat"] = ordem.astype(np.int64)
+    colunas["lats_ordenadas"] = colunas["produtores_lat"][ordem]
+
+    # produtos e bitsets de ofertas sobre as posições dos produtores
+    produtos = session.execute(select(Produto.id, Produto.nome, Produto.sazonalidade).order_by(Produto.id)).all()
+    colunas["produtos_ids"] = np.array([p.id for p in produtos], dtype=np.int64)
+    textos["produtos_nome"] = [p.nome for p in produtos]
+    textos["produtos_sazonalidade"] = [p.sazonalidade for p in produtos]
+
+    ofertas = session.execute(select(produtor_produto.c.produtor_id, produtor_produto.c.produto_id))
+    pares = np.fromiter(chain.from_iterable(ofertas.tuples()), dtype=np.int64).reshape(-1, 2)
+    colunas_bits = np.searchsorted(colunas["produtores_ids"], pares[:, 0])
+    linhas_bits = np.searchsorted(colunas["produtos_ids"], pares[:, 1])
+    conhecidos = (np.isin(pares[:, 0], colunas["produtores_ids"]) & np.isin(pares[:, 1], colunas["produtos_ids"]))
+    matriz = np.zeros((len(produtos), len(produtores)), dtype=bool)
+    matriz[linhas_bits[conhecidos], colunas_bits[conhecidos]] = True
+    colunas["ofertas"] = np.packbits(matriz, axis=1)
+
+    # avaliações agrupadas por usuário (CSR); a fatia de um usuário é lida sem cópia
+    usuarios, produtores_avaliados, notas = carregar_avaliacoes(session)
+    ordem = np.lexsort((produtores_avaliados, usuarios))
+    usuarios, produtores_avaliados, notas = usuarios[ordem], produtores_avaliados[ordem], notas[ordem]
+    colunas["avaliacoes_usuarios_ids"], contagens = np.unique(usuarios, return_counts=True)
+    colunas["avaliacoes_indptr"] = np.concatenate([[0], np.cumsum(contagens)]).astype(np.int64)
+    colunas["avaliacoes_produtores"] = produtores_avaliados
+    colunas["avaliacoes_notas"] = notas
+
+    # similaridade item-item e fatoração (ALS) calculadas aqui, e não na primeira requisição do motor
+    avaliacoes = MatrizAvaliacoes(usuarios, produtores_avaliados, notas)
+    similaridade = similaridade_produtores(avaliacoes.matriz, vizinhos_item)
+    colunas["item_produtores_ids"] = avaliacoes.produtores_ids
+    colunas["item_media_produtores"] = avaliacoes.media_produtores
+    colunas["item_indptr"] = similaridade.indptr.astype(np.int64)
+    colunas["item_indices"] = similaridade.indices.astype(np.int64)
+    colunas["item_similaridades"] = similaridade.data
+
+    try:
+        anterior = CatalogoColunar(diretorio).fatores()
+    except (FileNotFoundError, ValueError):
+        anterior = None
+    if anterior is not None:
+        fatores = continuar_treino(avaliacoes, anterior, ITERACOES_FATORES_CONTINUACAO, versao=versao)
+    else:
+        fatores = modelo_de_treino(avaliacoes, treinar_als(avaliacoes, iteracoes=ITERACOES_FATORES),
+                                   REGULARIZACAO, versao)
+    for nome in ARQUIVOS_FATORES:
+        colunas[f"fatores_{nome}"] = getattr(fatores, nome)
+
+    for nome in TEXTOS_CATALOGO:
+        for parte, vetor in codificar_textos(textos[nome]).items():
+            colunas[f"{nome}_{parte}"] = vetor
+    caminho = nova_versao_disco(diretorio)
+    for nome, vetor in colunas.items():
+        np.save(os.path.join(caminho, f"{nome}.npy"), np.ascontiguousarray(vetor))
+
+    metadados = {
+        "formato": FORMATO_CATALOGO,
+        "versao_avaliacoes": [int(valor or 0) for valor in versao],
+        "versao_dados": versoes,
+        "produtores": len(produtores),
+        "produtos": len(produtos),
+        "avaliacoes": int(len(notas)),
+        "vizinhos_item": vizinhos_item,
+        "fatores": {"media": fatores.media, "regularizacao": fatores.regularizacao},
+        "exportado_em": time.time(),
+        "formas": {nome: list(vetor.shape) for nome, vetor in colunas.items()},
+    }
+    with open(os.path.join(caminho, ARQUIVO_METADADOS), 'w') as arquivo:
+        json.dump(metadados, arquivo)
+    publicar_versao_disco(diretorio, caminho)
+    return metadados
+
+
+# ================= leitura =================
+class CatalogoColunar:
+    """Catálogo somente leitura sobre os .npy de um snapshot, mapeados em memória.
+
+    Abrir o catálogo lê apenas os metadados e os textos dos produtos; as
+    demais colunas são páginas carregadas sob demanda. Os filtros devolvem
+    ids (como indice_espacial/indice_produtos) e `produtores_por_ids`
+    monta ProdutorColunar só para as linhas pedidas. O modelo knn é
+    construído das avaliações do snapshot no primeiro uso e os modelos
+    item e mf usam a similaridade e os vetores gravados na exportação;
+    como o snapshot não muda, nunca são invalidados.
+    """
+
+    def __init__(self, diretorio: str, diretorio_fatores: str = None,
+                 motor_vizinhos: str = "bruta", vizinhos_item: int = 50):
+        caminho = versao_atual_disco(diretorio)
+        if caminho is None:
+            raise FileNotFoundError(f"Nenhum catálogo publicado em {diretorio}; use `python catalogo.py exportar`")
+        self.caminho = caminho  # versão aberta; exportações posteriores não a alteram
+        with open(os.path.join(caminho, ARQUIVO_METADADOS)) as arquivo:
+            self.metadados = json.load(arquivo)
+        if self.metadados.get("formato") != FORMATO_CATALOGO:
+            raise ValueError(f"Formato de catálogo {self.metadados.get('formato')} não suportado; "
+                             f"exporte novamente com `python catalogo.py exportar`")
+
+        def abrir(nome):
+            return np.load(os.path.join(caminho, f"{nome}.npy"), mmap_mode='r')
+
+        for nome in ARQUIVOS_CATALOGO:
+            setattr(self, nome, abrir(nome))
+        for nome in TEXTOS_CATALOGO:
+            setattr(self, nome, ColunaTexto(*(abrir(f"{nome}_{parte}") for parte in PARTES_TEXTO)))
+
+        formas = {nome: list(vetor.shape) for nome, vetor in self._arquivos()}
+        if formas != self.metadados["formas"]:
+            raise ValueError(f"Snapshot inconsistente em {caminho}: formas dos arquivos != metadados")
+
+        self.versao = tuple(self.metadados["versao_avaliacoes"])
+        self.linha_por_nome = {nome: i for i, nome in enumerate(self.produtos_nome.valores())}
+        self.linhas_por_estacao = {}
+        for i, estacao in enumerate(self.produtos_sazonalidade.valores()):
+            self.linhas_por_estacao.setdefault(estacao, []).append(i)
+
+        self.diretorio_fatores = diretorio_fatores
+        self.motor_vizinhos = motor_vizinhos
+        self.vizinhos_item = vizinhos_item
+        self._modelos = {}
+        self._trava = threading.Lock()  # um único treino por motor, mesmo com várias threads
+
+    def atualizado(self, versoes: dict) -> bool:
+        """Se os contadores de versao_dados (`versoes`, lidos do banco) são os da exportação."""
+        exportadas = self.metadados.get("versao_dados", {})
+        return all(versoes.get(tabela, 0) == exportadas.get(tabela, 0) for tabela in TABELAS_CATALOGO)
+
+    def _arquivos(self):
+        """(nome do arquivo, vetor mapeado) de todas as colunas abertas."""
+        for nome in ARQUIVOS_CATALOGO:
+            yield nome, getattr(self, nome)
+        for nome in TEXTOS_CATALOGO:
+            coluna = getattr(self, nome)
+            for parte in PARTES_TEXTO:
+                yield f"{nome}_{parte}", getattr(coluna, parte)
+
+    # ================= produtores =================
+    def posicoes(self, ids) -> np.ndarray:
+        """Posições dos ids informados que existem no catálogo, na ordem recebida."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(self.produtores_ids) or not len(ids):
+            return np.empty(0, dtype=np.int64)
+        posicoes = np.minimum(np.searchsorted(self.produtores_ids, ids), len(self.produtores_ids) - 1)
+        return posicoes[self.produtores_ids[posicoes] == ids]
+
+    def produtor(self, posicao: int) -> ProdutorColunar:
+        """Monta o registro do produtor na posição informada."""
+        lat, lon, nota = (float(self.produtores_lat[posicao]), float(self.produtores_lon[posicao]),
+                          float(self.produtores_nota[posicao]))
+        return ProdutorColunar(
+            id=int(self.produtores_ids[posicao]),
+            nome=self.produtores_nome[posicao],
+            sigla=self.produtores_sigla[posicao],
+            logradouro=self.produtores_logradouro[posicao],
+            lat=None if np.isnan(lat) else lat,
+            lon=None if np.isnan(lon) else lon,
+            nota=None if np.isnan(nota) else nota,
+        )
+
+    def produtores_por_ids(self, ids) -> list[ProdutorColunar]:
+        """Registros dos produtores pelos ids, preservando a ordem (como back.buscar_produtores_por_ids)."""
+        return [self.produtor(int(posicao)) for posicao in self.posicoes(ids)]
+
+    def nomes_produtos(self) -> list[str]:
+        """Nomes dos produtos ordenados por nome."""
+        return sorted(nome for nome in self.linha_por_nome if isinstance(nome, str))
+
+    # ================= filtros espaciais =================
+    def raio(self, lat: float, lon: float, raio: float,
+             formula: str = "haversine") -> tuple[np.ndarray, np.ndarray]:
+        """Retorna (ids, distâncias em km) dos produtores a até `raio` km, em ordem de id.
+
+        A faixa de latitude da caixa delimitadora sai de uma busca binária
+        nas latitudes ordenadas; só essa faixa é lida das colunas mapeadas.
+        """
+        if formula not in FORMULAS:
+            raise ValueError(f"Fórmula desconhecida: {formula}. Use uma de {list(FORMULAS)}")
+        lat_min, lat_max, lon_min, lon_max = caixa_delimitadora(lat, lon, raio, margem=MARGEM_ELIPSOIDE)
+        inicio = np.searchsorted(self.lats_ordenadas, lat_min, side='left')
+        fim = np.searchsorted(self.lats_ordenadas, lat_max, side='right')
+        posicoes = np.sort(self.ordem_lat[inicio:fim])
+
+        lons = self.produtores_lon[posicoes]
+        if lon_min <= lon_max:
+            dentro = (lons >= lon_min) & (lons <= lon_max)
+        else:  # a caixa cruza o antimeridiano
+            dentro = (lons >= lon_min) | (lons <= lon_max)
+        posicoes = posicoes[dentro]
+
+        distancias = FORMULAS[formula](lat, lon, self.produtores_lat[posicoes], lons[dentro])
+        mascara = distancias <= raio
+        return self.produtores_ids[posicoes[mascara]], distancias[mascara]
+
+    def mais_proximos(self, lat: float, lon: float, k: int, formula: str = "haversine",
+                      permitidos: np.ndarray = None, raio_maximo: float = None) -> tuple[np.ndarray, np.ndarray]:
+        """Retorna (ids, distâncias em km) dos k produtores mais próximos, do mais perto ao mais longe.
+
+        Mesmo contrato de IndiceEspacial.mais_proximos. Sem árvore, a
+        pré-seleção usa haversine sobre todos os candidatos e só os mais
+        próximos são refinados pela `formula`; o número de refinados dobra
+        até que a k-ésima distância fique abaixo do limite garantido para
+        quem ficou de fora.
+        """
+        if formula not in FORMULAS:
+            raise ValueError(f"Fórmula desconhecida: {formula}. Use uma de {list(FORMULAS)}")
+        vazio = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+        if permitidos is None:
+            posicoes = self.ordem_lat
+        else:
+            posicoes = self.posicoes(permitidos)
+            posicoes = posicoes[~np.isnan(self.produtores_lat[posicoes]) & ~np.isnan(self.produtores_lon[posicoes])]
+        if k <= 0 or not len(posicoes):
+            return vazio
+
+        esfera = haversine(lat, lon, self.produtores_lat[posicoes], self.produtores_lon[posicoes])
+        if raio_maximo is not None:
+            perto = esfera <= raio_maximo * MARGEM_ELIPSOIDE
+            posicoes, esfera = posicoes[perto], esfera[perto]
+
+        n_refinados = min(len(posicoes), k + max(4, k // 10))
+        while True:
+            if n_refinados < len(posicoes):
+                selecionados = np.argpartition(esfera, n_refinados - 1)[:n_refinados]
+                limite = esfera[selecionados].max() / MARGEM_ELIPSOIDE
+            else:
+                selecionados, limite = np.arange(len(posicoes)), np.inf
+            candidatos = posicoes[selecionados]
+            distancias = FORMULAS[formula](lat, lon, self.produtores_lat[candidatos],
+                                           self.produtores_lon[candidatos])
+            if raio_maximo is not None:
+                dentro = distancias <= raio_maximo
+                candidatos, distancias = candidatos[dentro], distancias[dentro]
+            if len(candidatos) > k:
+                menores = np.argpartition(distancias, k - 1)[:k]
+                candidatos, distancias = candidatos[menores], distancias[menores]
+            if limite == np.inf or (len(candidatos) == k and distancias.max() <= limite):
+                break
+            n_refinados = min(len(posicoes), n_refinados * 2)
+
+        ids = self.produtores_ids[candidatos]
+        ordem = np.lexsort((ids, distancias))
+        return ids[ordem], distancias[ordem]
+
+    # ================= filtros de produtos =================
+    def filtrar(self, todos: list[str] = None, algum: list[str] = None, estacao: str = None) -> np.ndarray:
+        """Ids dos produtores que passam pelos filtros (AND entre eles), como IndiceProdutos.filtrar.
+
+        Produtores sem ofertas também ocupam um bit; partindo da união de
+        todos os produtos, sem nenhum filtro o resultado são os produtores
+        com ofertas, como no índice.
+        """
+        resultado = self._uniao(range(len(self.produtos_ids)))
+        if todos is not None:
+            linhas = self._linhas(todos)
+            if not linhas:
+                return np.empty(0, dtype=np.int64)
+            resultado &= np.bitwise_and.reduce(self.ofertas[linhas], axis=0)
+        if algum is not None:
+            resultado &= self._uniao(self._linhas(algum))
+        if estacao is not None:
+            resultado &= self._uniao(self.linhas_por_estacao.get(estacao, []))
+        bits = np.unpackbits(resultado, count=len(self.produtores_ids)).astype(bool)
+        return self.produtores_ids[bits]
+
+    def _linhas(self, nomes: list[str]) -> list[int]:
+        return [self.linha_por_nome[nome] for nome in dict.fromkeys(nomes or []) if nome in self.linha_por_nome]
+
+    def _uniao(self, linhas: list[int]) -> np.ndarray:
+        if not len(linhas):
+            return np.zeros(self.ofertas.shape[1], dtype=np.uint8)
+        return np.bitwise_or.reduce(self.ofertas[list(linhas)], axis=0)
+
+    # ================= avaliações e recomendações =================
+    def item_item(self) -> ModeloItemItem:
+        """Modelo item-item sobre a similaridade gravada no snapshot."""
+        from scipy.sparse import csr_matrix
+
+        n_produtores = len(self.item_produtores_ids)
+        similaridade = csr_matrix((self.item_similaridades, self.item_indices, self.item_indptr),
+                                  shape=(n_produtores, n_produtores), copy=False)
+        return ModeloItemItem.de_similaridade(self.item_produtores_ids, self.item_media_produtores, similaridade,
+                                              self.metadados["vizinhos_item"])
+
+    def fatores(self) -> ModeloFatores:
+        """Modelo de fatoração sobre os vetores do snapshot (mapeados, sem cópia)."""
+        return ModeloFatores(*(getattr(self, f"fatores_{nome}") for nome in ARQUIVOS_FATORES),
+                             media=self.metadados["fatores"]["media"],
+                             regularizacao=self.metadados["fatores"]["regularizacao"], versao=self.versao)
+
+    def avaliacoes_usuario(self, usuario_id: int) -> tuple[np.ndarray, np.ndarray]:
+        """(produtores, notas) avaliados pelo usuário: fatias dos vetores mapeados, sem cópia."""
+        posicao = int(np.searchsorted(self.avaliacoes_usuarios_ids, usuario_id))
+        if posicao == len(self.avaliacoes_usuarios_ids) or self.avaliacoes_usuarios_ids[posicao] != usuario_id:
+            return self.avaliacoes_produtores[:0], self.avaliacoes_notas[:0]
+        inicio, fim = self.avaliacoes_indptr[posicao], self.avaliacoes_indptr[posicao + 1]
+        return self.avaliacoes_produtores[inicio:fim], self.avaliacoes_notas[inicio:fim]
+
+    def matriz_avaliacoes(self) -> MatrizAvaliacoes:
+        """Monta a matriz esparsa de avaliações a partir das colunas do snapshot."""
+        usuarios = np.repeat(self.avaliacoes_usuarios_ids, np.diff(self.avaliacoes_indptr))
+        return MatrizAvaliacoes(usuarios, self.avaliacoes_produtores, self.avaliacoes_notas)
+
+    def modelo(self, motor: str):
+        """Modelo do motor ("knn", "item" ou "mf"), construído no primeiro uso.
+
+        No motor item a similaridade é a da exportação, a menos que
+        `vizinhos_item` seja diferente do M exportado (aí é recalculada).
+        No motor mf, com `diretorio_fatores` os vetores são os gravados por
+        fatoracao.py; sem ele, os treinados na exportação do snapshot. Nos
+        dois casos são mapeados em memória e nenhuma chamada treina o ALS.
+        """
+        with self._trava:
+            if motor not in self._modelos:
+                if motor == "knn":
+                    from vizinhos_aproximados import criar_busca
+                    self._modelos[motor] = ModeloKNN(self.matriz_avaliacoes(), criar_busca(self.motor_vizinhos))
+                elif motor == "item":
+                    if self.metadados["vizinhos_item"] == self.vizinhos_item:
+                        self._modelos[motor] = self.item_item()
+                    else:
+                        self._modelos[motor] = ModeloItemItem(self.matriz_avaliacoes(), self.vizinhos_item)
+                elif motor == "mf":
+                    if self.diretorio_fatores and diretorio_modelo(self.diretorio_fatores) is not None:
+                        self._modelos[motor] = ModeloFatores.carregar(self.diretorio_fatores)
+                    else:
+                        self._modelos[motor] = self.fatores()
+                else:
+                    raise ValueError(f"Motor de recomendação desconhecido: {motor}")
+            return self._modelos[motor]
+
+    def recomendar(self, usuario_id: int, motor: str = "knn", quantidade: int = 10,
+                   permitidos: np.ndarray = None) -> list[tuple[int, float]]:
+        """Retorna [(produtor_id, nota prevista)] do motor escolhido; usuários sem avaliações recebem []."""
+        # sem avaliações não há o que recomendar em nenhum motor (nem modelo a construir)
+        produtores_avaliados, notas = self.avaliacoes_usuario(usuario_id)
+        if not len(produtores_avaliados):
+            return []
+        modelo = self.modelo(motor)
+        if motor == "knn":
+            return modelo.recomendar(usuario_id, n_vizinhos=20, quantidade=quantidade, permitidos=permitidos)
+        if motor == "item":
+            return modelo.recomendar(produtores_avaliados, notas, quantidade=quantidade, permitidos=permitidos)
+        return modelo.recomendar(usuario_id, produtores_avaliados, notas, quantidade=quantidade,
+                                 permitidos=permitidos)
+
+
+# ================= linha de comando =================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Snapshot colunar (mmap) do catálogo")
+    subcomandos = parser.add_subparsers(dest="comando", required=True)
+
+    exportar = subcomandos.add_parser("exportar", help="grava o snapshot do banco em um diretório")
+    exportar.add_argument("--banco", default="db.db")
+    exportar.add_argument("--saida", default="catalogo")
+    exportar.add_argument("--vizinhos-item", type=int, default=50, help="M do modelo item-item (use o VIZINHOS_ITEM do app)")
+
+    medir = subcomandos.add_parser("medir", help="compara a abertura e os filtros do snapshot com o banco")
+    medir.add_argument("--catalogo", default="catalogo")
+    medir.add_argument("--banco", default="db.db")
+    medir.add_argument("--consultas", type=int, default=200)
+    args = parser.parse_args()
+
+    from db import criar_banco
+
+    if args.comando == "exportar":
+        inicio = time.perf_counter()
+        with Session(criar_banco(args.banco)) as session:
+            metadados = exportar_catalogo(session, args.saida, args.vizinhos_item)
+        print(f"{metadados['produtores']} produtores, {metadados['produtos']} produtos e "
+              f"{metadados['avaliacoes']} avaliações exportados para {args.saida} "
+              f"em {time.perf_counter() - inicio:.2f} s")
+    else:
+        from indice_espacial import IndiceEspacial
+
+        inicio = time.perf_counter()
+        catalogo = CatalogoColunar(args.catalogo)
+        abertura_catalogo = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        with Session(criar_banco(args.banco)) as session:
+            indice = IndiceEspacial()
+            indice.atualizar(session)
+            abertura_banco = time.perf_counter() - inicio
+
+            rng = np.random.default_rng(0)
+            posicoes = rng.choice(catalogo.ordem_lat, size=args.consultas)
+            pontos = [(float(catalogo.produtores_lat[p]), float(catalogo.produtores_lon[p])) for p in posicoes]
+            tempos = {"catalogo": [], "banco": []}
+            for lat, lon in pontos:
+                inicio = time.perf_counter()
+                catalogo.produtores_por_ids(catalogo.raio(lat, lon, 10.0)[0])
+                tempos["catalogo"].append(time.perf_counter() - inicio)
+                inicio = time.perf_counter()
+                ids, _ = indice.raio(session, lat, lon, 10.0)
+                session.query(Produtor).filter(Produtor.id.in_(ids.tolist())).all()
+                session.expunge_all()
+                tempos["banco"].append(time.perf_counter() - inicio)
+
+        print(f"abertura: catálogo {abertura_catalogo * 1000:.1f} ms, banco + índice {abertura_banco * 1000:.1f} ms")
+        for fonte, amostras in tempos.items():
+            p50, p99 = np.percentile(np.array(amostras) * 1000, [50, 99])
+            print(f"raio 10 km + registros ({fonte}): p50 {p50:.2f} ms, p99 {p99:.2f} ms")
@@ -1,16 +1,24 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, ForeignKey, Table
+from sqlalchemy import create_engine, event, case, Column, Index, Integer, String, Float, ForeignKey, Table, func, insert, inspect, select
 from sqlalchemy.orm import relationship, Session, declarative_base
-import pandas as pd
+import argparse
+import os
+from contextlib import contextmanager
+import shutil
+import tempfile
+import time
+import numpy as np
 import random
 from random import randint
-from faker import Faker
 
 Base = declarative_base()
 
 # Tabela de associação para relação muitos-para-muitos entre Produtor e Produto
 produtor_produto = Table('produtor_produto', Base.metadata,
     Column('produtor_id', Integer, ForeignKey('produtores.id')),
-    Column('produto_id', Integer, ForeignKey('produtos.id'))
+    Column('produto_id', Integer, ForeignKey('produtos.id')),
+    # as duas direções da associação; o par é único
+    Index('ux_produtor_produto', 'produtor_id', 'produto_id', unique=True),
+    Index('ix_produtor_produto_produto', 'produto_id', 'produtor_id'),
 )
 
 class Usuario(Base):
@@ -46,12 +54,21 @@ class Produtor(Base):
     __tablename__ = 'produtores'
     
     id = Column(Integer, primary_key=True)
-    nome = Column(String(100), nullable=False)
+    nome = Column(String(100), nullable=False, index=True)
     sigla = Column(String(20))
     logradouro = Column(String(200))
     lat = Column(Float)
     lon = Column(Float)
     nota = Column(Float, default=0)  # Média das avaliações
+    # Soma e quantidade das notas e quantidade de cada nota (histograma),
+    # mantidas pelos gatilhos de GATILHOS_NOTA
+    soma_notas = Column(Integer, nullable=False, server_default="0")
+    num_avaliacoes = Column(Integer, nullable=False, server_default="0")
+    num_notas_1 = Column(Integer, nullable=False, server_default="0")
+    num_notas_2 = Column(Integer, nullable=False, server_default="0")
+    num_notas_3 = Column(Integer, nullable=False, server_default="0")
+    num_notas_4 = Column(Integer, nullable=False, server_default="0")
+    num_notas_5 = Column(Integer, nullable=False, server_default="0")
     
     # Relacionamentos
     avaliacoes = relationship("Avaliacao", back_populates="produtor")
@@ -61,19 +78,24 @@ class Produtor(Base):
         return f"<Produtor(nome='{self.nome}')>"
     
     def calcular_nota_media(self):
-        if not self.avaliacoes:
+        # usa os contadores mantidos pelo banco em vez de carregar todas as avaliações
+        if not self.num_avaliacoes:
             return 0
-        return sum(a.nota for a in self.avaliacoes) / len(self.avaliacoes)
+        return self.soma_notas / self.num_avaliacoes
     
     def atualizar_nota(self):
         self.nota = self.calcular_nota_media()
 
+    def histograma_notas(self) -> dict[int, int]:
+        """Quantidade de avaliações de cada nota ({1: ..., 5: ...}), lida dos contadores."""
+        return {nota: getattr(self, f"num_notas_{nota}") for nota in NOTAS}
+
 class Avaliacao(Base):
     __tablename__ = 'avaliacoes'
     
     id = Column(Integer, primary_key=True)
-    usuario_id = Column(Integer, ForeignKey('usuarios.id'))
-    produtor_id = Column(Integer, ForeignKey('produtores.id'))
+    usuario_id = Column(Integer, ForeignKey('usuarios.id'), index=True)
+    produtor_id = Column(Integer, ForeignKey('produtores.id'), index=True)
     nota = Column(Integer, nullable=False)
     
     # Relacionamentos
@@ -83,72 +105,431 @@ class Avaliacao(Base):
     def __repr__(self):
         return f"<Avaliacao(nota={self.nota})>"
 
+class Recomendacao(Base):
+    __tablename__ = 'recomendacoes'
+
+    id = Column(Integer, primary_key=True)
+    usuario_id = Column(Integer, ForeignKey('usuarios.id'), nullable=False, index=True)
+    produtor_id = Column(Integer, ForeignKey('produtores.id'), nullable=False)
+    pontuacao = Column(Float, nullable=False)  # Nota prevista pelo modelo
+    posicao = Column(Integer, nullable=False)  # 1 = melhor recomendação
+    versao_modelo = Column(String(100), nullable=False)  # Versão das avaliações usadas no treino
+
+    def __repr__(self):
+        return f"<Recomendacao(usuario_id={self.usuario_id}, produtor_id={self.produtor_id}, posicao={self.posicao})>"
+
+# Notas possíveis; cada uma tem seu contador num_notas_<nota> em produtores
+NOTAS = range(1, 6)
+
+def _contar_notas(sinal: str, linha: str) -> str:
+    """Atribuições que somam (ou subtraem) 1 ao contador da nota de NEW/OLD, para os gatilhos."""
+    return ",\n                              ".join(
+        f"num_notas_{nota} = num_notas_{nota} {sinal} ({linha}.nota = {nota})" for nota in NOTAS)
+
+# Gatilhos que mantêm soma_notas, num_avaliacoes, num_notas_* e nota dos produtores
+# em O(1) a cada avaliação inserida, alterada ou removida. No UPDATE do SQLite, as
+# colunas do lado direito ainda têm os valores antigos da linha.
+GATILHOS_NOTA = [
+    f"""CREATE TRIGGER IF NOT EXISTS avaliacoes_nota_insercao AFTER INSERT ON avaliacoes
+    BEGIN
+        UPDATE produtores SET soma_notas = soma_notas + NEW.nota,
+                              num_avaliacoes = num_avaliacoes + 1,
+                              {_contar_notas("+", "NEW")},
+                              nota = CAST(soma_notas + NEW.nota AS REAL) / (num_avaliacoes + 1)
+        WHERE id = NEW.produtor_id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS avaliacoes_nota_remocao AFTER DELETE ON avaliacoes
+    BEGIN
+        UPDATE produtores SET soma_notas = soma_notas - OLD.nota,
+                              num_avaliacoes = num_avaliacoes - 1,
+                              {_contar_notas("-", "OLD")},
+                              nota = CASE WHEN num_avaliacoes > 1
+                                          THEN CAST(soma_notas - OLD.nota AS REAL) / (num_avaliacoes - 1)
+                                          ELSE 0 END
+        WHERE id = OLD.produtor_id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS avaliacoes_nota_alteracao AFTER UPDATE OF nota, produtor_id ON avaliacoes
+    BEGIN
+        UPDATE produtores SET soma_notas = soma_notas - OLD.nota,
+                              num_avaliacoes = num_avaliacoes - 1,
+                              {_contar_notas("-", "OLD")},
+                              nota = CASE WHEN num_avaliacoes > 1
+                                          THEN CAST(soma_notas - OLD.nota AS REAL) / (num_avaliacoes - 1)
+                                          ELSE 0 END
+        WHERE id = OLD.produtor_id;
+        UPDATE produtores SET soma_notas = soma_notas + NEW.nota,
+                              num_avaliacoes = num_avaliacoes + 1,
+                              {_contar_notas("+", "NEW")},
+                              nota = CAST(soma_notas + NEW.nota AS REAL) / (num_avaliacoes + 1)
+        WHERE id = NEW.produtor_id;
+    END""",
+]
+NOMES_GATILHOS_NOTA = ("avaliacoes_nota_insercao", "avaliacoes_nota_remocao", "avaliacoes_nota_alteracao")
+
+def recalcular_notas(conexao) -> int:
+    """Recalcula soma, quantidade, histograma e média de todos os produtores a partir das avaliações (reparo em massa)."""
+    totais = conexao.execute(
+        select(func.sum(Avaliacao.nota), func.count(Avaliacao.id),
+               *(func.sum(case((Avaliacao.nota == nota, 1), else_=0)) for nota in NOTAS), Avaliacao.produtor_id)
+        .group_by(Avaliacao.produtor_id)).all()
+    contadores = ", ".join(f"num_notas_{nota} = ?" for nota in NOTAS)
+    conexao.exec_driver_sql(
+        f"UPDATE produtores SET soma_notas = 0, num_avaliacoes = 0, "
+        f"{', '.join(f'num_notas_{nota} = 0' for nota in NOTAS)}, nota = 0")
+    if totais:
+        conexao.exec_driver_sql(
+            f"UPDATE produtores SET soma_notas = ?, num_avaliacoes = ?, {contadores}, "
+            f"nota = CAST(? AS REAL) / ? WHERE id = ?",
+            [(soma, quantidade, *histograma, soma, quantidade, produtor_id)
+             for soma, quantidade, *histograma, produtor_id in totais])
+    return len(totais)
+
+# ================= engine e migrações =================
+# Configurações aplicadas a cada conexão SQLite aberta por criar_engine
+PRAGMAS = {
+    "journal_mode": "WAL",        # leitores não bloqueiam o escritor
+    "synchronous": "NORMAL",      # seguro com WAL e bem mais rápido que FULL
+    "cache_size": -64_000,        # ~64 MB de cache de páginas (negativo = KiB)
+    "mmap_size": 256 * 2**20,     # leituras via mmap de até 256 MB do arquivo
+    "temp_store": "MEMORY",
+}
+
+def criar_engine(caminho='db.db', **opcoes):
+    """Engine SQLite com as PRAGMAS de desempenho aplicadas em cada conexão nova."""
+    engine = create_engine(f'sqlite:///{caminho}', **opcoes)
+
+    @event.listens_for(engine, "connect")
+    def configurar(conexao_dbapi, _):
+        cursor = conexao_dbapi.cursor()
+        for pragma, valor in PRAGMAS.items():
+            cursor.execute(f"PRAGMA {pragma} = {valor}")
+        cursor.close()
+
+    return engine
+
+# Índices criados pela migração 2 (os mesmos declarados nos modelos acima)
+INDICES = [
+    ("ix_produtores_nome", "produtores", "nome", False),
+    ("ix_avaliacoes_usuario_id", "avaliacoes", "usuario_id", False),
+    ("ix_avaliacoes_produtor_id", "avaliacoes", "produtor_id", False),
+    ("ux_produtor_produto", "produtor_produto", "produtor_id, produto_id", True),
+    ("ix_produtor_produto_produto", "produtor_produto", "produto_id, produtor_id", False),
+]
+
+def _migracao_contadores_nota(conexao):
+    """1: colunas soma_notas/num_avaliacoes e gatilhos que mantêm a nota dos produtores."""
+    colunas = {coluna['name'] for coluna in inspect(conexao).get_columns('produtores')}
+    novas = [coluna for coluna in ('soma_notas', 'num_avaliacoes') if coluna not in colunas]
+    for coluna in novas:
+        conexao.exec_driver_sql(f"ALTER TABLE produtores ADD COLUMN {coluna} INTEGER NOT NULL DEFAULT 0")
+    for gatilho in GATILHOS_NOTA:
+        conexao.exec_driver_sql(gatilho)
+    # bancos antigos: preenche os contadores a partir das avaliações existentes
+    if novas:
+        recalcular_notas(conexao)
+
+def _migracao_indices(conexao):
+    """2: índices de busca e unicidade do par (produtor, produto)."""
+    # remove pares repetidos antes de criar o índice único
+    conexao.exec_driver_sql(
+        "DELETE FROM produtor_produto WHERE rowid NOT IN "
+        "(SELECT min(rowid) FROM produtor_produto GROUP BY produtor_id, produto_id)")
+    for nome, tabela, colunas, unico in INDICES:
+        conexao.exec_driver_sql(
+            f"CREATE {'UNIQUE ' if unico else ''}INDEX IF NOT EXISTS {nome} ON {tabela} ({colunas})")
+    conexao.exec_driver_sql("ANALYZE")
+
+# Tabelas cujas escritas incrementam o contador em versao_dados
+TABELAS_VERSIONADAS = ["produtos", "produtores", "produtor_produto", "usuarios", "avaliacoes"]
+
+def _gatilho_versao(contador: str, tabela: str, operacao: str) -> tuple[str, str]:
+    """(nome, CREATE TRIGGER) do gatilho que incrementa `contador` a cada `operacao` em `tabela`."""
+    nome = f"{contador}_versao_{operacao.split()[0].lower()}"
+    return nome, (f"CREATE TRIGGER IF NOT EXISTS {nome} AFTER {operacao} ON {tabela} "
+                  f"BEGIN UPDATE versao_dados SET versao = versao + 1 WHERE tabela = '{contador}'; END")
+
+def _migracao_versao_dados(conexao):
+    """3: contador de versão por tabela, incrementado por gatilhos a cada escrita."""
+    conexao.exec_driver_sql(
+        "CREATE TABLE IF NOT EXISTS versao_dados (tabela TEXT PRIMARY KEY, versao INTEGER NOT NULL DEFAULT 0)")
+    for tabela in TABELAS_VERSIONADAS:
+        conexao.exec_driver_sql("INSERT OR IGNORE INTO versao_dados (tabela, versao) VALUES (?, 0)", (tabela,))
+        for operacao in ("INSERT", "UPDATE", "DELETE"):
+            conexao.exec_driver_sql(_gatilho_versao(tabela, tabela, operacao)[1])
+
+def _migracao_versao_coordenadas(conexao):
+    """4: contador 'produtores_coordenadas', que só muda com inserções, remoções e alterações de lat/lon.
+
+    Os índices espaciais usam este contador em vez do de 'produtores', que
+    também muda a cada avaliação (os gatilhos de nota atualizam a tabela).
+    """
+    conexao.exec_driver_sql(
+        "INSERT OR IGNORE INTO versao_dados (tabela, versao) VALUES ('produtores_coordenadas', 0)")
+    for operacao in ("INSERT", "UPDATE OF lat, lon", "DELETE"):
+        conexao.exec_driver_sql(_gatilho_versao("produtores_coordenadas", "produtores", operacao)[1])
+
+def _migracao_histograma_notas(conexao):
+    """5: colunas num_notas_1..5 (histograma das notas) nos produtores e gatilhos de nota que as mantêm."""
+    colunas = {coluna['name'] for coluna in inspect(conexao).get_columns('produtores')}
+    for nota in NOTAS:
+        if f"num_notas_{nota}" not in colunas:
+            conexao.exec_driver_sql(f"ALTER TABLE produtores ADD COLUMN num_notas_{nota} INTEGER NOT NULL DEFAULT 0")
+    for nome in NOMES_GATILHOS_NOTA:
+        conexao.exec_driver_sql(f"DROP TRIGGER IF EXISTS {nome}")
+    for gatilho in GATILHOS_NOTA:
+        conexao.exec_driver_sql(gatilho)
+    recalcular_notas(conexao)
+
+# Migrações em ordem; a posição (a partir de 1) é gravada em PRAGMA user_version
+MIGRACOES = [
+    _migracao_contadores_nota,
+    _migracao_indices,
+    _migracao_versao_dados,
+    _migracao_versao_coordenadas,
+    _migracao_histograma_notas,
+]
+
+def migrar(engine) -> int:
+    """Aplica as migrações pendentes, cada uma em sua transação; retorna a versão final do banco."""
+    with engine.connect() as conexao:
+        versao = conexao.exec_driver_sql("PRAGMA user_version").scalar()
+    for numero, migracao in enumerate(MIGRACOES, start=1):
+        if numero <= versao:
+            continue
+        with engine.begin() as conexao:
+            migracao(conexao)
+            conexao.exec_driver_sql(f"PRAGMA user_version = {numero}")
+        versao = numero
+    return versao
+
+def versao_dados(conexao) -> dict[str, int]:
+    """Lê os contadores de escrita de cada tabela ({tabela: versao}) com uma consulta O(1)."""
+    return dict(conexao.exec_driver_sql("SELECT tabela, versao FROM versao_dados").all())
+
 # Criação do banco de dados
-def criar_banco():
-    engine = create_engine('sqlite:///db.db')
+def criar_banco(caminho='db.db', **opcoes):
+    engine = criar_engine(caminho, **opcoes)
     Base.metadata.create_all(engine)
+    migrar(engine)
     return engine
 
-# Função para importar produtos do CSV
-def importar_produtos(session):
-    df = pd.read_csv('data/produtos.csv')
-    produtos = {}
-    
+# ================= relatório de planos de consulta =================
+# Consultas usadas pelo back.py, com parâmetros de exemplo
+CONSULTAS_RELATORIO = {
+    "produtor por nome": "SELECT * FROM produtores WHERE nome = (SELECT nome FROM produtores LIMIT 1)",
+    "avaliações de um usuário": "SELECT * FROM avaliacoes WHERE usuario_id = 1",
+    "avaliações de um produtor (por nome)": (
+        "SELECT p.nome, u.nome, a.nota FROM avaliacoes a JOIN produtores p ON a.produtor_id = p.id "
+        "JOIN usuarios u ON a.usuario_id = u.id WHERE p.nome = (SELECT nome FROM produtores LIMIT 1)"),
+    "produtos de um produtor": (
+        "SELECT pr.* FROM produtos pr JOIN produtor_produto pp ON pr.id = pp.produto_id "
+        "WHERE pp.produtor_id = 1"),
+    "produtores de um produto": "SELECT produtor_id FROM produtor_produto WHERE produto_id IN (1, 2)",
+}
+
+def _planos(conexao) -> dict:
+    """Executa EXPLAIN QUERY PLAN e mede o tempo de cada consulta do relatório."""
+    resultado = {}
+    for nome, sql in CONSULTAS_RELATORIO.items():
+        plano = [linha[-1] for linha in conexao.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}")]
+        inicio = time.perf_counter()
+        conexao.exec_driver_sql(sql).fetchall()
+        resultado[nome] = (plano, (time.perf_counter() - inicio) * 1000)
+    return resultado
+
+def relatorio_planos(caminho='db.db'):
+    """Compara os planos de consulta sem e com os índices, em uma cópia temporária do banco."""
+    with tempfile.TemporaryDirectory() as pasta:
+        copia = os.path.join(pasta, "relatorio.db")
+        shutil.copyfile(caminho, copia)
+        engine = criar_engine(copia)
+        migrar(engine)
+
+        # "antes": remove os índices da migração 2 na cópia
+        with engine.begin() as conexao:
+            for nome, *_ in INDICES:
+                conexao.exec_driver_sql(f"DROP INDEX IF EXISTS {nome}")
+            conexao.exec_driver_sql("PRAGMA user_version = 1")
+            antes = _planos(conexao)
+        migrar(engine)
+        with engine.connect() as conexao:
+            depois = _planos(conexao)
+        engine.dispose()
+
+    print("\n=== PLANOS DE CONSULTA (antes -> depois) ===")
+    for nome in CONSULTAS_RELATORIO:
+        (plano_antes, ms_antes), (plano_depois, ms_depois) = antes[nome], depois[nome]
+        print(f"\n{nome}: {ms_antes:.2f} ms -> {ms_depois:.2f} ms")
+        for linha in plano_antes:
+            print(f"  antes:  {linha}")
+        for linha in plano_depois:
+            print(f"  depois: {linha}")
+    print("==============================\n")
+
+def _gatilhos_versao_insercao(tabela: str) -> list[tuple[str, str, str]]:
+    """(contador, tabela, operação) dos gatilhos de versão disparados por um INSERT em `tabela`."""
+    gatilhos = [(tabela, tabela, "INSERT")]
+    if tabela == "produtores":
+        gatilhos.append(("produtores_coordenadas", "produtores", "INSERT"))
+    elif tabela == "avaliacoes":
+        # os gatilhos de nota fazem um UPDATE em produtores por avaliação
+        gatilhos.append(("produtores", "produtores", "UPDATE"))
+    return gatilhos
+
+@contextmanager
+def _sem_gatilhos(conexao, gatilhos: dict[str, str]):
+    """Remove os gatilhos {nome: CREATE TRIGGER} que existirem e os recria no fim; produz os nomes removidos.
+
+    Como DDL é transacional no SQLite, os gatilhos só somem para a
+    transação corrente: se ela for desfeita, eles voltam junto.
+    """
+    existentes = conexao.exec_driver_sql(
+        f"SELECT name FROM sqlite_master WHERE type = 'trigger' AND name IN ({', '.join('?' * len(gatilhos))})",
+        tuple(gatilhos)).scalars().all()
+    for nome in existentes:
+        conexao.exec_driver_sql(f"DROP TRIGGER {nome}")
+    try:
+        yield existentes
+    finally:
+        for nome in existentes:
+            conexao.exec_driver_sql(gatilhos[nome])
+
+@contextmanager
+def sem_gatilhos_versao(conexao, tabela: str):
+    """Desliga os gatilhos de versão de uma carga em `tabela` e incrementa cada contador uma vez no fim.
+
+    Os gatilhos de versao_dados rodam um UPDATE por linha, o que pesa em
+    uma carga de centenas de milhares de linhas.
+    """
+    contadores, gatilhos = {}, {}
+    for contador, tabela_gatilho, operacao in _gatilhos_versao_insercao(tabela):
+        nome, sql = _gatilho_versao(contador, tabela_gatilho, operacao)
+        contadores[nome], gatilhos[nome] = contador, sql
+    with _sem_gatilhos(conexao, gatilhos) as existentes:
+        yield
+        conexao.exec_driver_sql("UPDATE versao_dados SET versao = versao + 1 WHERE tabela = ?",
+                                [(contadores[nome],) for nome in existentes])
+
+def _inserir_avaliacoes(conexao, sql: str, colunas: list[str], linhas: list):
+    """Insere avaliações sem o gatilho de nota por linha e soma os contadores dos produtores por lote."""
+    with _sem_gatilhos(conexao, {NOMES_GATILHOS_NOTA[0]: GATILHOS_NOTA[0]}) as existentes:
+        conexao.exec_driver_sql(sql, linhas)
+        if not existentes:
+            return
+        valores = np.array([(linha[colunas.index('produtor_id')], linha[colunas.index('nota')]) for linha in linhas],
+                           dtype=np.int64)
+        produtores, posicoes = np.unique(valores[:, 0], return_inverse=True)
+        notas = valores[:, 1]
+        somas = np.bincount(posicoes, weights=notas, minlength=len(produtores)).astype(np.int64)
+        quantidades = np.bincount(posicoes, minlength=len(produtores))
+        histograma = np.column_stack([np.bincount(posicoes, weights=notas == nota, minlength=len(produtores))
+                                      for nota in NOTAS]).astype(np.int64)
+        contadores = ", ".join(f"num_notas_{nota} = num_notas_{nota} + ?" for nota in NOTAS)
+        conexao.exec_driver_sql(
+            f"UPDATE produtores SET soma_notas = soma_notas + ?, num_avaliacoes = num_avaliacoes + ?, {contadores}, "
+            f"nota = CAST(soma_notas + ? AS REAL) / (num_avaliacoes + ?) WHERE id = ?",
+            [(soma, quantidade, *contagens, soma, quantidade, produtor_id)
+             for soma, quantidade, contagens, produtor_id
+             in zip(somas.tolist(), quantidades.tolist(), histograma.tolist(), produtores.tolist())])
+
+# Função auxiliar para inserções em massa
+def inserir_em_lote(conexao, tabela, colunas: list[str], linhas):
+    """Insere tuplas com um executemany direto no driver, sem montar um dicionário por linha.
+
+    Os gatilhos de versão ficam desligados durante o executemany e cada
+    contador afetado sobe uma vez por chamada, não uma vez por linha; nas
+    avaliações, os contadores de nota dos produtores também são somados
+    uma vez por produtor do lote em vez de um UPDATE por avaliação.
+    """
+    linhas = linhas if isinstance(linhas, list) else list(linhas)
+    if not linhas:
+        return
+    sql = str(insert(tabela).compile(dialect=conexao.dialect,
+                                     column_keys=colunas))
+    with sem_gatilhos_versao(conexao, tabela.name):
+        if tabela.name == "avaliacoes":
+            _inserir_avaliacoes(conexao, sql, colunas, linhas)
+        else:
+            conexao.exec_driver_sql(sql, linhas)
+
+# Função para importar produtos do CSV em lote
+def importar_produtos(session, caminho='data/produtos.csv') -> dict[str, int]:
+    """Importa os produtos com um único executemany e retorna {nome: id}."""
+    import pandas as pd  # só a carga do CSV precisa do pandas
+
+    df = pd.read_csv(caminho)
+
     print("Importando produtos...")
-    for _, row in df.iterrows():
+    registros = pd.DataFrame({
+        'nome': df['Nome'],
+        'sazonalidade': df['Sazonalidade'],
+        'descricao': df['Descricao'],
         # Convertendo kcal/100g para inteiro
-        kcal = int(float(row['kcal/100g'])) if not pd.isna(row['kcal/100g']) else 0
-        preco = float(row['Preco/100g']) if not pd.isna(row['Preco/100g']) else 0.0
-        
-        produto = Produto(
-            nome=row['Nome'],
-            sazonalidade=row['Sazonalidade'],
-            descricao=row['Descricao'],
-            kcal_por_100g=kcal,
-            preco_por_100g=preco
-        )
-        session.add(produto)
-        produtos[row['Nome']] = produto
-        
-    session.flush()  # Para gerar os IDs
+        'kcal_por_100g': pd.to_numeric(df['kcal/100g'], errors='coerce').fillna(0).astype(int),
+        'preco_por_100g': pd.to_numeric(df['Preco/100g'], errors='coerce').fillna(0.0).astype(float),
+    })
+    conexao = session.connection()
+    conexao.execute(insert(Produto.__table__), registros.to_dict('records'))
+
+    produtos = dict(conexao.execute(select(Produto.nome, Produto.id)).all())
     print(f"Importados {len(produtos)} produtos")
     return produtos
 
-# Função para importar produtores do CSV com nomes únicos
-def importar_produtores(session, produtos_dict):
-    df = pd.read_csv('data/produtores.csv')
-    produtores = []
-    
+# Função para importar produtores do CSV em lote, com nomes únicos
+def importar_produtores(session, produtos_ids: dict[str, int], caminho='data/produtores.csv',
+                        tamanho_lote: int = 50_000) -> int:
+    """Importa os produtores e a tabela produtor_produto em lotes, sem criar objetos ORM.
+
+    O CSV é lido em pedaços de `tamanho_lote` linhas para manter a memória
+    constante; as colunas de produtos (a partir do índice 5) são derretidas
+    em pares (produtor_id, produto_id) de uma vez por pedaço e tudo é
+    inserido com executemany, na transação da sessão recebida.
+    """
+    import pandas as pd
+
+    conexao = session.connection()
+    proximo_id = (conexao.execute(select(func.max(Produtor.id))).scalar() or 0) + 1
+    total = 0
+
     print("Importando produtores...")
-    
-    # Cada linha do CSV agora será um produtor único
-    for _, row in df.iterrows():
-        # Cria um nome único combinando o nome original e o logradouro
-        nome_completo = f"{row['Nome']} - {row['Logradouro']}"
-        
-        produtor = Produtor(
-            nome=nome_completo,
-            sigla=row['Sigla'],
-            logradouro=row['Logradouro'],
-            lat=row['lat'],
-            lon=row['lon']
-        )
-        session.add(produtor)
-        
-        # Adiciona produtos que são True para este produtor
-        for coluna in df.columns[5:]:  # Colunas dos produtos começam no índice 5
-            if str(row[coluna]).lower() == 'true':
-                if coluna in produtos_dict:
-                    produtor.produtos.append(produtos_dict[coluna])
-        
-        produtores.append(produtor)
-    
-    session.flush()  # Para gerar os IDs
-    print(f"Importados {len(produtores)} produtores únicos")
-    return produtores
+    for df in pd.read_csv(caminho, chunksize=tamanho_lote):
+        # ids atribuídos aqui para ligar os produtos sem consultar o banco de volta
+        df['id'] = range(proximo_id, proximo_id + len(df))
+        proximo_id += len(df)
+
+        produtores = pd.DataFrame({
+            'id': df['id'],
+            # Cria um nome único combinando o nome original e o logradouro
+            'nome': df['Nome'].astype(str) + " - " + df['Logradouro'].astype(str),
+            'sigla': df['Sigla'],
+            'logradouro': df['Logradouro'],
+            'lat': df['lat'],
+            'lon': df['lon'],
+            'nota': 0.0,
+        })
+        produtores = produtores.astype(object).where(produtores.notna(), None)
+        inserir_em_lote(conexao, Produtor.__table__, list(produtores.columns),
+                        produtores.itertuples(index=False, name=None))
+
+        # Colunas dos produtos começam no índice 5; converte para uma matriz
+        # booleana e derrete em pares (produtor, produto) com um único nonzero
+        colunas_produtos = [coluna for coluna in df.columns[5:] if coluna in produtos_ids]
+        ofertas = df[colunas_produtos].apply(
+            lambda coluna: coluna if coluna.dtype == bool else coluna.astype(str).str.lower().eq('true'))
+        linhas, colunas = np.nonzero(ofertas.to_numpy(dtype=bool))
+        ids_produtos = np.array([produtos_ids[coluna] for coluna in colunas_produtos], dtype=np.int64)
+        pares = zip(df['id'].to_numpy()[linhas].tolist(), ids_produtos[colunas].tolist())
+        inserir_em_lote(conexao, produtor_produto, ['produtor_id', 'produto_id'], pares)
+
+        total += len(df)
+
+    print(f"Importados {total} produtores únicos")
+    return total
 
 # Função para criar usuários aleatórios
 def criar_usuarios(session, num_usuarios=30):
+    from faker import Faker  # dependência apenas da geração de dados
+
     print(f"Criando {num_usuarios} usuários aleatórios...")
     fake = Faker('pt_BR')
 
@@ -192,40 +573,37 @@ def criar_avaliacoes(session, usuarios, produtores):
     return avaliacoes
 
 # Função principal para popular o banco
-def popular_banco():
-    engine = criar_banco()
+def popular_banco(caminho='db.db'):
+    engine = criar_banco(caminho)
     with Session(engine) as session:
         # Verifica se o banco já está populado
         if session.query(Produto).count() > 0:
             print("Banco de dados já populado!")
             return
         
-        # Importa produtos e produtores
+        # Importa produtos e produtores em lote, na transação da sessão
         produtos = importar_produtos(session)
-        produtores = importar_produtores(session, produtos)
+        importar_produtores(session, produtos)
+        produtores = session.query(Produtor).all()
         
         # Cria usuários e avaliações aleatórias
         usuarios = criar_usuarios(session, 200)
+        # As notas médias dos produtores são atualizadas pelos gatilhos do banco
         criar_avaliacoes(session, usuarios, produtores)
         
-        # Atualiza as notas médias dos produtores
-        print("Atualizando notas médias dos produtores...")
-        for produtor in produtores:
-            produtor.atualizar_nota()
-        
         # Commit das alterações
         session.commit()
         print("Banco de dados populado com sucesso!")
 
 # Função para exibir estatísticas do banco
-def mostrar_estatisticas():
-    engine = create_engine('sqlite:///db.db')
+def mostrar_estatisticas(caminho='db.db'):
+    engine = criar_engine(caminho)
     with Session(engine) as session:
         
-        num_produtos = session.query(Produto).count()
-        num_produtores = session.query(Produtor).count()
-        num_usuarios = session.query(Usuario).count()
-        num_avaliacoes = session.query(Avaliacao).count()
+        num_produtos = session.query(func.count(Produto.id)).scalar()
+        num_produtores = session.query(func.count(Produtor.id)).scalar()
+        num_usuarios = session.query(func.count(Usuario.id)).scalar()
+        num_avaliacoes = session.query(func.count(Avaliacao.id)).scalar()
         
         print("\n=== ESTATÍSTICAS DO BANCO ===")
         print(f"Produtos: {num_produtos}")
@@ -234,10 +612,193 @@ def mostrar_estatisticas():
         print(f"Avaliações: {num_avaliacoes}")
         print("==============================\n")
 
+# ================= gerador de carga sintética =================
+class _Progresso:
+    """Conta linhas inseridas e imprime a taxa (linhas/s) a cada lote."""
+
+    def __init__(self, tabela: str):
+        self.tabela = tabela
+        self.linhas = 0
+        self.inicio = time.perf_counter()
+
+    def somar(self, quantidade: int):
+        self.linhas += quantidade
+        decorrido = time.perf_counter() - self.inicio
+        taxa = self.linhas / decorrido if decorrido > 0 else 0.0
+        print(f"  {self.tabela}: {self.linhas} linhas ({taxa:,.0f} linhas/s)")
+
+def _pesos_popularidade(rng, quantidade: int, expoente: float) -> np.ndarray:
+    """Probabilidades tipo Zipf (1/posição^expoente) em uma ordem aleatória; expoente 0 = uniforme."""
+    pesos = 1.0 / np.arange(1, quantidade + 1) ** expoente
+    rng.shuffle(pesos)
+    return pesos / pesos.sum()
+
+def gerar_produtores_sinteticos(conexao, rng, quantidade: int, tamanho_lote: int = 50_000,
+                                desvio_graus: float = 0.5, prob_oferta: float = 0.35) -> int:
+    """Cria produtores espalhados em torno dos já existentes, com ofertas aleatórias de produtos."""
+    base = np.array(conexao.execute(
+        select(Produtor.lat, Produtor.lon).where(Produtor.lat.isnot(None))).all(), dtype=np.float64)
+    if base.size == 0:
+        base = np.array([[-15.793889, -47.882778]])  # Brasília
+    produtos_ids = np.array(conexao.execute(select(Produto.id)).scalars().all(), dtype=np.int64)
+    proximo_id = (conexao.execute(select(func.max(Produtor.id))).scalar() or 0) + 1
+
+    progresso = _Progresso("produtores")
+    for inicio in range(0, quantidade, tamanho_lote):
+        n = min(tamanho_lote, quantidade - inicio)
+        ids = np.arange(proximo_id, proximo_id + n)
+        proximo_id += n
+
+        centros = base[rng.integers(0, len(base), n)]
+        coordenadas = centros + rng.normal(0.0, desvio_graus, (n, 2))
+        notas_iniciais = np.zeros(n)
+        nomes = [f"Produtor sintético {id}" for id in ids.tolist()]
+        inserir_em_lote(conexao, Produtor.__table__,
+                        ['id', 'nome', 'sigla', 'logradouro', 'lat', 'lon', 'nota'],
+                        zip(ids.tolist(), nomes, ["SINT"] * n, ["Sintético"] * n,
+                            coordenadas[:, 0].tolist(), coordenadas[:, 1].tolist(), notas_iniciais.tolist()))
+
+        if produtos_ids.size:
+            linhas, colunas = np.nonzero(rng.random((n, len(produtos_ids))) < prob_oferta)
+            inserir_em_lote(conexao, produtor_produto, ['produtor_id', 'produto_id'],
+                            zip(ids[linhas].tolist(), produtos_ids[colunas].tolist()))
+        progresso.somar(n)
+    return quantidade
+
+def gerar_usuarios_sinteticos(conexao, rng, quantidade: int, tamanho_lote: int = 100_000) -> np.ndarray:
+    """Cria usuários com nomes combinados de listas pequenas; retorna os ids criados."""
+    from faker import Faker
+
+    # Faker só é usado para montar as listas de nomes, não uma vez por usuário
+    fake = Faker('pt_BR')
+    fake.seed_instance(int(rng.integers(0, 2**31)))
+    primeiros = np.array([fake.first_name() for _ in range(200)])
+    sobrenomes = np.array([fake.last_name() for _ in range(200)])
+    proximo_id = (conexao.execute(select(func.max(Usuario.id))).scalar() or 0) + 1
+
+    progresso = _Progresso("usuarios")
+    for inicio in range(0, quantidade, tamanho_lote):
+        n = min(tamanho_lote, quantidade - inicio)
+        ids = np.arange(proximo_id + inicio, proximo_id + inicio + n)
+        nomes = np.char.add(np.char.add(primeiros[rng.integers(0, 200, n)], " "),
+                            sobrenomes[rng.integers(0, 200, n)])
+        senhas = [f"{valor:012x}" for valor in rng.integers(0, 2**48, n).tolist()]
+        inserir_em_lote(conexao, Usuario.__table__, ['id', 'nome', 'senha'],
+                        zip(ids.tolist(), nomes.tolist(), senhas))
+        progresso.somar(n)
+    return np.arange(proximo_id, proximo_id + quantidade)
+
+def gerar_avaliacoes_sinteticas(conexao, rng, usuarios_ids: np.ndarray, avaliacoes_min: int = 6,
+                                avaliacoes_max: int = 12, popularidade: float = 0.0,
+                                cauda_usuarios: float = 0.0, tamanho_lote: int = 50_000) -> int:
+    """Cria avaliações para os usuários dados.
+
+    `popularidade` > 0 concentra as avaliações em poucos produtores (Zipf)
+    e `cauda_usuarios` > 0 sorteia a quantidade de avaliações por usuário
+    de uma Pareto, criando alguns usuários muito ativos. Cada produtor tem
+    uma qualidade própria, então suas notas não são puro ruído.
+    """
+    produtores_ids = np.array(conexao.execute(select(Produtor.id)).scalars().all(), dtype=np.int64)
+    n_produtores = len(produtores_ids)
+    if n_produtores == 0:
+        return 0
+    probabilidades = _pesos_popularidade(rng, n_produtores, popularidade)
+    qualidade = rng.normal(3.3, 0.8, n_produtores)
+
+    progresso = _Progresso("avaliacoes")
+    total = 0
+    for inicio in range(0, len(usuarios_ids), tamanho_lote):
+        usuarios = usuarios_ids[inicio:inicio + tamanho_lote]
+        if cauda_usuarios > 0:
+            extras = rng.pareto(cauda_usuarios, len(usuarios)) * (avaliacoes_max - avaliacoes_min) / 2
+            quantidades = avaliacoes_min + extras.astype(np.int64)
+        else:
+            quantidades = rng.integers(avaliacoes_min, avaliacoes_max + 1, len(usuarios))
+        quantidades = np.clip(quantidades, 1, n_produtores)
+
+        # sorteia com reposição e remove os pares repetidos do mesmo usuário
+        repetidos = np.repeat(usuarios, quantidades)
+        colunas = rng.choice(n_produtores, size=len(repetidos), p=probabilidades)
+        pares = np.unique(repetidos * n_produtores + colunas)
+        avaliadores, colunas = pares // n_produtores, pares % n_produtores
+
+        notas = np.clip(np.rint(qualidade[colunas] + rng.normal(0.0, 1.0, len(colunas))), 1, 5)
+        inserir_em_lote(conexao, Avaliacao.__table__, ['usuario_id', 'produtor_id', 'nota'],
+                        zip(avaliadores.tolist(), produtores_ids[colunas].tolist(),
+                            notas.astype(np.int64).tolist()))
+        total += len(pares)
+        progresso.somar(len(pares))
+    return total
+
+def gerar_dados_sinteticos(caminho='db.db', usuarios=10_000, produtores_extras=0,
+                           avaliacoes_min=6, avaliacoes_max=12, popularidade=0.0,
+                           cauda_usuarios=0.0, semente=42):
+    """Gera uma base de carga sintética, importando antes os CSVs se o banco estiver vazio."""
+    engine = criar_banco(caminho)
+    rng = np.random.default_rng(semente)
+    inicio = time.perf_counter()
+
+    with Session(engine) as session:
+        if session.query(Produto).count() == 0:
+            importar_produtores(session, importar_produtos(session))
+        conexao = session.connection()
+
+        if produtores_extras:
+            print(f"Gerando {produtores_extras} produtores sintéticos...")
+            gerar_produtores_sinteticos(conexao, rng, produtores_extras)
+        print(f"Gerando {usuarios} usuários sintéticos...")
+        usuarios_ids = gerar_usuarios_sinteticos(conexao, rng, usuarios)
+
+        # Garante o usuario padrão usado pelo back.py
+        if session.query(Usuario).filter(Usuario.nome == "rafael").count() == 0:
+            usuario_padrao = Usuario(nome="rafael", senha="123")
+            session.add(usuario_padrao)
+            session.flush()
+            usuarios_ids = np.append(usuarios_ids, usuario_padrao.id)
+        print("Gerando avaliações sintéticas...")
+        gerar_avaliacoes_sinteticas(conexao, rng, usuarios_ids, avaliacoes_min, avaliacoes_max,
+                                    popularidade, cauda_usuarios)
+
+        # As notas médias dos produtores já foram atualizadas pelos gatilhos
+        session.commit()
+    print(f"Dados sintéticos gerados em {time.perf_counter() - inicio:.1f} s")
+
 # Exemplo de uso
 if __name__ == "__main__":
-    # Popular o banco
-    popular_banco()
-    
+    parser = argparse.ArgumentParser(description="Cria e popula o banco de dados.")
+    parser.add_argument("--banco", default="db.db", help="arquivo SQLite")
+    subcomandos = parser.add_subparsers(dest="comando")
+
+    gerar = subcomandos.add_parser("gerar", help="gera dados sintéticos em escala para testes de carga")
+    gerar.add_argument("--usuarios", type=int, default=10_000)
+    gerar.add_argument("--produtores-extras", type=int, default=0)
+    gerar.add_argument("--avaliacoes-min", type=int, default=6, help="avaliações mínimas por usuário")
+    gerar.add_argument("--avaliacoes-max", type=int, default=12, help="avaliações máximas por usuário")
+    gerar.add_argument("--popularidade", type=float, default=0.0,
+                       help="expoente Zipf da popularidade dos produtores (0 = uniforme)")
+    gerar.add_argument("--cauda-usuarios", type=float, default=0.0,
+                       help="forma da Pareto de avaliações por usuário (0 = uniforme)")
+    gerar.add_argument("--semente", type=int, default=42)
+
+    subcomandos.add_parser("recalcular-notas", help="recalcula as notas de todos os produtores a partir das avaliações")
+    subcomandos.add_parser("migrar", help="aplica as migrações pendentes (índices, gatilhos)")
+    subcomandos.add_parser("plano-consultas", help="relatório dos planos de consulta antes e depois dos índices")
+    args = parser.parse_args()
+
+    if args.comando == "gerar":
+        gerar_dados_sinteticos(args.banco, args.usuarios, args.produtores_extras,
+                               args.avaliacoes_min, args.avaliacoes_max, args.popularidade,
+                               args.cauda_usuarios, args.semente)
+    elif args.comando == "recalcular-notas":
+        with criar_banco(args.banco).begin() as conexao:
+            print(f"Notas recalculadas para {recalcular_notas(conexao)} produtores")
+    elif args.comando == "migrar":
+        print(f"Banco na versão {migrar(criar_banco(args.banco))}")
+    elif args.comando == "plano-consultas":
+        relatorio_planos(args.banco)
+    else:
+        # Popular o banco
+        popular_banco(args.banco)
+
     # Mostrar estatísticas
-    mostrar_estatisticas()
\ No newline at end of file
+    mostrar_estatisticas(args.banco)
\ No newline at end of file
@@ -0,0 +1,477 @@
+"""Fatoração de matrizes (ALS) das avaliações, com embeddings float32 mapeados do disco.
+
+Cada usuário e cada produtor vira um vetor de `fatores` posições mais um
+viés; a nota prevista é a média global mais os dois vieses mais o
+produto escalar dos vetores. Os vetores são guardados aumentados,
+usuário = [x, viés do usuário, 1] e produtor = [y, 1, viés do produtor],
+para que a previsão seja média + um único produto escalar. O treino
+alterna mínimos quadrados regularizados (ALS) entre usuários e
+produtores, em blocos resolvidos em paralelo por um pool de threads (as
+rotinas de álgebra linear do NumPy liberam o GIL).
+
+O modelo é salvo como arquivos .npy em um subdiretório por versão
+(publicado pela troca atômica do ponteiro de cache_modelo) e carregado com
+mmap: vários processos compartilham as mesmas páginas e só as linhas
+usadas são lidas do disco. Novas avaliações podem ser incorporadas com
+um treino curto a partir dos vetores salvos (atualizar), e usuários que
+não estão no modelo recebem um vetor calculado na hora a partir das suas
+notas (fold-in).
+
+    python fatoracao.py treinar --banco db.db --saida fatores
+    python fatoracao.py atualizar --banco db.db --saida fatores --iteracoes 3
+    python fatoracao.py latencia --usuarios 1000000 --produtores 100000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from cache_modelo import nova_versao_disco, publicar_versao_disco, versao_atual_disco
+from recomendacao import MatrizAvaliacoes, carregar_avaliacoes, versao_avaliacoes
+from sqlalchemy.orm import Session
+
+# Arquivos de cada versão salva; os metadados guardam as formas, conferidas ao carregar
+ARQUIVOS_FATORES = ("usuarios_ids", "produtores_ids", "usuarios", "produtores", "media_produtores")
+ARQUIVO_METADADOS = "metadados.json"
+
+# Hiperparâmetros padrão; numa base sintética "media" com 10% das notas separadas,
+# 16 fatores e regularização 0,3 tiveram o menor RMSE de teste (1,04) e 1/4 do
+# tempo por iteração de 32 fatores
+FATORES = 16
+REGULARIZACAO = 0.3
+
+# Colunas dos vetores aumentados: usuário = [x, viés, 1] e produtor = [y, 1, viés]
+COLUNA_VIES_USUARIO, COLUNA_UM_USUARIO = -2, -1
+COLUNA_UM_PRODUTOR, COLUNA_VIES_PRODUTOR = -2, -1
+
+# Entradas (avaliações) por bloco do ALS: limita a memória das matrizes k×k de cada bloco
+ENTRADAS_POR_BLOCO = 16_384
+
+
+# ================= treino (ALS) =================
+def _blocos(indptr: np.ndarray, max_entradas: int) -> list[tuple[int, int]]:
+    """Divide as linhas de uma matriz CSR em faixas [inicio, fim) com até max_entradas avaliações."""
+    blocos, inicio = [], 0
+    n_linhas = len(indptr) - 1
+    while inicio < n_linhas:
+        fim = int(np.searchsorted(indptr, indptr[inicio] + max_entradas, side='right')) - 1
+        fim = min(max(fim, inicio + 1), n_linhas)  # linhas maiores que o limite ficam sozinhas
+        blocos.append((inicio, fim))
+        inicio = fim
+    return blocos
+
+def _resolver_bloco(matriz, atributos: np.ndarray, desvios: np.ndarray, inicio: int, fim: int,
+                    regularizacao: float, saida: np.ndarray, livres: np.ndarray):
+    """Resolve as posições `livres` dos vetores das linhas [inicio, fim) com o outro lado fixo.
+
+    Para cada linha u com avaliações nas colunas I_u, com F = atributos e
+    d = desvios do outro lado:
+    (F_I^T F_I + regularizacao * |I_u| * Id) x_u = F_I^T (r_u - d_I)
+    """
+    indptr = matriz.indptr[inicio:fim + 1]
+    a, b = indptr[0], indptr[-1]
+    contagens = np.diff(indptr)
+    com_notas = np.flatnonzero(contagens)
+    saida[np.ix_(inicio + np.flatnonzero(contagens == 0), livres)] = 0.0
+    if not len(com_notas):
+        return
+
+    from scipy.sparse import csr_matrix
+
+    indices = matriz.indices[a:b]
+    vetores = atributos[indices]
+    notas = matriz.data[a:b] - desvios[indices]
+    n_entradas, k = vetores.shape
+    if fim - inicio == 1:
+        gram = (vetores.T @ vetores)[None]
+        lado_direito = (vetores.T @ notas)[None]
+    else:
+        # soma por linha das entradas do bloco: matriz esparsa (linhas × entradas) de uns,
+        # com a mesma estrutura de indptr (mais rápido que np.add.reduceat em 3 dimensões)
+        soma = csr_matrix((np.ones(n_entradas, dtype=np.float32), np.arange(n_entradas), indptr - a),
+                          shape=(fim - inicio, n_entradas))
+        externos = (vetores[:, :, None] * vetores[:, None, :]).reshape(n_entradas, k * k)
+        gram = (soma @ externos)[com_notas].reshape(-1, k, k)
+        lado_direito = (soma @ (vetores * notas[:, None]))[com_notas]
+    gram += (regularizacao * contagens[com_notas])[:, None, None] * np.eye(k, dtype=gram.dtype)
+    saida[np.ix_(inicio + com_notas, livres)] = np.linalg.solve(gram, lado_direito[..., None])[..., 0]
+
+def _meia_iteracao(matriz, fixos: np.ndarray, coluna_vies_fixos: int, saida: np.ndarray,
+                   coluna_um_saida: int, regularizacao: float, executor):
+    """Atualiza os vetores aumentados de `saida` (linhas da matriz) com os de `fixos` (colunas).
+
+    O viés do lado fixo vira desvio das notas e a coluna de uns do lado
+    fixo multiplica o viés que está sendo resolvido.
+    """
+    atributos = np.ascontiguousarray(np.delete(fixos, coluna_vies_fixos, axis=1))
+    desvios = np.ascontiguousarray(fixos[:, coluna_vies_fixos])
+    livres = np.delete(np.arange(saida.shape[1]), coluna_um_saida)
+    blocos = _blocos(matriz.indptr, ENTRADAS_POR_BLOCO)
+    list(executor.map(lambda bloco: _resolver_bloco(matriz, atributos, desvios, *bloco, regularizacao,
+                                                    saida, livres), blocos))
+
+def erro_quadratico(matriz, media: float, usuarios: np.ndarray, produtores: np.ndarray,
+                    tamanho_lote: int = 1_000_000) -> float:
+    """RMSE das notas da matriz (CSR usuário×produtor) previstas pelos vetores."""
+    if not matriz.nnz:
+        return 0.0
+    linhas = np.repeat(np.arange(matriz.shape[0]), np.diff(matriz.indptr))
+    soma = 0.0
+    for inicio in range(0, matriz.nnz, tamanho_lote):
+        fatia = slice(inicio, inicio + tamanho_lote)
+        previsao = media + np.einsum('ij,ij->i', usuarios[linhas[fatia]], produtores[matriz.indices[fatia]])
+        soma += float(np.sum((matriz.data[fatia] - previsao) ** 2))
+    return float(np.sqrt(soma / matriz.nnz))
+
+def treinar_als(avaliacoes: MatrizAvaliacoes, fatores: int = FATORES, regularizacao: float = REGULARIZACAO,
+                iteracoes: int = 10, trabalhadores: int = None, usuarios_iniciais: np.ndarray = None,
+                produtores_iniciais: np.ndarray = None, semente: int = 0, verbose: bool = False) -> dict:
+    """Treina os vetores aumentados de usuários e produtores por ALS sobre as notas centradas na média global.
+
+    `usuarios_iniciais`/`produtores_iniciais` (aumentados e alinhados às
+    linhas/colunas da matriz) continuam um treino anterior (warm start);
+    sem eles, os vetores dos produtores começam pequenos e aleatórios, com
+    viés zero.
+    """
+    matriz = avaliacoes.matriz
+    media = float(matriz.data.mean()) if matriz.nnz else 0.0
+    centrada = matriz.copy()
+    centrada.data = centrada.data - np.float32(media)
+    transposta = centrada.T.tocsr()
+
+    rng = np.random.default_rng(semente)
+    n_usuarios, n_produtores = matriz.shape
+    if usuarios_iniciais is None:
+        usuarios = np.zeros((n_usuarios, fatores + 2), dtype=np.float32)
+        usuarios[:, COLUNA_UM_USUARIO] = 1.0
+    else:
+        usuarios = np.array(usuarios_iniciais, dtype=np.float32)
+    if produtores_iniciais is None:
+        produtores = np.zeros((n_produtores, fatores + 2), dtype=np.float32)
+        produtores[:, :fatores] = rng.normal(0, 0.1, (n_produtores, fatores))
+        produtores[:, COLUNA_UM_PRODUTOR] = 1.0
+    else:
+        produtores = np.array(produtores_iniciais, dtype=np.float32)
+
+    historico = []
+    with ThreadPoolExecutor(max_workers=trabalhadores or os.cpu_count() or 1) as executor:
+        for iteracao in range(iteracoes):
+            inicio = time.perf_counter()
+            _meia_iteracao(centrada, produtores, COLUNA_VIES_PRODUTOR, usuarios, COLUNA_UM_USUARIO,
+                           regularizacao, executor)
+            _meia_iteracao(transposta, usuarios, COLUNA_VIES_USUARIO, produtores, COLUNA_UM_PRODUTOR,
+                           regularizacao, executor)
+            historico.append({"iteracao": iteracao + 1, "segundos": time.perf_counter() - inicio,
+                              "rmse": erro_quadratico(matriz, media, usuarios, produtores)})
+            if verbose:
+                print(f"Iteração {iteracao + 1}: RMSE {historico[-1]['rmse']:.4f} "
+                      f"({historico[-1]['segundos']:.2f} s)")
+
+    return {"usuarios": usuarios, "produtores": produtores, "media": media, "historico": historico}
+
+def alinhar_vetores(ids: np.ndarray, ids_anteriores: np.ndarray, vetores_anteriores: np.ndarray,
+                    coluna_um: int, rng: np.random.Generator, escala: float = 0.1) -> np.ndarray:
+    """Vetores aumentados na ordem de `ids`, reaproveitando os de `ids_anteriores`.
+
+    Ids novos começam com fatores aleatórios, viés zero e a coluna de uns.
+    """
+    vetores = np.zeros((len(ids), vetores_anteriores.shape[1]), dtype=np.float32)
+    vetores[:, :-2] = rng.normal(0, escala, (len(ids), vetores_anteriores.shape[1] - 2))
+    vetores[:, coluna_um] = 1.0
+    if len(ids_anteriores):
+        posicoes = np.minimum(np.searchsorted(ids_anteriores, ids), len(ids_anteriores) - 1)
+        conhecidos = ids_anteriores[posicoes] == ids
+        vetores[conhecidos] = vetores_anteriores[posicoes[conhecidos]]
+    return vetores
+
+
+# ================= modelo =================
+class ModeloFatores:
+    """Vetores float32 de usuários e produtores e a pontuação de recomendações sobre eles.
+
+    Carregado com `carregar`, os vetores são np.memmap: pontuar um usuário
+    é um produto matriz-vetor sobre os produtores aumentados (ou só sobre
+    os `permitidos`), sem tocar nos vetores dos outros usuários.
+    """
+
+    def __init__(self, usuarios_ids: np.ndarray, produtores_ids: np.ndarray, usuarios: np.ndarray,
+                 produtores: np.ndarray, media_produtores: np.ndarray, media: float,
+                 regularizacao: float, versao: tuple = None):
+        self.usuarios_ids = usuarios_ids
+        self.produtores_ids = produtores_ids
+        self.usuarios = usuarios
+        self.produtores = produtores
+        self.media_produtores = media_produtores
+        self.media = media
+        self.regularizacao = regularizacao
+        self.versao = versao  # versão das avaliações usadas no treino
+
+    @property
+    def fatores(self) -> int:
+        return self.produtores.shape[1] - 2
+
+    # ================= persistência =================
+    def salvar(self, diretorio: str):
+        """Grava os vetores e os metadados em uma versão nova de `diretorio` e a publica.
+
+        Quem estiver lendo a versão anterior (mmap) continua com ela; o
+        próximo `carregar` já abre a nova, nunca uma mistura das duas.
+        """
+        os.makedirs(diretorio, exist_ok=True)
+        caminho = nova_versao_disco(diretorio)
+        for nome in ARQUIVOS_FATORES:
+            np.save(os.path.join(caminho, f"{nome}.npy"), np.ascontiguousarray(getattr(self, nome)))
+        metadados = {"media": self.media, "regularizacao": self.regularizacao, "fatores": self.fatores,
+                     "versao": list(self.versao) if self.versao is not None else None,
+                     "formas": {nome: list(np.shape(getattr(self, nome))) for nome in ARQUIVOS_FATORES}}
+        with open(os.path.join(caminho, ARQUIVO_METADADOS), 'w') as arquivo:
+            json.dump(metadados, arquivo)
+        publicar_versao_disco(diretorio, caminho)
+
+    @classmethod
+    def carregar(cls, diretorio: str) -> "ModeloFatores":
+        """Abre a versão publicada com os vetores mapeados em memória (somente leitura)."""
+        caminho = diretorio_modelo(diretorio)
+        if caminho is None:
+            raise FileNotFoundError(f"Nenhum modelo de fatores salvo em {diretorio}")
+        with open(os.path.join(caminho, ARQUIVO_METADADOS)) as arquivo:
+            metadados = json.load(arquivo)
+        arrays = {nome: np.load(os.path.join(caminho, f"{nome}.npy"), mmap_mode='r') for nome in ARQUIVOS_FATORES}
+        formas = {nome: list(vetor.shape) for nome, vetor in arrays.items()}
+        if "formas" in metadados and formas != metadados["formas"]:
+            raise ValueError(f"Modelo em {caminho} inconsistente: formas {formas} != metadados {metadados['formas']}")
+        versao = tuple(metadados["versao"]) if metadados.get("versao") is not None else None
+        return cls(**arrays, media=metadados["media"], regularizacao=metadados["regularizacao"], versao=versao)
+
+    # ================= consultas =================
+    def colunas(self, produtores_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Retorna (colunas, máscara) dos produtores informados que existem no modelo."""
+        produtores_ids = np.asarray(produtores_ids, dtype=np.int64)
+        if not len(self.produtores_ids):
+            return np.empty(0, dtype=np.int64), np.zeros(len(produtores_ids), dtype=bool)
+        posicoes = np.minimum(np.searchsorted(self.produtores_ids, produtores_ids), len(self.produtores_ids) - 1)
+        conhecidos = self.produtores_ids[posicoes] == produtores_ids
+        return posicoes[conhecidos], conhecidos
+
+    def dobrar(self, produtores_avaliados: np.ndarray, notas: np.ndarray) -> np.ndarray:
+        """Calcula o vetor aumentado de um usuário a partir das suas notas, com os produtores fixos (fold-in)."""
+        vetor = np.zeros(self.fatores + 2, dtype=np.float32)
+        vetor[COLUNA_UM_USUARIO] = 1.0
+        colunas, conhecidos = self.colunas(produtores_avaliados)
+        if not len(colunas):
+            return vetor
+        produtores = np.asarray(self.produtores[colunas], dtype=np.float64)
+        atributos = produtores[:, :-1]  # [y, 1]: resolve [x, viés do usuário]
+        residuos = np.asarray(notas, dtype=np.float64)[conhecidos] - self.media - produtores[:, COLUNA_VIES_PRODUTOR]
+        gram = atributos.T @ atributos + self.regularizacao * len(colunas) * np.eye(self.fatores + 1)
+        vetor[:-1] = np.linalg.solve(gram, atributos.T @ residuos)
+        return vetor
+
+    def vetor_usuario(self, usuario_id: int, produtores_avaliados: np.ndarray, notas: np.ndarray) -> np.ndarray:
+        """Vetor aumentado salvo do usuário; usuários fora do modelo recebem o vetor por fold-in das notas."""
+        posicao = int(np.searchsorted(self.usuarios_ids, usuario_id))
+        if posicao < len(self.usuarios_ids) and self.usuarios_ids[posicao] == usuario_id:
+            return np.asarray(self.usuarios[posicao])
+        return self.dobrar(produtores_avaliados, notas)
+
+    def recomendar(self, usuario_id: int, produtores_avaliados: np.ndarray, notas: np.ndarray,
+                   quantidade: int = 10, nota_minima: float = 3.0,
+                   permitidos: np.ndarray = None) -> list[tuple[int, float]]:
+        """Retorna [(produtor_id, nota prevista)] ordenados da maior para a menor nota prevista.
+
+        Entram apenas produtores não avaliados pelo usuário, com média geral
+        >= nota_minima e, se informado, presentes em `permitidos` (ids).
+        Empates são desfeitos pelo id do produtor.
+        """
+        if not len(produtores_avaliados) or not len(self.produtores_ids):
+            return []
+        vetor = self.vetor_usuario(usuario_id, produtores_avaliados, notas)
+
+        # produtores já avaliados e de média baixa ficam com -inf em vez de serem removidos
+        avaliadas, _ = self.colunas(produtores_avaliados)
+        if permitidos is None:
+            candidatos = np.arange(len(self.produtores_ids))
+            pontuacoes = self.produtores @ vetor
+            pontuacoes[avaliadas] = -np.inf
+        else:
+            candidatos, _ = self.colunas(permitidos)
+            pontuacoes = self.produtores[candidatos] @ vetor
+            pontuacoes[np.isin(candidatos, avaliadas)] = -np.inf
+        pontuacoes[self.media_produtores[candidatos] < nota_minima] = -np.inf
+
+        if len(candidatos) > quantidade:
+            melhores = np.argpartition(-pontuacoes, quantidade - 1)[:quantidade]
+            candidatos, pontuacoes = candidatos[melhores], pontuacoes[melhores]
+        produtores_ids = self.produtores_ids[candidatos]
+        ordem = [i for i in np.lexsort((produtores_ids, -pontuacoes)) if np.isfinite(pontuacoes[i])]
+        return [(int(produtores_ids[i]), float(self.media + pontuacoes[i])) for i in ordem]
+
+
+def modelo_de_treino(avaliacoes: MatrizAvaliacoes, treino: dict, regularizacao: float,
+                     versao: tuple = None) -> ModeloFatores:
+    """Monta o ModeloFatores a partir da matriz de avaliações e do resultado de treinar_als."""
+    return ModeloFatores(avaliacoes.usuarios_ids, avaliacoes.produtores_ids, treino["usuarios"],
+                         treino["produtores"], avaliacoes.media_produtores.astype(np.float32),
+                         treino["media"], regularizacao, versao)
+
+
+# ================= construção para o back.py =================
+def diretorio_modelo(diretorio: str) -> str | None:
+    """Subdiretório da versão publicada, o próprio `diretorio` se ele guardar um modelo sem versões, ou None."""
+    caminho = versao_atual_disco(diretorio)
+    if caminho is None and os.path.exists(os.path.join(diretorio, ARQUIVO_METADADOS)):
+        caminho = diretorio
+    return caminho
+
+def versao_fatores(session: Session, diretorio: str = None) -> tuple:
+    """Versão do modelo servido: a versão publicada em disco ou, sem ela, a versão das avaliações.
+
+    Com um diretório salvo o modelo só muda quando `treinar`/`atualizar`
+    publicam uma versão nova; avaliações novas de quem já está no modelo
+    só entram no próximo treino.
+    """
+    caminho = diretorio_modelo(diretorio) if diretorio else None
+    if caminho is not None:
+        try:
+            return ("disco", caminho, os.stat(os.path.join(caminho, ARQUIVO_METADADOS)).st_mtime_ns)
+        except OSError:
+            pass
+    return versao_avaliacoes(session)
+
+def construir_modelo_fatores(session: Session, diretorio: str = None, **parametros) -> ModeloFatores:
+    """Carrega o modelo salvo em `diretorio`; sem ele, treina com as avaliações (e salva, se houver diretório)."""
+    if diretorio and diretorio_modelo(diretorio) is not None:
+        return ModeloFatores.carregar(diretorio)
+    versao = versao_avaliacoes(session)
+    avaliacoes = MatrizAvaliacoes(*carregar_avaliacoes(session))
+    regularizacao = parametros.pop("regularizacao", REGULARIZACAO)
+    modelo = modelo_de_treino(avaliacoes, treinar_als(avaliacoes, regularizacao=regularizacao, **parametros),
+                              regularizacao, versao)
+    if diretorio:
+        modelo.salvar(diretorio)
+        return ModeloFatores.carregar(diretorio)
+    return modelo
+
+def continuar_treino(avaliacoes: MatrizAvaliacoes, anterior: ModeloFatores, iteracoes: int = 3,
+                     trabalhadores: int = None, semente: int = 0, versao: tuple = None,
+                     verbose: bool = False) -> ModeloFatores:
+    """Modelo novo para `avaliacoes` com poucas iterações de ALS a partir dos vetores de `anterior` (warm start)."""
+    rng = np.random.default_rng(semente)
+    treino = treinar_als(
+        avaliacoes, anterior.fatores, anterior.regularizacao, iteracoes, trabalhadores,
+        usuarios_iniciais=alinhar_vetores(avaliacoes.usuarios_ids, anterior.usuarios_ids, anterior.usuarios,
+                                          COLUNA_UM_USUARIO, rng, 0.0),
+        produtores_iniciais=alinhar_vetores(avaliacoes.produtores_ids, anterior.produtores_ids,
+                                            anterior.produtores, COLUNA_UM_PRODUTOR, rng),
+        verbose=verbose,
+    )
+    return modelo_de_treino(avaliacoes, treino, anterior.regularizacao, versao)
+
+def atualizar_fatores(session: Session, anterior: ModeloFatores, iteracoes: int = 3,
+                      trabalhadores: int = None) -> ModeloFatores:
+    """Incorpora as avaliações atuais a `anterior` em memória (usado pelo back.py em segundo plano)."""
+    versao = versao_avaliacoes(session)
+    return continuar_treino(MatrizAvaliacoes(*carregar_avaliacoes(session)), anterior, iteracoes, trabalhadores,
+                            versao=versao)
+
+def atualizar_modelo(session: Session, diretorio: str, iteracoes: int = 3, trabalhadores: int = None,
+                     semente: int = 0, verbose: bool = False) -> ModeloFatores:
+    """Incorpora as avaliações atuais ao modelo salvo com poucas iterações a partir dos vetores dele."""
+    anterior = ModeloFatores.carregar(diretorio)
+    versao = versao_avaliacoes(session)
+    modelo = continuar_treino(MatrizAvaliacoes(*carregar_avaliacoes(session)), anterior, iteracoes,
+                              trabalhadores, semente, versao, verbose)
+    modelo.salvar(diretorio)
+    return ModeloFatores.carregar(diretorio)
+
+
+# ================= latência em escala =================
+def medir_latencia(usuarios: int = 1_000_000, produtores: int = 100_000, fatores: int = FATORES,
+                   consultas: int = 2000, fracao_permitidos: float = 0.05, semente: int = 0) -> dict:
+    """Mede a pontuação de um usuário com vetores aleatórios do tamanho pedido, salvos e lidos por mmap.
+
+    Retorna p50/p99 (ms) da pontuação sobre todos os produtores e restrita
+    a uma fração deles (como depois de um filtro de distância/preferência).
+    """
+    rng = np.random.default_rng(semente)
+    with tempfile.TemporaryDirectory() as diretorio:
+        ModeloFatores(
+            np.arange(1, usuarios + 1, dtype=np.int64), np.arange(1, produtores + 1, dtype=np.int64),
+            rng.normal(0, 0.1, (usuarios, fatores + 2)).astype(np.float32),
+            rng.normal(0, 0.1, (produtores, fatores + 2)).astype(np.float32),
+            rng.uniform(1, 5, produtores).astype(np.float32), 3.5, 0.1,
+        ).salvar(diretorio)
+        tamanho_mb = sum(os.path.getsize(os.path.join(diretorio_modelo(diretorio), f"{nome}.npy"))
+                         for nome in ARQUIVOS_FATORES) / 2**20
+        modelo = ModeloFatores.carregar(diretorio)
+
+        resultados = {"usuarios": usuarios, "produtores": produtores, "fatores": fatores,
+                      "tamanho_mb": tamanho_mb}
+        n_permitidos = max(1, int(produtores * fracao_permitidos))
+        for nome, restringir in (("todos", False), ("permitidos", True)):
+            tempos = []
+            for _ in range(consultas):
+                usuario_id = int(rng.integers(1, usuarios + 1))
+                avaliados = rng.integers(1, produtores + 1, 9)
+                permitidos = np.sort(rng.choice(produtores, n_permitidos, replace=False) + 1) if restringir else None
+                inicio = time.perf_counter()
+                modelo.recomendar(usuario_id, avaliados, np.full(9, 4.0), permitidos=permitidos)
+                tempos.append(time.perf_counter() - inicio)
+            ms = np.array(tempos) * 1000
+            resultados[nome] = {"p50_ms": float(np.percentile(ms, 50)), "p99_ms": float(np.percentile(ms, 99))}
+        del modelo  # fecha os mmaps antes de apagar o diretório
+    return resultados
+
+
+if __name__ == "__main__":
+    from db import criar_engine, migrar
+
+    parser = argparse.ArgumentParser(description="Treina e mede o modelo de fatoração de matrizes (ALS).")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    treinar = comandos.add_parser("treinar", help="treina do zero e grava os vetores em --saida")
+    atualizar = comandos.add_parser("atualizar", help="continua o treino salvo com as avaliações atuais")
+    for comando in (treinar, atualizar):
+        comando.add_argument("--banco", default="db.db", help="arquivo SQLite")
+        comando.add_argument("--saida", default="fatores", help="diretório do modelo (use o mesmo em CAMINHO_FATORES)")
+        comando.add_argument("--trabalhadores", type=int, default=None, help="threads do ALS (padrão: núcleos)")
+    treinar.add_argument("--fatores", type=int, default=FATORES)
+    treinar.add_argument("--regularizacao", type=float, default=REGULARIZACAO)
+    treinar.add_argument("--iteracoes", type=int, default=10)
+    atualizar.add_argument("--iteracoes", type=int, default=3)
+
+    latencia = comandos.add_parser("latencia", help="mede a pontuação com vetores aleatórios em escala")
+    latencia.add_argument("--usuarios", type=int, default=1_000_000)
+    latencia.add_argument("--produtores", type=int, default=100_000)
+    latencia.add_argument("--fatores", type=int, default=FATORES)
+    latencia.add_argument("--consultas", type=int, default=2000)
+    args = parser.parse_args()
+
+    if args.comando == "latencia":
+        resultados = medir_latencia(args.usuarios, args.produtores, args.fatores, args.consultas)
+        print(f"\nVetores: {resultados['usuarios']} usuários × {resultados['produtores']} produtores × "
+              f"{resultados['fatores']} fatores ({resultados['tamanho_mb']:.0f} MB em disco)")
+        print(f"Todos os produtores: p50 {resultados['todos']['p50_ms']:.2f} ms, p99 {resultados['todos']['p99_ms']:.2f} ms")
+        print(f"5% dos produtores:   p50 {resultados['permitidos']['p50_ms']:.2f} ms, "
+              f"p99 {resultados['permitidos']['p99_ms']:.2f} ms")
+    else:
+        engine = criar_engine(args.banco)
+        migrar(engine)  # versao_avaliacoes depende da tabela versao_dados
+        inicio = time.perf_counter()
+        with Session(engine) as session:
+            if args.comando == "treinar" or diretorio_modelo(args.saida) is None:
+                versao = versao_avaliacoes(session)
+                avaliacoes = MatrizAvaliacoes(*carregar_avaliacoes(session))
+                regularizacao = getattr(args, "regularizacao", REGULARIZACAO)
+                treino = treinar_als(avaliacoes, getattr(args, "fatores", FATORES), regularizacao,
+                                     args.iteracoes, args.trabalhadores, verbose=True)
+                modelo = modelo_de_treino(avaliacoes, treino, regularizacao, versao)
+                modelo.salvar(args.saida)
+            else:
+                modelo = atualizar_modelo(session, args.saida, args.iteracoes, args.trabalhadores, verbose=True)
+        print(f"\nUsuários: {len(modelo.usuarios_ids)}, produtores: {len(modelo.produtores_ids)}, "
+              f"fatores: {modelo.fatores}")
+        print(f"Tempo: {time.perf_counter() - inicio:.2f} s")
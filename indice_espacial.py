@@ -0,0 +1,320 @@
+from collections import OrderedDict
+
+import numpy as np
+from db import Produtor, versao_dados
+from distancia import FORMULAS, RAIO_TERRA_KM, MotorDistancia, haversine, versao_produtores
+from instrumentacao import registrar_cache
+from sqlalchemy.orm import Session
+
+# Margem aplicada ao raio na busca pela árvore (esfera) antes do refinamento
+# exato: a diferença entre esfera e elipsoide WGS-84 fica abaixo de 0,6%
+MARGEM_ELIPSOIDE = 1.01
+
+# ================= cache de candidatos por célula =================
+# Baldes de raio (km): uma busca usa o menor balde >= raio. Acima do último
+# balde a busca vai direto à árvore.
+BALDES_RAIO = (1, 2, 5, 10, 15, 20, 25, 30, 40, 50, 60, 75, 100)
+
+# Meia diagonal aproximada (km, no equador) da célula geohash de cada precisão;
+# cada balde usa a maior célula com meia diagonal <= balde / 2, então os
+# candidatos cobrem no máximo ~2,25x a área de uma busca exata
+MEIA_DIAGONAL_GEOHASH = {3: 110.0, 4: 21.8, 5: 3.46, 6: 0.68, 7: 0.108, 8: 0.021}
+PRECISAO_POR_BALDE = {
+    balde: min(p for p, meia in MEIA_DIAGONAL_GEOHASH.items() if meia <= balde / 2) for balde in BALDES_RAIO
+}
+
+BASE32_GEOHASH = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+def geohash(lat: float, lon: float, precisao: int) -> tuple[str, tuple[float, float, float, float]]:
+    """Retorna o geohash do ponto e a caixa da célula (lat_min, lat_max, lon_min, lon_max)."""
+    lat_min, lat_max, lon_min, lon_max = -90.0, 90.0, -180.0, 180.0
+    codigo, bits, valor, longitude = [], 0, 0, True
+    while len(codigo) < precisao:
+        # bits alternados, começando pela longitude; cada caractere carrega 5 bits
+        if longitude:
+            meio = (lon_min + lon_max) / 2
+            valor = valor * 2 + (lon >= meio)
+            lon_min, lon_max = (meio, lon_max) if lon >= meio else (lon_min, meio)
+        else:
+            meio = (lat_min + lat_max) / 2
+            valor = valor * 2 + (lat >= meio)
+            lat_min, lat_max = (meio, lat_max) if lat >= meio else (lat_min, meio)
+        longitude = not longitude
+        bits += 1
+        if bits == 5:
+            codigo.append(BASE32_GEOHASH[valor])
+            bits, valor = 0, 0
+    return "".join(codigo), (lat_min, lat_max, lon_min, lon_max)
+
+
+class CacheCelulas:
+    """LRU de candidatos (ids, lats, lons) por (célula geohash, balde de raio).
+
+    Os candidatos de uma entrada cobrem qualquer ponto da célula com raio
+    até o balde; a busca exata só refina as distâncias desse conjunto.
+    Deve ser limpo sempre que as coordenadas dos produtores mudam.
+    """
+
+    def __init__(self, capacidade: int = 512):
+        self.capacidade = capacidade
+        self.entradas = OrderedDict()
+        self.acertos = 0
+        self.falhas = 0
+
+    def limpar(self):
+        self.entradas.clear()
+
+    def obter(self, chave, construir):
+        """Retorna a entrada da chave, construindo-a (e descartando a menos usada) se preciso."""
+        entrada = self.entradas.get(chave)
+        registrar_cache("celulas_raio", entrada is not None)
+        if entrada is not None:
+            self.acertos += 1
+            self.entradas.move_to_end(chave)
+            return entrada
+        self.falhas += 1
+        entrada = self.entradas[chave] = construir()
+        if len(self.entradas) > self.capacidade:
+            self.entradas.popitem(last=False)
+        return entrada
+
+
+class IndiceEspacial(MotorDistancia):
+    """Índice espacial (BallTree com métrica haversine) sobre as coordenadas dos produtores.
+
+    A árvore é construída uma vez; produtores novos entram em uma área de
+    pendentes, percorrida linearmente, até que ela fique grande o bastante
+    para justificar a reconstrução. As distâncias finais são sempre
+    refinadas com a fórmula escolhida (ver distancia.FORMULAS).
+    """
+
+    NOME_CACHE = "indice_espacial"
+
+    def __init__(self, min_pendentes: int = 256, fracao_pendentes: float = 0.1,
+                 capacidade_celulas: int = 512):
+        super().__init__()
+        self.celulas = CacheCelulas(capacidade_celulas)  # capacidade 0 desliga o cache
+        self.min_pendentes = min_pendentes
+        self.fracao_pendentes = fracao_pendentes
+        self.arvore = None
+        self.n_indexados = 0  # os primeiros n_indexados pontos estão na árvore
+        self.ordem_lat = np.empty(0, dtype=np.int64)  # posições indexadas ordenadas por latitude
+        self.lats_ordenadas = np.empty(0, dtype=np.float64)
+
+    # ================= manutenção =================
+    def invalidar(self):
+        """Força a reconstrução completa do índice na próxima consulta."""
+        super().invalidar()
+        self.arvore = None
+        self.n_indexados = 0
+        self.celulas.limpar()
+
+    def reconstruir(self):
+        """Reconstrói a árvore com todos os pontos, incluindo os pendentes."""
+        from sklearn.neighbors import BallTree  # scikit-learn só é carregado na primeira construção
+
+        self.n_indexados = len(self.ids)
+        if self.n_indexados:
+            self.arvore = BallTree(np.radians(np.column_stack([self.lats, self.lons])),
+                                   metric='haversine')
+        else:
+            self.arvore = None
+        self.ordem_lat = np.argsort(self.lats, kind='stable')
+        self.lats_ordenadas = self.lats[self.ordem_lat]
+
+    def adicionar(self, ids, lats, lons):
+        """Adiciona produtores ao índice sem reconstruir a árvore imediatamente."""
+        self.ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+        self.lats = np.concatenate([self.lats, np.asarray(lats, dtype=np.float64)])
+        self.lons = np.concatenate([self.lons, np.asarray(lons, dtype=np.float64)])
+
+        pendentes = len(self.ids) - self.n_indexados
+        if pendentes > max(self.min_pendentes, self.fracao_pendentes * self.n_indexados):
+            self.reconstruir()
+
+    def atualizar(self, session: Session, versoes: dict = None):
+        """Sincroniza o índice com a tabela de produtores.
+
+        Se desde a última sincronização houve apenas inserções, somente os
+        produtores novos são carregados; qualquer outra mudança reconstrói tudo.
+        """
+        if versoes is None:
+            versoes = versao_dados(session.connection())
+        versao = versao_produtores(session, versoes)
+        registrar_cache(self.NOME_CACHE, versao == self.versao)
+        if versao == self.versao:
+            return
+        self.celulas.limpar()  # candidatos em cache podem ter ficado errados
+
+        if self.versao is not None and self.arvore is not None:
+            novos = (
+                session.query(Produtor.id, Produtor.lat, Produtor.lon)
+                .filter(Produtor.id > (self.maior_id or 0))
+                .order_by(Produtor.id)
+                .all()
+            )
+            # só inserções desde a última sincronização: o contador andou uma vez por produtor novo
+            if self.versao[0] + len(novos) == versao[0]:
+                if novos:
+                    self.maior_id = novos[-1][0]
+                novos = [linha for linha in novos if linha[1] is not None and linha[2] is not None]
+                if novos:
+                    ids, lats, lons = zip(*novos)
+                    self.adicionar(ids, lats, lons)
+                self.versao = versao
+                return
+
+        super().atualizar(session, versoes)
+        self.reconstruir()
+
+    # ================= consultas =================
+    def raio(self, session: Session, lat: float, lon: float, raio: float,
+             formula: str = "haversine", versoes: dict = None) -> tuple[np.ndarray, np.ndarray]:
+        """Retorna (ids, distâncias em km) dos produtores a até `raio` km, na ordem da tabela.
+
+        Raios até o último de BALDES_RAIO usam os candidatos em cache da
+        célula geohash do ponto; os demais consultam a árvore diretamente.
+        """
+        if formula not in FORMULAS:
+            raise ValueError(f"Fórmula desconhecida: {formula}. Use uma de {list(FORMULAS)}")
+        with self._trava:
+            self.atualizar(session, versoes)
+
+            balde = next((balde for balde in BALDES_RAIO if balde >= raio), None)
+            if self.celulas.capacidade and balde is not None:
+                celula, caixa = geohash(lat, lon, PRECISAO_POR_BALDE[balde])
+                ids, lats, lons = self.celulas.obter(
+                    (celula, balde), lambda: self._candidatos_celula(caixa, balde))
+            else:
+                ids, lats, lons = self._candidatos_raio(lat, lon, raio)
+
+        distancias = FORMULAS[formula](lat, lon, lats, lons)
+        mascara = distancias <= raio
+        return ids[mascara], distancias[mascara]
+
+    def _candidatos_raio(self, lat: float, lon: float, raio: float) -> tuple[np.ndarray, ...]:
+        """(ids, lats, lons) de um superconjunto dos produtores a até `raio` km, na ordem da tabela."""
+        candidatos = self._posicoes_pendentes()
+        if self.arvore is not None:
+            raio_rad = raio * MARGEM_ELIPSOIDE / RAIO_TERRA_KM
+            indexados = self.arvore.query_radius(np.radians([[lat, lon]]), r=raio_rad)[0]
+            candidatos = np.concatenate([indexados, candidatos])
+        candidatos = np.sort(candidatos)
+        return self.ids[candidatos], self.lats[candidatos], self.lons[candidatos]
+
+    def _candidatos_celula(self, caixa: tuple, balde: float) -> tuple[np.ndarray, ...]:
+        """(ids, lats, lons) dos produtores a até `balde` km de algum ponto da célula `caixa`.
+
+        Busca a partir do centro da célula com o raio do balde somado à maior
+        distância do centro até um canto; os candidatos são filtrados por
+        haversine para caber no cache.
+        """
+        lat_min, lat_max, lon_min, lon_max = caixa
+        centro_lat, centro_lon = (lat_min + lat_max) / 2, (lon_min + lon_max) / 2
+        meia_diagonal = float(haversine(centro_lat, centro_lon, np.array([lat_min, lat_max]),
+                                        np.array([lon_min, lon_max])).max())
+        alcance = balde * MARGEM_ELIPSOIDE + meia_diagonal
+
+        ids, lats, lons = self._candidatos_raio(centro_lat, centro_lon, alcance)
+        mascara = haversine(centro_lat, centro_lon, lats, lons) <= alcance
+        return ids[mascara], lats[mascara], lons[mascara]
+
+    def dentro_do_raio(self, session: Session, lat: float, lon: float, raio: float,
+                       formula: str = "haversine", versoes: dict = None) -> tuple[np.ndarray, np.ndarray]:
+        """Mesma interface de MotorDistancia.dentro_do_raio, atendida pelo índice."""
+        return self.raio(session, lat, lon, raio, formula, versoes)
+
+    def mais_proximos(self, session: Session, lat: float, lon: float, k: int,
+                      formula: str = "haversine", permitidos: np.ndarray = None,
+                      raio_maximo: float = None, versoes: dict = None) -> tuple[np.ndarray, np.ndarray]:
+        """Retorna (ids, distâncias em km) dos k produtores mais próximos, do mais perto ao mais longe.
+
+        A árvore devolve os candidatos em ordem de distância na esfera; a
+        busca para assim que a k-ésima distância refinada fica abaixo do
+        limite garantido para quem ficou de fora (distância do último
+        candidato / MARGEM_ELIPSOIDE) e, se não fica, dobra o número de
+        candidatos. `permitidos` (ids ordenados, ex.: de indice_produtos)
+        restringe o resultado; se for pequeno em relação ao total, as
+        distâncias são calculadas direto sobre ele. `raio_maximo` descarta
+        quem estiver mais longe. Os k menores saem de uma seleção parcial
+        (argpartition), sem ordenar todos os candidatos.
+        """
+        if formula not in FORMULAS:
+            raise ValueError(f"Fórmula desconhecida: {formula}. Use uma de {list(FORMULAS)}")
+        vazio = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64))
+        if k <= 0:
+            return vazio
+
+        with self._trava:
+            self.atualizar(session, versoes)
+            if not len(self.ids):
+                return vazio
+            if permitidos is not None:
+                permitidos = np.asarray(permitidos, dtype=np.int64)
+                if len(permitidos) <= len(self.ids) // 8:
+                    # filtro seletivo: mais barato medir só os permitidos (ids estão em ordem crescente)
+                    posicoes = np.minimum(np.searchsorted(self.ids, permitidos), len(self.ids) - 1)
+                    posicoes = posicoes[self.ids[posicoes] == permitidos]
+                    return self._k_menores(posicoes, lat, lon, k, formula, raio_maximo)[:2]
+
+            pendentes = self._posicoes_pendentes()
+            k_arvore = min(self.n_indexados, k + max(4, k // 10))
+            while True:
+                limite = np.inf  # distância mínima garantida de quem não é candidato
+                candidatos = pendentes
+                if self.arvore is not None and k_arvore:
+                    distancias_rad, indexados = self.arvore.query(np.radians([[lat, lon]]), k=k_arvore)
+                    candidatos = np.concatenate([indexados[0], pendentes])
+                    if k_arvore < self.n_indexados:
+                        limite = distancias_rad[0][-1] * RAIO_TERRA_KM / MARGEM_ELIPSOIDE
+                if permitidos is not None:
+                    candidatos = candidatos[np.isin(self.ids[candidatos], permitidos)]
+
+                ids, distancias, completo = self._k_menores(candidatos, lat, lon, k, formula, raio_maximo)
+                suficiente = completo and distancias[-1] <= limite
+                if limite == np.inf or suficiente or (raio_maximo is not None and raio_maximo <= limite):
+                    return ids, distancias
+                k_arvore = min(self.n_indexados, k_arvore * 2)
+
+    def _k_menores(self, posicoes: np.ndarray, lat: float, lon: float, k: int, formula: str,
+                   raio_maximo: float = None) -> tuple[np.ndarray, np.ndarray, bool]:
+        """(ids, distâncias) dos k mais próximos entre as posições e se foram encontrados k."""
+        distancias = FORMULAS[formula](lat, lon, self.lats[posicoes], self.lons[posicoes])
+        if raio_maximo is not None:
+            dentro = distancias <= raio_maximo
+            posicoes, distancias = posicoes[dentro], distancias[dentro]
+        if len(posicoes) > k:
+            selecionados = np.argpartition(distancias, k - 1)[:k]
+            posicoes, distancias = posicoes[selecionados], distancias[selecionados]
+        ids = self.ids[posicoes]
+        ordem = np.lexsort((ids, distancias))
+        return ids[ordem], distancias[ordem], len(ordem) == k
+
+    def caixa(self, session: Session, lat_min: float, lat_max: float,
+              lon_min: float, lon_max: float, versoes: dict = None) -> np.ndarray:
+        """Retorna os ids dos produtores dentro da caixa delimitadora, na ordem da tabela.
+
+        Se lon_min > lon_max a caixa cruza o antimeridiano.
+        """
+        with self._trava:
+            self.atualizar(session, versoes)
+
+            # faixa de latitude por busca binária, longitude por máscara
+            inicio = np.searchsorted(self.lats_ordenadas, lat_min, side='left')
+            fim = np.searchsorted(self.lats_ordenadas, lat_max, side='right')
+            faixa = self.ordem_lat[inicio:fim]
+
+            pendentes = self._posicoes_pendentes()
+            pendentes = pendentes[(self.lats[pendentes] >= lat_min) & (self.lats[pendentes] <= lat_max)]
+            candidatos = np.concatenate([faixa, pendentes])
+
+            lons = self.lons[candidatos]
+            if lon_min <= lon_max:
+                mascara = (lons >= lon_min) & (lons <= lon_max)
+            else:
+                mascara = (lons >= lon_min) | (lons <= lon_max)
+            return self.ids[np.sort(candidatos[mascara])]
+
+    def _posicoes_pendentes(self) -> np.ndarray:
+        """Posições dos pontos que ainda não foram inseridos na árvore."""
+        return np.arange(self.n_indexados, len(self.ids))
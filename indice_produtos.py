@@ -0,0 +1,115 @@
+import threading
+from itertools import chain
+
+import numpy as np
+from db import Produto, produtor_produto, versao_dados
+from instrumentacao import registrar_cache
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+
+def versao_ofertas(session: Session, versoes: dict = None) -> tuple:
+    """Retorna uma assinatura O(1) das tabelas produtor_produto e produtos.
+
+    Usa os contadores de escrita de versao_dados (mantidos por gatilhos), então
+    pode ser consultada a cada filtro sem percorrer as tabelas. `versoes` são
+    os contadores já lidos pelo chamador; sem eles a tabela é lida aqui.
+    """
+    if versoes is None:
+        versoes = versao_dados(session.connection())
+    return (versoes.get("produtor_produto", 0), versoes.get("produtos", 0))
+
+
+class IndiceProdutos:
+    """Índice de bitmaps produtor×produto: um bitset por produto sobre as posições dos produtores.
+
+    Filtros "oferece todos" (AND), "oferece algum" (OR) e de estação viram
+    operações bit a bit sobre vetores de bytes. O índice é reconstruído
+    quando a assinatura de produtor_produto ou de produtos muda; as
+    consultas aceitam `versoes` já lidos de versao_dados (ver versao_ofertas).
+    """
+
+    def __init__(self):
+        self.produtores_ids = np.empty(0, dtype=np.int64)  # posição do bit -> id do produtor
+        self.bitsets = np.zeros((0, 0), dtype=np.uint8)     # uma linha empacotada por produto
+        self.linha_por_nome = {}
+        self.linhas_por_estacao = {}
+        self.versao = None
+        self._trava = threading.RLock()  # consultas e reconstruções não se misturam entre threads
+
+    def invalidar(self):
+        """Força a reconstrução do índice na próxima consulta."""
+        self.versao = None
+
+    def atualizar(self, session: Session, versoes: dict = None):
+        """Reconstrói os bitsets caso as ofertas ou os produtos tenham mudado."""
+        versao = versao_ofertas(session, versoes)
+        registrar_cache("indice_produtos", versao == self.versao)
+        if versao == self.versao:
+            return
+
+        produtos = session.execute(select(Produto.id, Produto.nome, Produto.sazonalidade)
+                                   .order_by(Produto.id)).all()
+        produtos_ids = np.array([produto.id for produto in produtos], dtype=np.int64)
+        self.linha_por_nome = {produto.nome: i for i, produto in enumerate(produtos)}
+        self.linhas_por_estacao = {}
+        for i, produto in enumerate(produtos):
+            self.linhas_por_estacao.setdefault(produto.sazonalidade, []).append(i)
+
+        ofertas = session.execute(select(produtor_produto.c.produtor_id, produtor_produto.c.produto_id))
+        pares = np.fromiter(chain.from_iterable(ofertas.tuples()), dtype=np.int64).reshape(-1, 2)
+        self.produtores_ids, colunas = np.unique(pares[:, 0], return_inverse=True)
+        linhas = np.searchsorted(produtos_ids, pares[:, 1])
+        conhecidos = np.isin(pares[:, 1], produtos_ids)
+
+        matriz = np.zeros((len(produtos_ids), len(self.produtores_ids)), dtype=bool)
+        matriz[linhas[conhecidos], colunas[conhecidos]] = True
+        self.bitsets = np.packbits(matriz, axis=1)
+        self.versao = versao
+
+    # ================= consultas =================
+    def todos(self, session: Session, nomes: list[str], versoes: dict = None) -> np.ndarray:
+        """Ids dos produtores que oferecem todos os produtos (AND) da lista.
+
+        Assim como filtro_preferencia, nomes desconhecidos são ignorados e,
+        se nenhum nome for conhecido, o resultado é vazio.
+        """
+        return self.filtrar(session, todos=nomes, versoes=versoes)
+
+    def algum(self, session: Session, nomes: list[str], versoes: dict = None) -> np.ndarray:
+        """Ids dos produtores que oferecem pelo menos um dos produtos (OR) da lista."""
+        return self.filtrar(session, algum=nomes, versoes=versoes)
+
+    def da_estacao(self, session: Session, estacao: str, versoes: dict = None) -> np.ndarray:
+        """Ids dos produtores que oferecem algum produto da estação."""
+        return self.filtrar(session, estacao=estacao, versoes=versoes)
+
+    def filtrar(self, session: Session, todos: list[str] = None, algum: list[str] = None,
+                estacao: str = None, versoes: dict = None) -> np.ndarray:
+        """Combina (AND) os filtros informados; filtros None são ignorados."""
+        with self._trava:
+            self.atualizar(session, versoes)
+            resultado = np.full(self.bitsets.shape[1], 0xFF, dtype=np.uint8)
+            if todos is not None:
+                linhas = self._linhas(todos)
+                if not linhas:
+                    return np.empty(0, dtype=np.int64)
+                resultado &= np.bitwise_and.reduce(self.bitsets[linhas], axis=0)
+            if algum is not None:
+                resultado &= self._uniao(self._linhas(algum))
+            if estacao is not None:
+                resultado &= self._uniao(self.linhas_por_estacao.get(estacao, []))
+            return self._ids(resultado)
+
+    def _linhas(self, nomes: list[str]) -> list[int]:
+        return [self.linha_por_nome[nome] for nome in dict.fromkeys(nomes or []) if nome in self.linha_por_nome]
+
+    def _uniao(self, linhas: list[int]) -> np.ndarray:
+        if not linhas:
+            return np.zeros(self.bitsets.shape[1], dtype=np.uint8)
+        return np.bitwise_or.reduce(self.bitsets[linhas], axis=0)
+
+    def _ids(self, bitset: np.ndarray) -> np.ndarray:
+        """Converte um bitset empacotado nos ids dos produtores correspondentes."""
+        bits = np.unpackbits(bitset, count=len(self.produtores_ids)).astype(bool)
+        return self.produtores_ids[bits]
@@ -0,0 +1,285 @@
+"""Instrumentação dos caminhos quentes: tempo, consultas SQL, linhas lidas e acertos de cache.
+
+As funções decoradas com @medir e os eventos da engine registram seus
+números no escopo atual, que é um rerun do Streamlit ou uma requisição da
+API, aberto com `escopo(nome)`. Fora de um escopo ativo, @medir custa uma
+leitura de ContextVar e os eventos SQL retornam logo na primeira linha.
+Ao fechar, cada escopo é somado aos totais do processo, exportados em
+JSON (exportar_json) ou no formato texto do Prometheus (exportar_prometheus).
+
+INSTRUMENTACAO=1 liga os escopos por padrão (ex.: nos workers da API).
+"""
+import contextvars
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from sqlalchemy import event
+
+ATIVA = os.environ.get("INSTRUMENTACAO", "0").lower() in ("1", "true", "sim")
+
+# Contadores guardados por função e por escopo, na ordem da exportação
+CAMPOS = ("chamadas", "segundos", "consultas_sql", "segundos_sql", "linhas", "acertos_cache", "falhas_cache")
+
+# Prefixo das métricas no formato Prometheus
+PREFIXO_METRICAS = "produtores"
+
+# quadro (chamada medida ou raiz do escopo) que recebe os eventos da thread/contexto atual
+_quadro_atual = contextvars.ContextVar("quadro_instrumentacao", default=None)
+
+
+class Quadro:
+    """Contadores de uma chamada em andamento; ao terminar, são somados ao quadro pai."""
+
+    __slots__ = ("coleta", "consultas_sql", "segundos_sql", "linhas", "acertos_cache", "falhas_cache",
+                 "falhou")
+
+    def __init__(self, coleta: "Coleta"):
+        self.coleta = coleta
+        self.consultas_sql = 0
+        self.segundos_sql = 0.0
+        self.linhas = 0
+        self.acertos_cache = 0
+        self.falhas_cache = 0
+        self.falhou = False  # o corpo de uma função em cache rodou (ver falha_cache)
+
+    def contar_linha(self, cursor, linha):
+        """row_factory do sqlite3: conta cada linha lida sem alterá-la."""
+        self.linhas += 1
+        return linha
+
+    def somar_em(self, outro: "Quadro"):
+        outro.consultas_sql += self.consultas_sql
+        outro.segundos_sql += self.segundos_sql
+        outro.linhas += self.linhas
+        outro.acertos_cache += self.acertos_cache
+        outro.falhas_cache += self.falhas_cache
+
+
+def _zerados() -> dict:
+    return dict.fromkeys(CAMPOS, 0)
+
+def _somar(destino: dict, origem: dict):
+    for campo in CAMPOS:
+        destino[campo] += origem[campo]
+
+
+class Coleta:
+    """Números agregados de um escopo: por função (inclusivos) e por cache.
+
+    `total` tem o escopo inteiro, inclusive consultas feitas fora de
+    funções medidas; as linhas de `funcoes` incluem as funções chamadas
+    por elas, então não devem ser somadas entre si.
+    """
+
+    def __init__(self, nome: str):
+        self.nome = nome
+        self.inicio = time.time()
+        self.total = _zerados()
+        self.funcoes = {}  # nome -> contadores
+        self.caches = {}   # nome -> {"acertos": n, "falhas": n}
+        self._raiz = Quadro(self)
+        self._token = None
+        self._relogio = time.perf_counter()
+
+    def registrar_funcao(self, nome: str, segundos: float, quadro: Quadro):
+        contadores = self.funcoes.setdefault(nome, _zerados())
+        contadores["chamadas"] += 1
+        contadores["segundos"] += segundos
+        contadores["consultas_sql"] += quadro.consultas_sql
+        contadores["segundos_sql"] += quadro.segundos_sql
+        contadores["linhas"] += quadro.linhas
+        contadores["acertos_cache"] += quadro.acertos_cache
+        contadores["falhas_cache"] += quadro.falhas_cache
+
+    def registrar_cache(self, nome: str, acerto: bool):
+        contadores = self.caches.setdefault(nome, {"acertos": 0, "falhas": 0})
+        contadores["acertos" if acerto else "falhas"] += 1
+
+    def como_dict(self) -> dict:
+        return {"escopo": self.nome, "inicio": self.inicio, "total": dict(self.total),
+                "funcoes": {nome: dict(contadores) for nome, contadores in self.funcoes.items()},
+                "caches": {nome: dict(contadores) for nome, contadores in self.caches.items()}}
+
+
+# ================= totais do processo =================
+_trava = threading.Lock()
+_escopos = {}  # nome do escopo -> contadores somados
+_funcoes = {}  # nome da função -> contadores somados
+_caches = {}   # nome do cache -> {"acertos": n, "falhas": n}
+
+def _acumular(coleta: Coleta):
+    with _trava:
+        _somar(_escopos.setdefault(coleta.nome, _zerados()), coleta.total)
+        for nome, contadores in coleta.funcoes.items():
+            _somar(_funcoes.setdefault(nome, _zerados()), contadores)
+        for nome, contadores in coleta.caches.items():
+            acumulado = _caches.setdefault(nome, {"acertos": 0, "falhas": 0})
+            acumulado["acertos"] += contadores["acertos"]
+            acumulado["falhas"] += contadores["falhas"]
+
+def zerar():
+    """Descarta os totais acumulados do processo."""
+    with _trava:
+        _escopos.clear()
+        _funcoes.clear()
+        _caches.clear()
+
+
+# ================= escopos =================
+def iniciar_escopo(nome: str, ativo: Optional[bool] = None) -> Optional[Coleta]:
+    """Abre um escopo na thread/contexto atual; retorna None se a instrumentação estiver desligada.
+
+    Para scripts que não cabem em um `with` (ex.: o app.py do Streamlit),
+    combine com encerrar_escopo no fim da execução.
+    """
+    if not (ATIVA if ativo is None else ativo):
+        return None
+    coleta = Coleta(nome)
+    coleta._token = _quadro_atual.set(coleta._raiz)
+    return coleta
+
+def encerrar_escopo(coleta: Optional[Coleta]) -> Optional[Coleta]:
+    """Fecha o escopo, preenche `coleta.total` e soma tudo aos totais do processo."""
+    if coleta is None or coleta._token is None:
+        return coleta
+    _quadro_atual.reset(coleta._token)
+    coleta._token = None
+
+    raiz = coleta._raiz
+    coleta.total.update(chamadas=1, segundos=time.perf_counter() - coleta._relogio,
+                        consultas_sql=raiz.consultas_sql, segundos_sql=raiz.segundos_sql, linhas=raiz.linhas,
+                        acertos_cache=raiz.acertos_cache, falhas_cache=raiz.falhas_cache)
+    _acumular(coleta)
+    return coleta
+
+@contextmanager
+def escopo(nome: str, ativo: Optional[bool] = None):
+    """Context manager de iniciar_escopo/encerrar_escopo; produz a Coleta (ou None)."""
+    coleta = iniciar_escopo(nome, ativo)
+    try:
+        yield coleta
+    finally:
+        encerrar_escopo(coleta)
+
+
+# ================= pontos de medição =================
+def medir(funcao: Callable = None, *, nome: str = None, cache: bool = False):
+    """Decorator que registra tempo, SQL, linhas e caches de cada chamada no escopo atual.
+
+    Com `cache=True` a função é tratada como um cache (ex.: st.cache_data):
+    a chamada conta como acerto, a menos que o corpo chame falha_cache().
+    """
+    def decorar(funcao):
+        rotulo = nome or funcao.__name__
+
+        @functools.wraps(funcao)
+        def medida(*args, **kwargs):
+            pai = _quadro_atual.get()
+            if pai is None:
+                return funcao(*args, **kwargs)
+
+            quadro = Quadro(pai.coleta)
+            token = _quadro_atual.set(quadro)
+            inicio = time.perf_counter()
+            try:
+                return funcao(*args, **kwargs)
+            finally:
+                segundos = time.perf_counter() - inicio
+                _quadro_atual.reset(token)
+                if cache:
+                    acerto = not quadro.falhou
+                    quadro.acertos_cache += acerto
+                    quadro.falhas_cache += not acerto
+                    pai.coleta.registrar_cache(rotulo, acerto)
+                pai.coleta.registrar_funcao(rotulo, segundos, quadro)
+                quadro.somar_em(pai)
+
+        return medida
+
+    return decorar(funcao) if funcao is not None else decorar
+
+def registrar_cache(nome: str, acerto: bool):
+    """Registra um acerto ou falha do cache `nome` no escopo atual (sem escopo, não faz nada)."""
+    quadro = _quadro_atual.get()
+    if quadro is None:
+        return
+    if acerto:
+        quadro.acertos_cache += 1
+    else:
+        quadro.falhas_cache += 1
+    quadro.coleta.registrar_cache(nome, acerto)
+
+def falha_cache():
+    """Chamada no corpo de uma função medida com cache=True: o valor não veio do cache."""
+    quadro = _quadro_atual.get()
+    if quadro is not None:
+        quadro.falhou = True
+
+
+# ================= eventos SQL =================
+def instrumentar_engine(engine):
+    """Conta consultas, tempo de execução e linhas lidas da engine dentro dos escopos ativos."""
+    event.listen(engine, "before_cursor_execute", _antes_sql)
+    event.listen(engine, "after_cursor_execute", _depois_sql)
+    event.listen(engine, "handle_error", _erro_sql)
+
+# O início de cada comando fica no contexto de execução (um por comando), e
+# não em uma pilha da conexão: um comando que falha não deixa nada para trás.
+def _antes_sql(conexao, cursor, sql, parametros, contexto, executemany):
+    quadro = _quadro_atual.get()
+    if quadro is None:
+        return
+    quadro.consultas_sql += 1
+    # as linhas passam pela row_factory do cursor só enquanto houver um escopo ativo
+    if hasattr(cursor, "row_factory"):
+        cursor.row_factory = quadro.contar_linha
+    if contexto is not None:
+        contexto.inicio_instrumentacao = time.perf_counter()
+
+def _somar_tempo_sql(contexto):
+    quadro = _quadro_atual.get()
+    inicio = getattr(contexto, "inicio_instrumentacao", None)
+    if quadro is None or inicio is None:
+        return
+    del contexto.inicio_instrumentacao
+    quadro.segundos_sql += time.perf_counter() - inicio
+
+def _depois_sql(conexao, cursor, sql, parametros, contexto, executemany):
+    _somar_tempo_sql(contexto)
+
+def _erro_sql(contexto_excecao):
+    """Comandos que falham também contam o tempo que passaram no banco."""
+    _somar_tempo_sql(contexto_excecao.execution_context)
+
+
+# ================= exportação =================
+def exportar_json() -> dict:
+    """Totais do processo por escopo, por função e por cache."""
+    with _trava:
+        return {"escopos": {nome: dict(contadores) for nome, contadores in _escopos.items()},
+                "funcoes": {nome: dict(contadores) for nome, contadores in _funcoes.items()},
+                "caches": {nome: dict(contadores) for nome, contadores in _caches.items()}}
+
+def exportar_prometheus() -> str:
+    """Totais do processo no formato texto de exposição do Prometheus (contadores)."""
+    dados = exportar_json()
+    linhas = []
+    for grupo, rotulo in (("escopos", "escopo"), ("funcoes", "funcao")):
+        for campo in CAMPOS:
+            metrica = f"{PREFIXO_METRICAS}_{grupo}_{campo}_total"
+            linhas.append(f"# TYPE {metrica} counter")
+            for nome, contadores in sorted(dados[grupo].items()):
+                linhas.append(f'{metrica}{{{rotulo}="{_escapar(nome)}"}} {contadores[campo]}')
+    metrica = f"{PREFIXO_METRICAS}_cache_total"
+    linhas.append(f"# TYPE {metrica} counter")
+    for nome, contadores in sorted(dados["caches"].items()):
+        for resultado, chave in (("acerto", "acertos"), ("falha", "falhas")):
+            linhas.append(f'{metrica}{{cache="{_escapar(nome)}",resultado="{resultado}"}} {contadores[chave]}')
+    return "\n".join(linhas) + "\n"
+
+def _escapar(valor: str) -> str:
+    return valor.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,330 @@
+from itertools import chain
+
+import numpy as np
+from db import Avaliacao
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from vizinhos_aproximados import criar_busca
+
+
+def versao_avaliacoes(session: Session) -> tuple:
+    """Retorna uma assinatura O(1) da tabela de avaliações (contador de escritas, maior id).
+
+    O contador vem de versao_dados (mantido por gatilhos) e o maior id sai
+    direto da chave primária, sem percorrer a tabela.
+    """
+    contador = session.connection().exec_driver_sql(
+        "SELECT versao FROM versao_dados WHERE tabela = 'avaliacoes'").scalar()
+    return (contador or 0, session.query(func.max(Avaliacao.id)).scalar())
+
+def descrever_versao(versao: tuple, prefixo: str = "knn") -> str:
+    """Converte a assinatura das avaliações em um texto curto para guardar junto das recomendações."""
+    return "-".join([prefixo] + [str(int(valor or 0)) for valor in versao])
+
+def carregar_avaliacoes(session: Session, tamanho_lote: int = 100_000) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Lê (usuario_id, produtor_id, nota) de todas as avaliações em vetores NumPy, em lotes."""
+    consulta = select(Avaliacao.usuario_id, Avaliacao.produtor_id, Avaliacao.nota)
+    resultado = session.execute(consulta.execution_options(yield_per=tamanho_lote))
+
+    # fromiter sobre as tuplas achatadas: np.array(linhas) consulta cada Row como mapeamento
+    lotes = [np.fromiter(chain.from_iterable(lote), dtype=np.int64).reshape(-1, 3)
+             for lote in resultado.partitions()]
+    dados = np.concatenate(lotes) if lotes else np.empty((0, 3), dtype=np.int64)
+    return dados[:, 0], dados[:, 1], dados[:, 2].astype(np.float32)
+
+
+class MatrizAvaliacoes:
+    """Matriz esparsa (CSR) usuário×produtor com os mapas id↔linha e id↔coluna.
+
+    As linhas seguem os ids de usuário em ordem crescente e as colunas os ids
+    de produtor em ordem crescente, então o mapeamento é estável entre
+    reconstruções com os mesmos dados. A memória cresce com o número de
+    avaliações, não com usuários × produtores.
+    """
+
+    def __init__(self, usuarios: np.ndarray, produtores: np.ndarray, notas: np.ndarray):
+        from scipy.sparse import csr_matrix  # carregado só quando o modelo é construído
+
+        # ids únicos e ordenados; as posições inversas viram linhas/colunas
+        self.usuarios_ids, linhas = np.unique(usuarios, return_inverse=True)
+        self.produtores_ids, colunas = np.unique(produtores, return_inverse=True)
+        forma = (len(self.usuarios_ids), len(self.produtores_ids))
+
+        # notas repetidas para o mesmo par são substituídas pela média
+        self.matriz = csr_matrix((notas, (linhas, colunas)), shape=forma, dtype=np.float32)
+        contagem = csr_matrix((np.ones_like(notas), (linhas, colunas)), shape=forma, dtype=np.float32)
+        self.matriz.sum_duplicates()
+        contagem.sum_duplicates()
+        self.matriz.data /= contagem.data
+
+        # média das notas de cada produtor (mesmo valor de Produtor.nota, mantido pelos gatilhos)
+        soma_colunas = np.bincount(colunas, weights=notas, minlength=forma[1])
+        contagem_colunas = np.bincount(colunas, minlength=forma[1])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.media_produtores = np.where(contagem_colunas > 0, soma_colunas / contagem_colunas, 0.0)
+
+    @property
+    def forma(self) -> tuple[int, int]:
+        return self.matriz.shape
+
+    def linha_usuario(self, usuario_id: int) -> int:
+        """Retorna a linha do usuário na matriz, ou -1 se ele não tiver avaliações."""
+        return _posicao(self.usuarios_ids, usuario_id)
+
+    def coluna_produtor(self, produtor_id: int) -> int:
+        """Retorna a coluna do produtor na matriz, ou -1 se ele não tiver avaliações."""
+        return _posicao(self.produtores_ids, produtor_id)
+
+
+def _posicao(ids_ordenados: np.ndarray, id: int) -> int:
+    """Busca binária de um id em um vetor ordenado; -1 se não existir."""
+    posicao = int(np.searchsorted(ids_ordenados, id))
+    if posicao < len(ids_ordenados) and ids_ordenados[posicao] == id:
+        return posicao
+    return -1
+
+
+class ModeloKNN:
+    """Matriz de avaliações esparsa e motor de vizinhos (cosseno) já treinado sobre ela.
+
+    O motor padrão é a busca bruta exata; qualquer objeto de
+    vizinhos_aproximados.MOTORES pode ser usado no lugar.
+    """
+
+    def __init__(self, avaliacoes: MatrizAvaliacoes, busca=None):
+        # cada coluna é um produtor, cada linha é um usuario
+        self.avaliacoes = avaliacoes
+
+        # Criar e treinar o motor de vizinhos; a distância cosseno é calculada
+        # diretamente sobre a matriz esparsa, sem densificar
+        self.busca = (busca or criar_busca("bruta")).treinar(avaliacoes.matriz)
+
+    def vizinhos_com_similaridade(self, usuario_id: int, n_vizinhos: int = 20) -> tuple[np.ndarray, np.ndarray]:
+        """Retorna (linhas, similaridades cosseno) dos vizinhos do usuário, sem o próprio usuário."""
+        idx_usuario = self.avaliacoes.linha_usuario(usuario_id)
+        if idx_usuario < 0:
+            raise KeyError(usuario_id)
+        # linha esparsa com a nota do usuário para cada produtor
+        avaliacoes_usuario = self.avaliacoes.matriz[idx_usuario]
+
+        # o motor retorna a distancia dos vizinhos [] e o indice deles na matriz []
+        n_vizinhos = min(n_vizinhos, self.avaliacoes.forma[0])
+        distancias, vizinhos_k = self.busca.consultar(avaliacoes_usuario, n_vizinhos)
+
+        mascara = vizinhos_k != idx_usuario
+        return vizinhos_k[mascara], 1.0 - distancias[mascara]
+
+    def vizinhos(self, usuario_id: int, n_vizinhos: int = 20) -> list[int]:
+        """Retorna os ids dos usuários mais parecidos, do mais ao menos parecido, sem o próprio usuário."""
+        linhas, _ = self.vizinhos_com_similaridade(usuario_id, n_vizinhos)
+        return [int(id) for id in self.avaliacoes.usuarios_ids[linhas]]
+
+    def recomendar(self, usuario_id: int, n_vizinhos: int = 20, quantidade: int = 10,
+                   nota_minima: float = 3.0, permitidos: np.ndarray = None) -> list[tuple[int, float]]:
+        """Retorna [(produtor_id, nota prevista)] ordenados da maior para a menor nota prevista.
+
+        A nota prevista é a média das notas dos vizinhos ponderada pela
+        similaridade; entram apenas produtores avaliados por algum vizinho,
+        não avaliados pelo usuário, com média geral >= nota_minima e, se
+        informado, presentes em `permitidos` (ids). Empates são desfeitos
+        pelo id do produtor, então o resultado é determinístico.
+        """
+        linhas, similaridades = self.vizinhos_com_similaridade(usuario_id, n_vizinhos)
+        return self._pontuar(self.avaliacoes.linha_usuario(usuario_id), linhas, similaridades,
+                             quantidade, nota_minima, permitidos)
+
+    def _pontuar(self, idx_usuario: int, linhas: np.ndarray, similaridades: np.ndarray,
+                 quantidade: int, nota_minima: float, permitidos: np.ndarray = None) -> list[tuple[int, float]]:
+        """Calcula as notas previstas a partir das linhas dos vizinhos e suas similaridades."""
+        return pontuar_por_vizinhos(self.avaliacoes, idx_usuario, linhas, similaridades, quantidade,
+                                    nota_minima, permitidos)
+
+
+def pontuar_por_vizinhos(avaliacoes: MatrizAvaliacoes, idx_usuario: int, linhas: np.ndarray,
+                         similaridades: np.ndarray, quantidade: int, nota_minima: float,
+                         permitidos: np.ndarray = None) -> list[tuple[int, float]]:
+    """Notas previstas pela média das notas dos vizinhos (`linhas`) ponderada pela similaridade.
+
+    Percorre só as avaliações dos vizinhos, na ordem recebida; é a mesma
+    conta de ModeloKNN.recomendar e de recomendacoes_lote.calcular_bloco.
+    """
+    matriz = avaliacoes.matriz
+    if len(linhas) == 0:
+        return []
+
+    # vizinhos sem nenhuma avaliação em comum ainda contam, com peso mínimo
+    pesos = np.maximum(np.asarray(similaridades, dtype=np.float64), 1e-6)
+    notas_vizinhos = matriz[linhas]
+    pesos_entradas = np.repeat(pesos, np.diff(notas_vizinhos.indptr))
+    colunas, inverso = np.unique(notas_vizinhos.indices, return_inverse=True)
+    soma_pesos = np.bincount(inverso, weights=pesos_entradas)
+    previsao = np.bincount(inverso, weights=notas_vizinhos.data * pesos_entradas) / soma_pesos
+
+    candidatos = ~np.isin(colunas, matriz.indices[matriz.indptr[idx_usuario]:matriz.indptr[idx_usuario + 1]])
+    candidatos &= avaliacoes.media_produtores[colunas] >= nota_minima
+    if permitidos is not None:
+        candidatos &= np.isin(avaliacoes.produtores_ids[colunas], permitidos)
+    colunas, previsao = colunas[candidatos], previsao[candidatos]
+
+    produtores_ids = avaliacoes.produtores_ids[colunas]
+    ordem = np.lexsort((produtores_ids, -previsao))[:quantidade]
+    return [(int(produtores_ids[i]), float(previsao[i])) for i in ordem]
+
+
+def construir_modelo_knn(session: Session, motor: str = "bruta", **parametros) -> ModeloKNN:
+    """Lê todas as avaliações e treina o modelo KNN de usuários com o motor de vizinhos escolhido."""
+    usuarios, produtores, notas = carregar_avaliacoes(session)
+    return ModeloKNN(MatrizAvaliacoes(usuarios, produtores, notas), criar_busca(motor, **parametros))
+
+
+# ================= filtragem colaborativa item-item =================
+def similaridade_produtores(matriz, m_vizinhos: int = 50, tamanho_bloco: int = 1024):
+    """Retorna a matriz CSR produtor×produtor com os `m_vizinhos` produtores mais parecidos de cada linha.
+
+    A similaridade é o cosseno entre as colunas de notas da matriz
+    usuário×produtor (só valores positivos, sem o próprio produtor). Os
+    produtos esparsos são feitos em blocos de linhas para limitar a memória.
+    """
+    from scipy.sparse import csr_matrix
+    from sklearn.preprocessing import normalize
+
+    colunas = normalize(matriz.tocsc(), norm='l2', axis=0)
+    transposta = colunas.T.tocsr()  # produtores × usuários, linhas unitárias
+    n_produtores = matriz.shape[1]
+
+    linhas_s, colunas_s, valores_s = [], [], []
+    for inicio in range(0, n_produtores, tamanho_bloco):
+        fim = min(inicio + tamanho_bloco, n_produtores)
+        bloco = (transposta[inicio:fim] @ colunas).tocsr()
+        for i in range(fim - inicio):
+            a, b = bloco.indptr[i], bloco.indptr[i + 1]
+            vizinhos, sims = bloco.indices[a:b], bloco.data[a:b]
+            mascara = (vizinhos != inicio + i) & (sims > 0)
+            vizinhos, sims = vizinhos[mascara], sims[mascara]
+            if len(vizinhos) > m_vizinhos:
+                escolhidos = np.argpartition(-sims, m_vizinhos - 1)[:m_vizinhos]
+                vizinhos, sims = vizinhos[escolhidos], sims[escolhidos]
+            linhas_s.append(np.full(len(vizinhos), inicio + i))
+            colunas_s.append(vizinhos)
+            valores_s.append(sims)
+
+    if not linhas_s:
+        return csr_matrix((n_produtores, n_produtores), dtype=np.float32)
+    return csr_matrix(
+        (np.concatenate(valores_s), (np.concatenate(linhas_s), np.concatenate(colunas_s))),
+        shape=(n_produtores, n_produtores), dtype=np.float32,
+    )
+
+
+class ModeloItemItem:
+    """Filtragem colaborativa item-item com similaridades pré-calculadas (top-M por produtor).
+
+    Guarda só dados por produtor: a matriz de similaridade (M vizinhos por
+    linha), os ids das colunas e as notas médias. Na consulta, as notas do
+    usuário vêm de fora (ver back.recomendar_produtores), então o custo
+    depende do número de avaliações do usuário vezes M, e não do número de
+    usuários da base.
+    """
+
+    def __init__(self, avaliacoes: MatrizAvaliacoes, m_vizinhos: int = 50):
+        self.produtores_ids = avaliacoes.produtores_ids
+        self.media_produtores = avaliacoes.media_produtores
+        self.m_vizinhos = m_vizinhos
+        self.similaridade = similaridade_produtores(avaliacoes.matriz, m_vizinhos)
+
+    @classmethod
+    def de_similaridade(cls, produtores_ids: np.ndarray, media_produtores: np.ndarray, similaridade,
+                        m_vizinhos: int) -> "ModeloItemItem":
+        """Monta o modelo sobre uma similaridade já calculada (ex.: lida do snapshot colunar)."""
+        modelo = cls.__new__(cls)
+        modelo.produtores_ids = produtores_ids
+        modelo.media_produtores = media_produtores
+        modelo.m_vizinhos = m_vizinhos
+        modelo.similaridade = similaridade
+        return modelo
+
+    def parecidos(self, produtor_id: int, quantidade: int = 10) -> list[tuple[int, float]]:
+        """Retorna [(produtor_id, similaridade)] dos produtores mais parecidos com o informado."""
+        coluna = _posicao(self.produtores_ids, produtor_id)
+        if coluna < 0:
+            return []
+        a, b = self.similaridade.indptr[coluna], self.similaridade.indptr[coluna + 1]
+        vizinhos, sims = self.similaridade.indices[a:b], self.similaridade.data[a:b]
+        ordem = np.lexsort((self.produtores_ids[vizinhos], -sims))[:quantidade]
+        return [(int(self.produtores_ids[vizinhos[i]]), float(sims[i])) for i in ordem]
+
+    def recomendar(self, produtores_avaliados: np.ndarray, notas: np.ndarray, quantidade: int = 10,
+                   nota_minima: float = 3.0, permitidos: np.ndarray = None) -> list[tuple[int, float]]:
+        """Retorna [(produtor_id, nota prevista)] a partir das avaliações de um usuário.
+
+        A nota prevista de um candidato é a média das notas que o usuário deu
+        aos produtores avaliados que o têm entre os M vizinhos, ponderada
+        pela similaridade. Entram apenas produtores não avaliados pelo
+        usuário, com média geral >= nota_minima e, se informado, presentes em
+        `permitidos` (ids); empates são desfeitos pela soma das similaridades
+        (mais evidência primeiro) e pelo id.
+        """
+        produtores_avaliados = np.asarray(produtores_avaliados, dtype=np.int64)
+        notas = np.asarray(notas, dtype=np.float32)
+        if not len(produtores_avaliados) or not len(self.produtores_ids):
+            return []
+
+        # colunas dos produtores avaliados; notas repetidas para o mesmo produtor viram a média
+        posicoes = np.searchsorted(self.produtores_ids, produtores_avaliados)
+        posicoes = np.minimum(posicoes, len(self.produtores_ids) - 1)
+        conhecidos = self.produtores_ids[posicoes] == produtores_avaliados
+        avaliadas, inverso = np.unique(posicoes[conhecidos], return_inverse=True)
+        if not len(avaliadas):
+            return []
+        notas_avaliadas = np.bincount(inverso, weights=notas[conhecidos]) / np.bincount(inverso)
+
+        # só as linhas da similaridade dos produtores avaliados: |avaliadas| × M entradas
+        vizinhanca = self.similaridade[avaliadas]
+        pesos = vizinhanca.data
+        notas_por_entrada = np.repeat(notas_avaliadas, np.diff(vizinhanca.indptr))
+        candidatos, inverso = np.unique(vizinhanca.indices, return_inverse=True)
+        soma_pesos = np.bincount(inverso, weights=pesos)
+        previsao = np.bincount(inverso, weights=pesos * notas_por_entrada) / soma_pesos
+
+        mascara = ~np.isin(candidatos, avaliadas, assume_unique=True)
+        mascara &= self.media_produtores[candidatos] >= nota_minima
+        if permitidos is not None:
+            mascara &= np.isin(self.produtores_ids[candidatos], permitidos)
+        candidatos, previsao, soma_pesos = candidatos[mascara], previsao[mascara], soma_pesos[mascara]
+
+        produtores_ids = self.produtores_ids[candidatos]
+        ordem = np.lexsort((produtores_ids, -soma_pesos, -previsao))[:quantidade]
+        return [(int(produtores_ids[i]), float(previsao[i])) for i in ordem]
+
+
+def construir_modelo_item(session: Session, m_vizinhos: int = 50) -> ModeloItemItem:
+    """Lê todas as avaliações e pré-calcula a similaridade item-item (top-M vizinhos por produtor)."""
+    usuarios, produtores, notas = carregar_avaliacoes(session)
+    return ModeloItemItem(MatrizAvaliacoes(usuarios, produtores, notas), m_vizinhos)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from cache_modelo import ArmazemModelo
+    from db import criar_engine, migrar
+    # a classe do modelo precisa vir do módulo, e não de __main__, para o pickle ser lido pelo back.py
+    from recomendacao import construir_modelo_item
+
+    parser = argparse.ArgumentParser(description="Pré-calcula a similaridade item-item e grava o modelo em disco.")
+    parser.add_argument("--banco", default="db.db", help="arquivo SQLite")
+    parser.add_argument("--saida", default="modelo_item.pkl",
+                        help="arquivo do modelo (use o mesmo em CAMINHO_CACHE_ITEM)")
+    parser.add_argument("--vizinhos", type=int, default=50, help="M: vizinhos guardados por produtor")
+    args = parser.parse_args()
+
+    engine = criar_engine(args.banco)
+    migrar(engine)  # versao_avaliacoes depende da tabela versao_dados
+    armazem = ArmazemModelo(lambda session: construir_modelo_item(session, args.vizinhos),
+                            versao_avaliacoes, caminho=args.saida)
+    with Session(engine) as session:
+        modelo = armazem.obter(session)
+    print(f"Produtores: {len(modelo.produtores_ids)}")
+    print(f"Similaridades guardadas: {modelo.similaridade.nnz}")
+    print(f"Tempo: {armazem.ultima_reconstrucao:.2f} s")
+    print(f"Versão: {descrever_versao(armazem.versao_modelo, 'item')}")
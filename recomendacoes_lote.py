@@ -0,0 +1,196 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from db import Base, Recomendacao, criar_engine, migrar
+from recomendacao import (MatrizAvaliacoes, ModeloKNN, carregar_avaliacoes, descrever_versao, pontuar_por_vizinhos,
+                          versao_avaliacoes)
+from sklearn.preprocessing import normalize
+from sqlalchemy import delete, insert, select
+from sqlalchemy.orm import Session
+from vizinhos_aproximados import selecionar_vizinhos
+
+try:
+    import resource
+except ImportError:  # Windows não possui o módulo resource
+    resource = None
+
+# Estado de cada processo do pool, preenchido uma única vez por _inicializar_worker
+_avaliacoes = None
+_normalizada = None
+_nota_minima = None
+
+
+def _inicializar_worker(avaliacoes: MatrizAvaliacoes, nota_minima: float):
+    """Prepara as matrizes derivadas uma vez por processo."""
+    global _avaliacoes, _normalizada, _nota_minima
+    _avaliacoes = avaliacoes
+    # linhas normalizadas: o produto escalar vira similaridade cosseno
+    _normalizada = normalize(avaliacoes.matriz, norm='l2', axis=1)
+    _nota_minima = nota_minima
+
+
+def calcular_bloco(inicio: int, fim: int, n_vizinhos: int, quantidade: int) -> np.ndarray:
+    """Calcula as recomendações das linhas [inicio, fim) da matriz.
+
+    Retorna um vetor (n, 4) com linha do usuário, id do produtor, nota
+    prevista e posição. A similaridade do bloco contra todos os usuários
+    sai de uma multiplicação esparsa; a escolha dos vizinhos
+    (selecionar_vizinhos, com o próprio usuário contando entre os
+    `n_vizinhos` e removido depois) e a nota prevista
+    (pontuar_por_vizinhos) são as mesmas de ModeloKNN.recomendar com a
+    busca bruta, então a lista gravada é a que o modelo devolveria.
+    """
+    similaridade = (_normalizada[inicio:fim] @ _normalizada.T).tocsr()
+    n_usuarios = _normalizada.shape[0]
+
+    resultado = []
+    for i in range(fim - inicio):
+        a, b = similaridade.indptr[i], similaridade.indptr[i + 1]
+        linhas, sims = selecionar_vizinhos(similaridade.indices[a:b], similaridade.data[a:b], n_vizinhos, n_usuarios)
+        mascara = linhas != inicio + i
+        recomendacoes = pontuar_por_vizinhos(_avaliacoes, inicio + i, linhas[mascara], sims[mascara],
+                                             quantidade, _nota_minima)
+        for posicao, (produtor_id, nota) in enumerate(recomendacoes, start=1):
+            resultado.append((inicio + i, produtor_id, nota, posicao))
+    return np.array(resultado, dtype=np.float64).reshape(-1, 4)
+
+
+def _pico_memoria_mb() -> tuple:
+    """Pico de memória residente (MB) do processo principal e dos processos filhos."""
+    if resource is None:
+        return None, None
+    proprio = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    filhos = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return proprio, filhos
+
+
+def gerar_recomendacoes(engine, processos: int = None, tamanho_bloco: int = 1024,
+                        n_vizinhos: int = 20, quantidade: int = 10, nota_minima: float = 3.0) -> dict:
+    """Calcula e grava as recomendações de todos os usuários; retorna as estatísticas da execução.
+
+    `n_vizinhos` tem o sentido de ModeloKNN.recomendar (o próprio usuário
+    conta entre eles); o padrão de 20 é o de recomendar_produtores.
+    """
+    inicio_job = time.perf_counter()
+    Base.metadata.create_all(engine)
+    migrar(engine)  # versao_avaliacoes depende da tabela versao_dados
+
+    with Session(engine) as session:
+        versao = versao_avaliacoes(session)
+        avaliacoes = MatrizAvaliacoes(*carregar_avaliacoes(session))
+    versao_modelo = descrever_versao(versao)
+    n_usuarios = avaliacoes.forma[0]
+    blocos = [(i, min(i + tamanho_bloco, n_usuarios)) for i in range(0, n_usuarios, tamanho_bloco)]
+
+    processos = processos or os.cpu_count() or 1
+    total_linhas = 0
+    with engine.begin() as conexao:
+        # as recomendações antigas são substituídas dentro da mesma transação
+        conexao.execute(delete(Recomendacao.__table__))
+
+        if processos == 1:
+            _inicializar_worker(avaliacoes, nota_minima)
+            resultados = (calcular_bloco(i, f, n_vizinhos, quantidade) for i, f in blocos)
+            total_linhas = _gravar(conexao, avaliacoes, resultados, versao_modelo)
+        else:
+            with ProcessPoolExecutor(max_workers=processos, initializer=_inicializar_worker,
+                                     initargs=(avaliacoes, nota_minima)) as executor:
+                resultados = executor.map(calcular_bloco, *zip(*blocos),
+                                          [n_vizinhos] * len(blocos), [quantidade] * len(blocos))
+                total_linhas = _gravar(conexao, avaliacoes, resultados, versao_modelo)
+
+    duracao = time.perf_counter() - inicio_job
+    pico_proprio, pico_filhos = _pico_memoria_mb()
+    return {
+        "usuarios": n_usuarios,
+        "recomendacoes": total_linhas,
+        "segundos": duracao,
+        "usuarios_por_segundo": n_usuarios / duracao if duracao > 0 else 0.0,
+        "pico_memoria_mb": pico_proprio,
+        "pico_memoria_workers_mb": pico_filhos,
+        "versao_modelo": versao_modelo,
+    }
+
+
+def _gravar(conexao, avaliacoes: MatrizAvaliacoes, resultados, versao_modelo: str) -> int:
+    """Insere os resultados de cada bloco com executemany assim que ficam prontos."""
+    total = 0
+    for bloco in resultados:
+        if not len(bloco):
+            continue
+        linhas = bloco[:, 0].astype(np.int64)
+        registros = [
+            {"usuario_id": int(u), "produtor_id": int(p), "pontuacao": float(n),
+             "posicao": int(r), "versao_modelo": versao_modelo}
+            for u, p, n, r in zip(avaliacoes.usuarios_ids[linhas], bloco[:, 1], bloco[:, 2], bloco[:, 3])
+        ]
+        conexao.execute(insert(Recomendacao.__table__), registros)
+        total += len(registros)
+    return total
+
+
+def comparar_com_modelo(engine, amostra: int = 400, n_vizinhos: int = 20, semente: int = 0) -> dict:
+    """Compara as recomendações gravadas de uma amostra de usuários com as de ModeloKNN (busca bruta).
+
+    Só entram as gravadas para a versão atual das avaliações; cada lista
+    gravada é comparada, na ordem, com a do modelo do mesmo tamanho.
+    """
+    with Session(engine) as session:
+        versao_modelo = descrever_versao(versao_avaliacoes(session))
+        avaliacoes = MatrizAvaliacoes(*carregar_avaliacoes(session))
+        salvas = {}
+        for usuario_id, produtor_id in session.execute(
+                select(Recomendacao.usuario_id, Recomendacao.produtor_id)
+                .where(Recomendacao.versao_modelo == versao_modelo)
+                .order_by(Recomendacao.usuario_id, Recomendacao.posicao)):
+            salvas.setdefault(usuario_id, []).append(produtor_id)
+
+    modelo = ModeloKNN(avaliacoes)
+    rng = np.random.default_rng(semente)
+    usuarios = rng.choice(avaliacoes.usuarios_ids, size=min(amostra, len(avaliacoes.usuarios_ids)), replace=False)
+    iguais, sobreposicoes = 0, []
+    for usuario_id in usuarios.tolist():
+        gravadas = salvas.get(usuario_id, [])
+        modelo_ids = [id for id, _ in modelo.recomendar(usuario_id, n_vizinhos, quantidade=max(len(gravadas), 1))]
+        iguais += gravadas == modelo_ids
+        if gravadas or modelo_ids:
+            sobreposicoes.append(len(set(gravadas) & set(modelo_ids)) / max(len(gravadas), len(modelo_ids)))
+    return {
+        "usuarios": len(usuarios),
+        "listas_iguais": int(iguais),
+        "sobreposicao_media": float(np.mean(sobreposicoes)) if sobreposicoes else 1.0,
+        "versao_modelo": versao_modelo,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calcula as recomendações de todos os usuários.")
+    parser.add_argument("--banco", default="db.db", help="arquivo SQLite")
+    parser.add_argument("--processos", type=int, default=None, help="processos do pool (padrão: núcleos)")
+    parser.add_argument("--bloco", type=int, default=1024, help="usuários por bloco")
+    parser.add_argument("--vizinhos", type=int, default=20, help="vizinhos, contando o próprio usuário")
+    parser.add_argument("--quantidade", type=int, default=10, help="recomendações por usuário")
+    parser.add_argument("--verificar", type=int, default=0,
+                        help="compara N usuários sorteados com o modelo KNN ao vivo depois do job")
+    args = parser.parse_args()
+
+    estatisticas = gerar_recomendacoes(
+        criar_engine(args.banco), processos=args.processos,
+        tamanho_bloco=args.bloco, n_vizinhos=args.vizinhos, quantidade=args.quantidade,
+    )
+    print("\n=== RECOMENDAÇÕES EM LOTE ===")
+    print(f"Usuários: {estatisticas['usuarios']}")
+    print(f"Recomendações gravadas: {estatisticas['recomendacoes']}")
+    print(f"Tempo: {estatisticas['segundos']:.2f} s ({estatisticas['usuarios_por_segundo']:.0f} usuários/s)")
+    if estatisticas['pico_memoria_mb'] is not None:
+        print(f"Pico de memória: {estatisticas['pico_memoria_mb']:.0f} MB (workers: {estatisticas['pico_memoria_workers_mb']:.0f} MB)")
+    print(f"Versão do modelo: {estatisticas['versao_modelo']}")
+    print("==============================\n")
+
+    if args.verificar:
+        comparacao = comparar_com_modelo(criar_engine(args.banco), args.verificar, args.vizinhos)
+        print(f"Verificação: {comparacao['listas_iguais']}/{comparacao['usuarios']} listas iguais às do modelo, "
+              f"sobreposição média {comparacao['sobreposicao_media']:.3f}")
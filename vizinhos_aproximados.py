@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import argparse
+import time
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:  # scipy.sparse só aparece nas anotações
+    from scipy.sparse import csr_matrix
+
+
+def selecionar_vizinhos(linhas: np.ndarray, similaridades: np.ndarray, n_vizinhos: int,
+                        n_usuarios: int) -> tuple[np.ndarray, np.ndarray]:
+    """Retorna (linhas, similaridades) dos n_vizinhos usuários mais similares, do mais ao menos similar.
+
+    Recebe só as entradas não nulas de uma linha de similaridade cosseno
+    (com notas positivas ela nunca é negativa). O resultado é o de ordenar
+    todos os `n_usuarios` por similaridade decrescente e linha crescente:
+    empates ficam com a menor linha e, se houver menos de n_vizinhos
+    similaridades positivas, a lista é completada com os usuários de
+    similaridade 0 de menor linha. BuscaBruta e recomendacoes_lote usam
+    esta mesma escolha.
+    """
+    linhas = np.asarray(linhas, dtype=np.int64)
+    similaridades = np.asarray(similaridades)
+    n_vizinhos = min(n_vizinhos, n_usuarios)
+    if n_vizinhos <= 0:
+        return np.empty(0, dtype=np.int64), similaridades[:0]
+    if len(linhas) > n_vizinhos:
+        limite = np.partition(similaridades, len(similaridades) - n_vizinhos)[len(similaridades) - n_vizinhos]
+        acima = np.flatnonzero(similaridades > limite)
+        empatados = np.flatnonzero(similaridades == limite)
+        empatados = empatados[np.argsort(linhas[empatados], kind='stable')][:n_vizinhos - len(acima)]
+        escolhidos = np.concatenate([acima, empatados])
+        linhas, similaridades = linhas[escolhidos], similaridades[escolhidos]
+    elif len(linhas) < n_vizinhos:
+        # entre as primeiras (faltam + positivos) linhas há ao menos `faltam` sem similaridade
+        faltam = n_vizinhos - len(linhas)
+        zeros = np.arange(min(n_usuarios, faltam + len(linhas)))
+        zeros = zeros[~np.isin(zeros, linhas)][:faltam]
+        linhas = np.concatenate([linhas, zeros])
+        similaridades = np.concatenate([similaridades, np.zeros(len(zeros), dtype=similaridades.dtype)])
+    ordem = np.lexsort((linhas, -similaridades))
+    return linhas[ordem], similaridades[ordem]
+
+
+class BuscaBruta:
+    """Busca exata por distância cosseno (referência para os motores aproximados).
+
+    A similaridade da consulta com todos os usuários é um produto esparso
+    sobre as linhas normalizadas e a escolha é a de selecionar_vizinhos,
+    determinística (empates pela menor linha).
+    """
+
+    def __init__(self):
+        self.normalizada = None
+
+    def treinar(self, matriz: csr_matrix):
+        from sklearn.preprocessing import normalize  # scikit-learn só é carregado ao treinar o motor
+
+        self.normalizada = normalize(matriz, norm='l2', axis=1)
+        return self
+
+    def consultar(self, linha: csr_matrix, n_vizinhos: int) -> tuple[np.ndarray, np.ndarray]:
+        """Retorna (distâncias cosseno, linhas) dos n_vizinhos mais próximos, do mais perto ao mais longe."""
+        from sklearn.preprocessing import normalize
+
+        similaridade = (self.normalizada @ normalize(linha, norm='l2', axis=1).T).tocsc()
+        linhas, similaridades = selecionar_vizinhos(similaridade.indices, similaridade.data, n_vizinhos,
+                                                    self.normalizada.shape[0])
+        # em float64, 1 - (1 - s) devolve exatamente a similaridade s
+        return 1.0 - similaridades.astype(np.float64), linhas
+
+
+class BuscaLSH:
+    """Busca aproximada por distância cosseno com LSH de hiperplanos aleatórios.
+
+    Cada uma das `n_tabelas` tabelas agrupa os usuários pelo sinal da
+    projeção em `n_planos` hiperplanos aleatórios; na consulta, o balde do
+    usuário e mais `n_sondas` baldes vizinhos (o bit de projeção mais
+    incerto invertido) são visitados e os candidatos ordenados pela
+    distância exata. Mais tabelas e sondas aumentam o recall; mais planos
+    deixam os baldes menores e a consulta mais rápida. Sem `n_planos`, o
+    número de planos é escolhido para que cada balde tenha em média
+    `tamanho_balde` usuários.
+
+    Nas bases sintéticas (~9 avaliações por usuário), o LSH não compensa:
+    na "grande" (111 mil usuários), 8 tabelas com 8 planos e 4 sondas
+    examinam 15% dos usuários e acham 32% dos 20 vizinhos exatos, e o
+    recall só passa de 0,9 quando os candidatos passam de 90%, mais lento
+    que a busca bruta (~8 ms). Meça com `python vizinhos_aproximados.py
+    --escala grande --planos 6 8 11 --sondas 0 4` antes de trocar o motor.
+    """
+
+    def __init__(self, n_tabelas: int = 8, n_planos: int = None, n_sondas: int = 1,
+                 tamanho_balde: int = 50, semente: int = 0):
+        if n_planos is not None and not 1 <= n_planos <= 62:
+            raise ValueError("n_planos deve estar entre 1 e 62")
+        self.n_tabelas = n_tabelas
+        self.n_planos_fixo = n_planos
+        self.n_planos = n_planos
+        self.n_sondas = n_sondas
+        self.tamanho_balde = tamanho_balde
+        self.semente = semente
+
+        self.planos = []       # matriz (produtores × n_planos) de cada tabela
+        self.ordens = []       # linhas ordenadas pelo código de cada tabela
+        self.codigos = []      # códigos ordenados de cada tabela
+        self.normalizada = None
+        self._pesos_bits = None
+        self.candidatos_ultima_consulta = 0  # usuários comparados pela distância exata
+
+    def treinar(self, matriz: csr_matrix):
+        from sklearn.preprocessing import normalize
+
+        rng = np.random.default_rng(self.semente)
+        self.n_planos = self.n_planos_fixo or int(np.clip(
+            np.round(np.log2(max(matriz.shape[0], 1) / self.tamanho_balde)), 1, 62))
+        self._pesos_bits = 1 << np.arange(self.n_planos, dtype=np.int64)
+        self.normalizada = normalize(matriz, norm='l2', axis=1).astype(np.float32)
+        self.planos, self.ordens, self.codigos = [], [], []
+
+        for _ in range(self.n_tabelas):
+            planos = rng.standard_normal((matriz.shape[1], self.n_planos)).astype(np.float32)
+            codigos = self._codificar(np.asarray(self.normalizada @ planos))
+            ordem = np.argsort(codigos, kind='stable')
+            self.planos.append(planos)
+            self.ordens.append(ordem)
+            self.codigos.append(codigos[ordem])
+        return self
+
+    def consultar(self, linha: csr_matrix, n_vizinhos: int) -> tuple[np.ndarray, np.ndarray]:
+        """Retorna (distâncias cosseno, linhas) dos vizinhos encontrados, do mais perto ao mais longe."""
+        from sklearn.preprocessing import normalize
+
+        consulta = normalize(linha, norm='l2', axis=1).astype(np.float32)
+
+        candidatos = []
+        for planos, ordem, codigos in zip(self.planos, self.ordens, self.codigos):
+            projecao = np.asarray(consulta @ planos)[0]
+            codigo = int(self._codificar(projecao[None, :])[0])
+
+            # balde principal e baldes vizinhos, invertendo os bits menos confiáveis
+            sondas = [codigo] + [codigo ^ (1 << int(bit))
+                                 for bit in np.argsort(np.abs(projecao))[:min(self.n_sondas, self.n_planos)]]
+            for sonda in sondas:
+                inicio = np.searchsorted(codigos, sonda, side='left')
+                fim = np.searchsorted(codigos, sonda, side='right')
+                candidatos.append(ordem[inicio:fim])
+
+        candidatos = np.unique(np.concatenate(candidatos)) if candidatos else np.empty(0, dtype=np.int64)
+        self.candidatos_ultima_consulta = candidatos.size
+        if candidatos.size == 0:
+            return np.empty(0), np.empty(0, dtype=np.int64)
+
+        # distância exata apenas para os candidatos
+        similaridades = np.asarray((self.normalizada[candidatos] @ consulta.T).todense()).ravel()
+        distancias = 1.0 - similaridades
+        ordem = np.lexsort((candidatos, distancias))[:n_vizinhos]
+        return distancias[ordem], candidatos[ordem]
+
+    def _codificar(self, projecoes: np.ndarray) -> np.ndarray:
+        """Converte o sinal das projeções em um inteiro por linha."""
+        return ((projecoes > 0) * self._pesos_bits).sum(axis=1)
+
+
+# Motores disponíveis para o passo de vizinhos do recomendador
+MOTORES = {
+    "bruta": BuscaBruta,
+    "lsh": BuscaLSH,
+}
+
+def criar_busca(nome: str = "bruta", **parametros):
+    """Cria um motor de busca de vizinhos pelo nome (ver MOTORES)."""
+    if nome not in MOTORES:
+        raise ValueError(f"Motor de vizinhos desconhecido: {nome}. Use um de {list(MOTORES)}")
+    return MOTORES[nome](**parametros)
+
+
+# ================= avaliação de recall =================
+def avaliar_recall(matriz: csr_matrix, busca, k: int = 20, amostra: int = 200,
+                   semente: int = 0, exata: BuscaBruta = None) -> dict:
+    """Mede o recall@k de um motor aproximado contra a busca bruta em uma amostra de usuários.
+
+    Um vizinho devolvido conta como acerto se sua distância não for maior
+    que a do k-ésimo vizinho exato, para que empates não sejam punidos.
+    Em bases pequenas o LSH automático usa poucos planos e compara quase
+    todos os usuários, então o recall só diz algo junto da fração de
+    candidatos examinados (`candidatos_por_consulta`).
+    """
+    rng = np.random.default_rng(semente)
+    linhas = rng.choice(matriz.shape[0], size=min(amostra, matriz.shape[0]), replace=False)
+    exata = exata or BuscaBruta().treinar(matriz)
+    k = min(k, matriz.shape[0])
+
+    acertos, candidatos, tempo_exato, tempo_aproximado = 0, 0, 0.0, 0.0
+    for linha in linhas:
+        inicio = time.perf_counter()
+        distancias_exatas, _ = exata.consultar(matriz[linha], k)
+        tempo_exato += time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        distancias, _ = busca.consultar(matriz[linha], k)
+        tempo_aproximado += time.perf_counter() - inicio
+
+        acertos += int(np.sum(distancias <= distancias_exatas[-1] + 1e-6))
+        candidatos += getattr(busca, "candidatos_ultima_consulta", matriz.shape[0])
+
+    return {
+        f"recall@{k}": acertos / (k * len(linhas)),
+        "candidatos_por_consulta": candidatos / len(linhas),
+        "ms_por_consulta_exata": 1000 * tempo_exato / len(linhas),
+        "ms_por_consulta_aproximada": 1000 * tempo_aproximado / len(linhas),
+    }
+
+
+if __name__ == "__main__":
+    from db import criar_engine
+    from recomendacao import MatrizAvaliacoes, carregar_avaliacoes
+    from sqlalchemy.orm import Session
+
+    parser = argparse.ArgumentParser(description="Mede o recall@k do LSH contra a busca bruta.")
+    parser.add_argument("--banco", default="db.db", help="arquivo SQLite (ignorado com --escala)")
+    parser.add_argument("--escala", choices=["pequena", "media", "grande"],
+                        help="base sintética do benchmark.py (gerada na primeira vez em --dados)")
+    parser.add_argument("--dados", default=".benchmark", help="pasta das bases sintéticas")
+    parser.add_argument("--tabelas", type=int, default=8)
+    parser.add_argument("--planos", type=int, nargs="+", default=[None],
+                        help="um ou mais valores fixos; padrão: automático pelo tamanho do balde")
+    parser.add_argument("--sondas", type=int, nargs="+", default=[1])
+    parser.add_argument("--amostra", type=int, default=200)
+    parser.add_argument("-k", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.escala:
+        from benchmark import preparar_base
+        args.banco = preparar_base(args.escala, args.dados)
+    with Session(criar_engine(args.banco)) as session:
+        avaliacoes = MatrizAvaliacoes(*carregar_avaliacoes(session))
+
+    matriz = avaliacoes.matriz
+    exata = BuscaBruta().treinar(matriz)
+    print(f"{matriz.shape[0]} usuários, {matriz.shape[1]} produtores, {matriz.nnz} avaliações")
+    print(f"{'planos':>6} {'sondas':>6} {f'recall@{args.k}':>10} {'candidatos':>11} "
+          f"{'ms bruta':>9} {'ms lsh':>7}")
+    for n_planos in args.planos:
+        for n_sondas in args.sondas:
+            busca = BuscaLSH(args.tabelas, n_planos, n_sondas).treinar(matriz)
+            resultado = avaliar_recall(matriz, busca, k=args.k, amostra=args.amostra, exata=exata)
+            print(f"{busca.n_planos:>6} {n_sondas:>6} {resultado[f'recall@{min(args.k, matriz.shape[0])}']:>10.4f} "
+                  f"{resultado['candidatos_por_consulta'] / matriz.shape[0]:>10.1%} "
+                  f"{resultado['ms_por_consulta_exata']:>9.2f} {resultado['ms_por_consulta_aproximada']:>7.2f}")